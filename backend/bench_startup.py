@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark for the backend.
+
+Measures, in fresh interpreters:
+  - import time of main.py
+  - time-to-first-request: uvicorn spawn -> first 200 from /health
+  - time-to-ready: uvicorn spawn -> first 200 from /ready (MQTT + OpenAI client)
+for LAZY_INIT=true and LAZY_INIT=false, and prints the /startup profile of each run.
+
+Usage (from the backend directory):
+    python bench_startup.py [--runs 3] [--ready-timeout 20]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _env(lazy: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-bench")  # main.py refuses to import without a key
+    env["LAZY_INIT"] = "true" if lazy else "false"
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except Exception:
+        return None, None
+
+def measure_import(lazy: bool) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=_env(lazy),
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def measure_serve(lazy: bool, ready_timeout: float) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=_env(lazy), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"first_request_sec": None, "ready_sec": None, "profile": None}
+    try:
+        while time.perf_counter() - t0 < 30:
+            status, _ = _get(base + "/health")
+            if status == 200:
+                result["first_request_sec"] = time.perf_counter() - t0
+                break
+            time.sleep(0.01)
+        while result["first_request_sec"] and time.perf_counter() - t0 < ready_timeout:
+            status, _ = _get(base + "/ready")
+            if status == 200:
+                result["ready_sec"] = time.perf_counter() - t0
+                break
+            time.sleep(0.05)
+        status, body = _get(base + "/startup")
+        if status == 200:
+            result["profile"] = json.loads(body)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+def _fmt(values: list) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return "n/a"
+    return f"{statistics.median(values) * 1000:8.1f} ms (min {min(values) * 1000:.1f})"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--ready-timeout", type=float, default=20.0)
+    args = parser.parse_args()
+
+    for lazy in (True, False):
+        mode = "lazy" if lazy else "eager"
+        imports = [measure_import(lazy) for _ in range(args.runs)]
+        serves = [measure_serve(lazy, args.ready_timeout) for _ in range(args.runs)]
+        print(f"[BENCH] mode={mode}")
+        print(f"  import main.py      : {_fmt(imports)}")
+        print(f"  first /health 200   : {_fmt([r['first_request_sec'] for r in serves])}")
+        print(f"  first /ready 200    : {_fmt([r['ready_sec'] for r in serves])}")
+        print(f"  startup profile     : {serves[-1]['profile']}")
+
+if __name__ == "__main__":
+    main()
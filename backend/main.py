@@ -1,23 +1,30 @@
+import time
+_PROCESS_T0 = time.perf_counter()  # reference point for the startup profile
+
 import json
 import uuid
 import asyncio
-import time
 import os
+import hashlib
+import hmac
+import importlib
+import random
+import socket
+import sys
+import gzip
+import itertools
+import queue
+import threading
+from collections import OrderedDict, Counter, deque
 from typing import Tuple, List
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
-from gtts import gTTS
-import paho.mqtt.publish as mqtt_publish
-import paho.mqtt.client as mqtt
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 
-# --- Optional: For POST requests ---
-try:
-    import httpx
-except Exception:
-    httpx = None
+# Heavy clients (openai, gtts, paho, httpx, redis) are imported on first use or by the
+# background warm-up, so the app can serve /health before they are loaded.
 
 # --- Additional imports ---
 import tempfile
@@ -36,7 +43,10 @@ if not OPENAI_API_KEY:
     )
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+# LAZY_INIT=true: build heavy clients in background tasks after the app starts serving.
+# LAZY_INIT=false: build them inside lifespan before the first request (previous behaviour).
+LAZY_INIT = os.getenv("LAZY_INIT", "true").lower() == "true"
 
 MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.emqx.io")
 MQTT_PORT   = int(os.getenv("MQTT_PORT", "1883"))
@@ -46,10 +56,46 @@ MQTT_USE_SSL = os.getenv("MQTT_USE_SSL", "false").lower() == "true"  # Set to "t
 MQTT_PUB_TOPIC   = os.getenv("MQTT_PUB_TOPIC", "robot/events")
 MQTT_REPLY_TOPIC = os.getenv("MQTT_REPLY_TOPIC", "robot/reply")
 MQTT_SUB_TOPICS  = [("robot/notify", 0)]
+# Shared subscription group: with several workers each notify goes to exactly one of them
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "")
+
+# De-duplication windows (seconds) and seen-set bound
+DEDUP_WINDOW_SEC   = float(os.getenv("DEDUP_WINDOW_SEC", "10"))
+ACTION_DEDUP_SEC   = float(os.getenv("ACTION_DEDUP_SEC", "30"))
+DEDUP_MAX_KEYS     = int(os.getenv("DEDUP_MAX_KEYS", "1024"))
+
+# ========= Startup Profile =========
+STARTUP_PROFILE = {"mode": "lazy" if LAZY_INIT else "eager"}
+
+def mark_startup(phase: str):
+    """Record seconds since process import for a startup phase (first occurrence only)"""
+    STARTUP_PROFILE.setdefault(phase, round(time.perf_counter() - _PROCESS_T0, 3))
+
+# ========= Lazy Clients =========
+_openai_client = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    """OpenAI client, imported and built on first use (thread-safe)"""
+    global _openai_client
+    if _openai_client is None:
+        with _client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=OPENAI_API_KEY)
+                mark_startup("openai_ready")
+    return _openai_client
+
+def warm_up_clients():
+    """Import the remaining heavy modules so the first real request does not pay for them"""
+    get_openai_client()
+    import gtts  # noqa: F401
+    mark_startup("gtts_ready")
 
 # Helper function for MQTT publish with authentication and SSL
 def mqtt_publish_single(topic: str, payload: str, hostname: str):
     """Publish a single MQTT message with authentication and SSL support"""
+    import paho.mqtt.publish as mqtt_publish
     auth = None
     if MQTT_USERNAME and MQTT_PASSWORD:
         auth = {'username': MQTT_USERNAME, 'password': MQTT_PASSWORD}
@@ -102,16 +148,43 @@ SYSTEM_PROMPT = (
 async def lifespan(app: FastAPI):
     """Modern FastAPI lifespan event handler"""
     # Startup
-    global MAIN_LOOP
+    global MAIN_LOOP, ready_outbox
+    mark_startup("lifespan_start")
     MAIN_LOOP = asyncio.get_running_loop()
-    connect_mqtt(CURRENT_MQTT_BROKER)
+    await state_store.start(on_worker_message)
+    # Pick up default robot / broker changes made through another worker before this one started
+    await apply_runtime_config(await state_store.load_config(), reconnect=False)
+    if OCR_POST_URL:
+        ready_outbox = ReadyOutbox(OCR_POST_URL)
+        ready_outbox.start()
+    background_tasks.add(asyncio.create_task(websocket_heartbeat()))
+    background_tasks.add(asyncio.create_task(loop_lag_monitor.run()))
+    if LAZY_INIT:
+        # Serve /health immediately; MQTT connect and client imports run in the background
+        background_tasks.add(asyncio.create_task(asyncio.to_thread(connect_mqtt, CURRENT_MQTT_BROKER)))
+        background_tasks.add(asyncio.create_task(asyncio.to_thread(warm_up_clients)))
+        background_tasks.add(asyncio.create_task(get_http_client()))
+    else:
+        connect_mqtt(CURRENT_MQTT_BROKER)
+        warm_up_clients()
+        await get_http_client()
+    mark_startup("serving")
     yield
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    if ready_outbox:
+        await ready_outbox.close()
+    if http_client:
+        await http_client.aclose()
     global mqtt_client
     if mqtt_client:
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
         print("[MQTT] Disconnected")
+    await state_store.close()
+    if traffic_capture:
+        traffic_capture.close()
 
 # ========= FastAPI =========
 app = FastAPI(lifespan=lifespan)
@@ -127,6 +200,7 @@ app.add_middleware(
 # ========= MQTT Status =========
 mqtt_client = None
 MAIN_LOOP: asyncio.AbstractEventLoop | None = None
+background_tasks = set()
 CURRENT_MQTT_BROKER = MQTT_BROKER
 
 # ========= Robot Management =========
@@ -136,10 +210,305 @@ DEFAULT_ROBOT_ID = os.getenv("DEFAULT_ROBOT_ID", "wro1")
 websocket_robot_map = {}
 
 # ========= AI Conversation =========
-mqtt_conversation = [{"role": "system", "content": SYSTEM_PROMPT}]
 connected_websockets = set()
 conversations = {}
 
+# ========= Idempotency / De-duplication =========
+class DedupWindow:
+    """
+    Bounded, time-windowed seen-set of idempotency keys.
+    Thread-safe: checked from paho's network thread and from the event loop.
+    """
+    def __init__(self, name: str, window_sec: float, max_keys: int = DEDUP_MAX_KEYS):
+        self.name = name
+        self.window_sec = window_sec
+        self.max_keys = max_keys
+        self._seen = OrderedDict()  # key -> first-seen time (oldest first)
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.suppressed = 0
+        self.evicted = 0
+
+    def _expire(self, now: float):
+        while self._seen:
+            key, first_seen = next(iter(self._seen.items()))
+            if now - first_seen < self.window_sec and len(self._seen) <= self.max_keys:
+                break
+            self._seen.popitem(last=False)
+            if now - first_seen < self.window_sec:
+                self.evicted += 1
+
+    def check_and_mark(self, key: str) -> bool:
+        """Return True the first time a key is seen inside the window, False for a duplicate"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                self.suppressed += 1
+                return False
+            self._seen[key] = now
+            self.accepted += 1
+            self._expire(now)
+            return True
+
+    def note_suppressed(self):
+        """Count a duplicate caught outside this window (e.g. already claimed by another worker)"""
+        with self._lock:
+            self.suppressed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_sec": self.window_sec,
+                "tracked_keys": len(self._seen),
+                "accepted": self.accepted,
+                "suppressed": self.suppressed,
+                "evicted": self.evicted,
+            }
+
+inbound_dedup = DedupWindow("mqtt_ingress", DEDUP_WINDOW_SEC)
+action_dedup = DedupWindow("outbound_actions", ACTION_DEDUP_SEC)
+
+def event_idempotency_key(topic: str, raw_payload: str) -> str:
+    """
+    Idempotency key for an inbound event.
+    Uses the producer's explicit event_id when present: it names the physical event
+    (the EV3 sends boot id + event + per-boot sequence number) and is reused when the
+    producer re-sends it. Otherwise a digest of topic + payload, which catches
+    re-deliveries of the same bytes.
+    """
+    try:
+        obj = json.loads(raw_payload)
+    except Exception:
+        obj = None
+    if isinstance(obj, dict) and obj.get("event_id"):
+        return f"{topic}|{obj.get('robot_id')}|{obj.get('event_id')}"
+    return hashlib.sha1(f"{topic}|{raw_payload}".encode("utf-8")).hexdigest()
+
+# ========= Shared State (multi-worker) =========
+# WebSocket objects always live in the worker that accepted them; what is shared
+# between workers is which worker owns sockets for a robot, the MQTT conversation
+# and claimed event keys. Replies for sockets on another worker are routed to it.
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+REDIS_URL = os.getenv("REDIS_URL")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "xiaoka")
+WORKER_TTL_SEC = 30
+MQTT_HISTORY_KEY = "mqtt"
+
+class InMemoryStateStore:
+    """Process-local state store: the default for a single uvicorn worker"""
+    def __init__(self):
+        self._robot_sockets = {}  # robot_id -> number of local sockets
+        self._conversations = {}  # key -> list of non-system messages
+        self._config = {}
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+
+    async def close(self):
+        pass
+
+    async def load_config(self) -> dict:
+        return dict(self._config)
+
+    async def save_config(self, values: dict):
+        self._config.update(values)
+
+    async def add_robot_socket(self, robot_id: str):
+        self._robot_sockets[robot_id] = self._robot_sockets.get(robot_id, 0) + 1
+
+    async def remove_robot_socket(self, robot_id: str):
+        count = self._robot_sockets.get(robot_id, 0) - 1
+        if count > 0:
+            self._robot_sockets[robot_id] = count
+        else:
+            self._robot_sockets.pop(robot_id, None)
+
+    async def robot_workers(self, robot_id: str | None) -> set:
+        """Workers owning sockets for robot_id (robot_id=None: every live worker)"""
+        if robot_id is None or robot_id in self._robot_sockets:
+            return {WORKER_ID}
+        return set()
+
+    async def load_conversation(self, key: str) -> list:
+        return list(self._conversations.get(key, []))
+
+    async def append_conversation(self, key: str, messages: list, max_messages: int = 99):
+        conv = self._conversations.setdefault(key, [])
+        conv.extend(messages)
+        del conv[:-max_messages]
+
+    async def claim_event(self, key: str, ttl_sec: float) -> bool:
+        # Single worker: the local DedupWindow in on_message is authoritative
+        return True
+
+    async def send_to_worker(self, worker_id: str, message: dict):
+        if self._handler:
+            await self._handler(message)
+
+    def describe(self) -> dict:
+        return {"backend": "memory", "worker_id": WORKER_ID}
+
+class RedisStateStore:
+    """
+    Networked state store shared by all workers (REDIS_URL).
+    Any Redis-protocol server works, so a local redis-server or an in-process
+    fake client can stand in for the hosted instance.
+    """
+    def __init__(self, url: str = None, redis_client=None):
+        if redis_client is None:
+            try:
+                import redis.asyncio as aioredis
+            except Exception:
+                raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+            redis_client = aioredis.from_url(url, decode_responses=True)
+        self.redis = redis_client
+        self._local_robots = {}  # robot_id -> number of local sockets (for cleanup)
+        self._pubsub = None
+        self._listening = False  # heartbeat only while the worker channel is subscribed
+        self._tasks = []
+        self._handler = None
+
+    def _key(self, *parts) -> str:
+        return ":".join((STATE_KEY_PREFIX,) + parts)
+
+    async def start(self, handler):
+        self._handler = handler
+        await self._subscribe()
+        await self._heartbeat_once()
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._heartbeat())]
+        print(f"[STATE] Redis state store ready (worker {WORKER_ID})")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for robot_id in self._local_robots:
+            await self.redis.hdel(self._key("robot", robot_id), WORKER_ID)
+        await self.redis.srem(self._key("workers"), WORKER_ID)
+        await self.redis.delete(self._key("alive", WORKER_ID))
+        if self._pubsub:
+            await self._pubsub.close()
+        await self.redis.close()
+
+    async def load_config(self) -> dict:
+        return await self.redis.hgetall(self._key("config"))
+
+    async def save_config(self, values: dict):
+        await self.redis.hset(self._key("config"), mapping=values)
+
+    async def _heartbeat_once(self):
+        await self.redis.sadd(self._key("workers"), WORKER_ID)
+        await self.redis.set(self._key("alive", WORKER_ID), "1", ex=WORKER_TTL_SEC)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WORKER_TTL_SEC / 3)
+            if not self._listening:
+                # Let the alive key expire so other workers stop routing replies here
+                continue
+            try:
+                await self._heartbeat_once()
+            except Exception as e:
+                print(f"[STATE] heartbeat error: {e}")
+
+    async def _subscribe(self):
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self._key("worker", WORKER_ID))
+        self._listening = True
+
+    async def _listen(self):
+        backoff = 1.0
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    await self._heartbeat_once()
+                    print(f"[STATE] Worker channel resubscribed (worker {WORKER_ID})")
+                async for msg in self._pubsub.listen():
+                    backoff = 1.0
+                    if msg.get("type") != "message":
+                        continue
+                    try:
+                        await self._handler(json.loads(msg["data"]))
+                    except Exception as e:
+                        print(f"[STATE] worker message error: {e}")
+                raise ConnectionError("pub/sub stream ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._listening = False
+                print(f"[STATE] worker channel error: {e}; resubscribing in {backoff:.0f}s")
+                if self._pubsub is not None:
+                    try:
+                        await self._pubsub.close()
+                    except Exception:
+                        pass
+                    self._pubsub = None
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, WORKER_TTL_SEC / 3)
+
+    async def add_robot_socket(self, robot_id: str):
+        self._local_robots[robot_id] = self._local_robots.get(robot_id, 0) + 1
+        await self.redis.hset(self._key("robot", robot_id), WORKER_ID, self._local_robots[robot_id])
+
+    async def remove_robot_socket(self, robot_id: str):
+        count = self._local_robots.get(robot_id, 0) - 1
+        if count > 0:
+            self._local_robots[robot_id] = count
+            await self.redis.hset(self._key("robot", robot_id), WORKER_ID, count)
+        else:
+            self._local_robots.pop(robot_id, None)
+            await self.redis.hdel(self._key("robot", robot_id), WORKER_ID)
+
+    async def robot_workers(self, robot_id: str | None) -> set:
+        if robot_id is None:
+            candidates = list(await self.redis.smembers(self._key("workers")))
+        else:
+            candidates = list(await self.redis.hkeys(self._key("robot", robot_id)))
+        if not candidates:
+            return set()
+        pipe = self.redis.pipeline()
+        for worker_id in candidates:
+            pipe.exists(self._key("alive", worker_id))
+        alive = await pipe.execute()
+        return {w for w, ok in zip(candidates, alive) if ok}
+
+    async def load_conversation(self, key: str) -> list:
+        raw = await self.redis.lrange(self._key("conv", key), 0, -1)
+        return [json.loads(item) for item in raw]
+
+    async def append_conversation(self, key: str, messages: list, max_messages: int = 99):
+        conv_key = self._key("conv", key)
+        pipe = self.redis.pipeline()
+        pipe.rpush(conv_key, *[json.dumps(m, ensure_ascii=False) for m in messages])
+        pipe.ltrim(conv_key, -max_messages, -1)
+        await pipe.execute()
+
+    async def claim_event(self, key: str, ttl_sec: float) -> bool:
+        """SET NX across workers, so each event is handled by exactly one of them"""
+        return bool(await self.redis.set(self._key("event", key), WORKER_ID, nx=True, ex=max(1, int(ttl_sec))))
+
+    async def send_to_worker(self, worker_id: str, message: dict):
+        await self.redis.publish(self._key("worker", worker_id), json.dumps(message, ensure_ascii=False))
+
+    def describe(self) -> dict:
+        return {"backend": "redis", "worker_id": WORKER_ID}
+
+def make_state_store():
+    if REDIS_URL:
+        return RedisStateStore(REDIS_URL)
+    return InMemoryStateStore()
+
+state_store = make_state_store()
+
+async def load_mqtt_conversation() -> list:
+    """Shared MQTT conversation with the system prompt prepended"""
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + await state_store.load_conversation(MQTT_HISTORY_KEY)
+
+async def record_mqtt_exchange(*messages):
+    await state_store.append_conversation(MQTT_HISTORY_KEY, list(messages), max_messages=99)
+
 def trim_history(conv: list, max_messages: int = 100):
     if len(conv) <= max_messages:
         return
@@ -160,7 +529,7 @@ def get_gpt_response(conversation_history, max_tokens=100):
     - Short responses: 100 tokens (default)
     - Long-form content: up to 500 tokens for stories, explanations
     """
-    completion = client.chat.completions.create(
+    completion = get_openai_client().chat.completions.create(
         model=OPENAI_MODEL,
         messages=conversation_history,
         temperature=0.7,  # Lower temperature for faster, more consistent responses
@@ -187,6 +556,7 @@ async def broadcast_audio_bytes(audio_bytes: bytes):
             await ws.send_bytes(audio_bytes)
         except Exception as e:
             print(f"WebSocket send failed: {e}")
+            await reap_websocket(ws, "send_failed")
 
 async def synthesize_and_broadcast_tts(text: str, lang: str = None):
     """Fast TTS using in-memory processing (no file I/O)"""
@@ -205,6 +575,7 @@ async def synthesize_and_broadcast_tts(text: str, lang: str = None):
         print(f"[TTS] Synthesizing: '{text[:50]}...' in {tts_lang}")
         
         # Create TTS and save to memory (BytesIO) instead of file
+        from gtts import gTTS
         tts = gTTS(text=text, lang=tts_lang, slow=False, tld='com')
         audio_buffer = BytesIO()
         tts.write_to_fp(audio_buffer)
@@ -231,24 +602,158 @@ def detect_language(text: str):
     else:
         return "english"
 
-# ========= ready → POST =========
-async def _post_when_ready(payload: dict):
-    url = os.getenv("OCR_POST_URL")
-    if not url:
-        return
-    if httpx is None:
-        print("[READY-POST] httpx not installed; skip POST")
-        return
-    try:
-        async with httpx.AsyncClient(timeout=10) as cli:
-            resp = await cli.post(url, json=payload)
-            print(f"[READY-POST] {url} -> {resp.status_code}")
-    except Exception as e:
-        print(f"[READY-POST] error: {e}")
+# ========= ready → POST (pooled client + outbox) =========
+OCR_POST_URL = os.getenv("OCR_POST_URL")
+READY_POST_TIMEOUT     = float(os.getenv("READY_POST_TIMEOUT", "10"))
+READY_POST_MAX_RETRIES = int(os.getenv("READY_POST_MAX_RETRIES", "3"))
+READY_POST_BACKOFF_SEC = float(os.getenv("READY_POST_BACKOFF_SEC", "0.5"))
+READY_POST_LINGER_SEC  = float(os.getenv("READY_POST_LINGER_SEC", "0.2"))  # coalescing window
+READY_POST_FLUSH_SEC   = float(os.getenv("READY_POST_FLUSH_SEC", "5"))     # shutdown flush budget
+
+# Application-scoped pooled HTTP client (built once, reused for every POST)
+http_client = None
+_http_client_lock = asyncio.Lock()
+
+async def get_http_client():
+    """Shared httpx.AsyncClient, imported and built on first use; None if httpx is missing"""
+    global http_client
+    async with _http_client_lock:
+        if http_client is None:
+            try:
+                httpx = await asyncio.to_thread(importlib.import_module, "httpx")
+            except Exception:
+                print("[READY-POST] httpx not installed; ready POSTs disabled")
+                return None
+            # Built off-loop: creating the SSL context blocks for a few hundred ms
+            http_client = await asyncio.to_thread(
+                httpx.AsyncClient,
+                timeout=READY_POST_TIMEOUT,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+            mark_startup("http_ready")
+    return http_client
 
-async def on_ready_side_effects():
+class ReadyOutbox:
+    """
+    Queue of outgoing ready events for OCR_POST_URL.
+    Events of the same type for the same robot that arrive inside READY_POST_LINGER_SEC
+    are coalesced into one POST (latest payload, which carries robot_id, + "coalesced"
+    count); other robots keep their own POST. Failed POSTs are retried with jittered
+    exponential backoff.
+    """
+    def __init__(self, url: str):
+        self.url = url
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+        self.delivered = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.last_latency_ms = None
+        self.max_latency_ms = 0.0
+        self._latency_total_ms = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def enqueue(self, payload: dict):
+        self.queue.put_nowait((time.monotonic(), payload))
+
+    async def _run(self):
+        closing = False
+        while not closing:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            await asyncio.sleep(READY_POST_LINGER_SEC)
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    closing = True
+                    continue
+                batch.append(item)
+            await self._deliver_batch(batch)
+
+    async def _deliver_batch(self, batch: list):
+        # Coalesce by (event type, robot), keeping the newest payload and oldest enqueue time
+        merged = {}
+        for enqueued_at, payload in batch:
+            key = (payload.get("event"), payload.get("robot_id"))
+            if key in merged:
+                first_at, _, count = merged[key]
+                merged[key] = (first_at, payload, count + 1)
+            else:
+                merged[key] = (enqueued_at, payload, 1)
+        for enqueued_at, payload, count in merged.values():
+            if count > 1:
+                self.coalesced += count - 1
+                payload = dict(payload, coalesced=count)
+            await self._post_with_retry(payload, enqueued_at)
+
+    async def _post_with_retry(self, payload: dict, enqueued_at: float):
+        for attempt in range(READY_POST_MAX_RETRIES + 1):
+            try:
+                cli = await get_http_client()
+                if cli is None:
+                    self.failed += 1
+                    return
+                resp = await cli.post(self.url, json=payload)
+                if resp.status_code < 500 and resp.status_code != 429:
+                    self._record_latency(enqueued_at)
+                    self.delivered += 1
+                    print(f"[READY-POST] {self.url} -> {resp.status_code}")
+                    return
+                error = f"HTTP {resp.status_code}"
+            except Exception as e:
+                error = str(e)
+            if attempt < READY_POST_MAX_RETRIES:
+                self.retries += 1
+                delay = random.uniform(0, READY_POST_BACKOFF_SEC * (2 ** attempt))
+                print(f"[READY-POST] attempt {attempt + 1} failed ({error}); retry in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.failed += 1
+                print(f"[READY-POST] giving up after {attempt + 1} attempts: {error}")
+
+    def _record_latency(self, enqueued_at: float):
+        latency_ms = (time.monotonic() - enqueued_at) * 1000.0
+        self.last_latency_ms = round(latency_ms, 1)
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self._latency_total_ms += latency_ms
+
+    async def close(self):
+        """Flush pending events (bounded by READY_POST_FLUSH_SEC), then stop the worker"""
+        if not self.task:
+            return
+        pending = self.queue.qsize()
+        if pending:
+            print(f"[READY-POST] Flushing {pending} pending event(s) on shutdown")
+        self.queue.put_nowait(None)
+        try:
+            await asyncio.wait_for(self.task, READY_POST_FLUSH_SEC)
+        except asyncio.TimeoutError:
+            print(f"[READY-POST] Shutdown flush timed out; {self.queue.qsize()} event(s) dropped")
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "last_latency_ms": self.last_latency_ms,
+            "max_latency_ms": round(self.max_latency_ms, 1),
+            "avg_latency_ms": round(self._latency_total_ms / self.delivered, 1) if self.delivered else None,
+        }
+
+ready_outbox: ReadyOutbox | None = None
+
+async def on_ready_side_effects(robot_id: str):
+    if ready_outbox is None:
+        return
     ts = int(time.time())
-    await _post_when_ready({"event": "ready", "ts": ts})
+    ready_outbox.enqueue({"event": "ready", "robot_id": robot_id, "ts": ts})
 
 # ========= AI Process Flow =========
 def detect_long_form_request(user_text: str) -> bool:
@@ -306,6 +811,37 @@ async def process_user_message(conversation_history, user_text: str):
         return None, "Sorry, I am currently unable to properly process your request. Please try again."
 
 # ========= MQTT Publish (trigger side effects after ready) =========
+async def publish_coffee_start(robot_id: str) -> bool:
+    """
+    Publish the EV3 coffee start event once per robot inside ACTION_DEDUP_SEC, across
+    all workers: the local window is a fast path, the state store claim is authoritative.
+    Returns False when the actuation was suppressed as a duplicate.
+    """
+    key = f"coffee/start|{robot_id}"
+    if not action_dedup.check_and_mark(key):
+        print(f"[DEDUP] ⏭️  Suppressed duplicate coffee/start for robot {robot_id}")
+        return False
+    if not await state_store.claim_event(key, ACTION_DEDUP_SEC):
+        action_dedup.note_suppressed()
+        print(f"[DEDUP] ⏭️  coffee/start for robot {robot_id} already claimed by another worker")
+        return False
+    event_payload = json.dumps({
+        "event": "coffee",
+        "value": "start",
+        "robot_id": robot_id,
+        "ts": uuid.uuid4().hex
+    })
+    print(f"[MQTT] Publishing: {event_payload} to {MQTT_PUB_TOPIC}")
+    # Blocking connect (+ TLS) and publish: keep it off the event loop
+    await asyncio.to_thread(mqtt_publish_single, MQTT_PUB_TOPIC, event_payload, CURRENT_MQTT_BROKER)
+    print(f"[Backend] ✅ Published EVENT to {MQTT_PUB_TOPIC}: coffee/start for robot {robot_id}")
+    return True
+
+async def start_coffee(robot_id: str):
+    """coffee/start (de-duplicated) followed by the ready POST + OCR side effects"""
+    if await publish_coffee_start(robot_id):
+        await on_ready_side_effects(robot_id)
+
 def publish_action_to_mqtt(action: str, robot_id: str = None):
     """
     Publish action to MQTT with optional robot_id targeting
@@ -326,18 +862,7 @@ def publish_action_to_mqtt(action: str, robot_id: str = None):
         loop = asyncio.get_running_loop()
         if action == "ready" and loop.is_running():
             # Convert to EV3 event format: {event:"coffee", value:"start", robot_id:"xxx"}
-            mqtt_publish_single(
-                MQTT_PUB_TOPIC,
-                json.dumps({
-                    "event": "coffee",
-                    "value": "start",
-                    "robot_id": robot_id,
-                    "ts": uuid.uuid4().hex
-                }),
-                CURRENT_MQTT_BROKER
-            )
-            print(f"[Backend] Published EVENT to {MQTT_PUB_TOPIC}: coffee/start for robot {robot_id}")
-            loop.create_task(on_ready_side_effects())
+            loop.create_task(start_coffee(robot_id))
     except RuntimeError:
         pass
 
@@ -377,31 +902,26 @@ async def handle_mqtt_message(topic: str, raw_payload: str):
         except Exception:
             pass
         
-        # Filter by robot_id: only process if message is for us or is a broadcast
+        # Filter by robot_id: only process if some worker has sockets for this robot, or it is a broadcast
+        target_workers = await state_store.robot_workers(message_robot_id)
         if message_robot_id is not None:
-            # Check if any connected WebSocket is configured for this robot_id
-            matching_websockets = [ws for ws in connected_websockets.copy() if websocket_robot_map.get(ws) == message_robot_id]
-            
-            if not matching_websockets:
+            if not target_workers:
                 print(f"[MQTT->AI] ⏭️  Skipping message for robot_id '{message_robot_id}' - no matching WebSocket connections")
                 return  # No WebSocket is listening for this robot_id, skip processing
             
-            print(f"[MQTT->AI] ✅ Processing message for robot_id '{message_robot_id}' - {len(matching_websockets)} matching connection(s)")
+            print(f"[MQTT->AI] ✅ Processing message for robot_id '{message_robot_id}' - {len(target_workers)} owning worker(s)")
         else:
             # No robot_id in message - broadcast to all (backward compatibility)
-            matching_websockets = list(connected_websockets.copy())
-            print(f"[MQTT->AI] 📢 Broadcasting message (no robot_id) to all {len(matching_websockets)} connection(s)")
+            print(f"[MQTT->AI] 📢 Broadcasting message (no robot_id) to all {len(target_workers)} worker(s)")
 
         user_text = user_text.strip() or "(empty message)"
+        mqtt_conversation = await load_mqtt_conversation()
+        mqtt_conversation.append({"role": "user", "content": user_text})
 
         # Special handling: hello judges direct response, bypass AI
         if "hello judges" in user_text.lower():
             reply_text = "Hello judges! I am Xiao Ka, please wave! We are ready to move to the next stage!"
-            # Record to conversation history for consistency
-            mqtt_conversation.append({"role": "user", "content": user_text})
             print_context_remaining(mqtt_conversation, "MQTT hello judges")
-            mqtt_conversation.append({"role": "assistant", "content": reply_text})
-            trim_history(mqtt_conversation, max_messages=100)
         elif is_distance_event:
             # Distance event: directly trigger name asking and record to conversation history
             # Select response language based on user's previous language
@@ -410,22 +930,18 @@ async def handle_mqtt_message(topic: str, raw_payload: str):
             has_chinese = any(any('\u4e00' <= char <= '\u9fff' for char in msg["content"]) for msg in recent_messages)
 
             reply_text = "Hello there! I am Xiao Ka, nice to meet you! What's your name?"
-            # Record distance event and AI response to conversation history
-            mqtt_conversation.append({"role": "user", "content": user_text})
             print_context_remaining(mqtt_conversation, "MQTT distance event")
-            mqtt_conversation.append({"role": "assistant", "content": reply_text})
-            trim_history(mqtt_conversation, max_messages=100)
         else:
             # Normal AI processing flow
-            mqtt_conversation.append({"role": "user", "content": user_text})
             print_context_remaining(mqtt_conversation, "MQTT normal AI")
             trim_history(mqtt_conversation, max_messages=100)
+            reply_text = await get_gpt_response_async(mqtt_conversation)
 
-            ai_text = await get_gpt_response_async(mqtt_conversation)
-            mqtt_conversation.append({"role": "assistant", "content": ai_text})
-            trim_history(mqtt_conversation, max_messages=100)
-
-            reply_text = ai_text
+        # Record the exchange to the shared conversation history
+        await record_mqtt_exchange(
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": reply_text},
+        )
 
         # 建立回覆 payload
         reply_payload = {"type": "reply", "reply_to": topic, "text": reply_text, "ts": uuid.uuid4().hex}
@@ -436,20 +952,197 @@ async def handle_mqtt_message(topic: str, raw_payload: str):
         else:
             print("[MQTT->AI] mqtt_client not ready; skip publish")
 
-        # Only send to matching WebSocket connections
-        for ws in matching_websockets:
-            try:
-                await ws.send_text(reply_text)
-            except Exception as e:
-                print(f"[WS] send_text failed: {e}")
-
-        # Only synthesize TTS if there are matching connections
-        if matching_websockets:
-            asyncio.create_task(synthesize_and_broadcast_tts(reply_text))
+        # Deliver to the worker(s) that own the matching WebSocket connections
+        await route_reply(target_workers, message_robot_id, reply_text)
 
     except Exception as e:
         print(f"[MQTT->AI] handle_mqtt_message error: {e}")
 
+# ========= Cross-worker reply routing =========
+async def deliver_reply_locally(robot_id: str | None, reply_text: str) -> int:
+    """Send a reply to this worker's sockets for robot_id (None: all sockets) and start TTS"""
+    if robot_id is None:
+        matching_websockets = list(connected_websockets.copy())
+    else:
+        matching_websockets = [ws for ws in connected_websockets.copy() if websocket_robot_map.get(ws) == robot_id]
+
+    # Only send to matching WebSocket connections
+    for ws in matching_websockets:
+        try:
+            await ws.send_text(reply_text)
+        except Exception as e:
+            print(f"[WS] send_text failed: {e}")
+            await reap_websocket(ws, "send_failed")
+
+    # Only synthesize TTS if there are matching connections
+    if matching_websockets:
+        asyncio.create_task(synthesize_and_broadcast_tts(reply_text))
+    return len(matching_websockets)
+
+async def route_reply(target_workers: set, robot_id: str | None, reply_text: str):
+    for worker_id in target_workers:
+        if worker_id == WORKER_ID:
+            await deliver_reply_locally(robot_id, reply_text)
+        else:
+            await state_store.send_to_worker(worker_id, {"type": "reply", "robot_id": robot_id, "text": reply_text})
+            print(f"[ROUTE] Reply for robot_id '{robot_id}' forwarded to worker {worker_id}")
+
+async def on_worker_message(message: dict):
+    """Messages routed to this worker by another worker via the state store"""
+    if message.get("type") == "reply":
+        delivered = await deliver_reply_locally(message.get("robot_id"), message.get("text", ""))
+        print(f"[ROUTE] Delivered routed reply to {delivered} local connection(s)")
+    elif message.get("type") == "config":
+        await apply_runtime_config(message.get("config") or {})
+
+# ========= Shared runtime config (default robot / MQTT broker) =========
+async def apply_runtime_config(config: dict, reconnect: bool = True):
+    """Apply shared default_robot_id / mqtt_broker values to this worker's globals"""
+    global DEFAULT_ROBOT_ID, CURRENT_MQTT_BROKER
+    robot_id = config.get("default_robot_id")
+    if robot_id and robot_id != DEFAULT_ROBOT_ID:
+        DEFAULT_ROBOT_ID = robot_id
+        print(f"[Config] Default robot_id changed to: {DEFAULT_ROBOT_ID}")
+    broker = config.get("mqtt_broker")
+    if broker and broker != CURRENT_MQTT_BROKER:
+        CURRENT_MQTT_BROKER = broker
+        print(f"[Config] MQTT broker changed to: {CURRENT_MQTT_BROKER}")
+        if reconnect:
+            await asyncio.to_thread(connect_mqtt, CURRENT_MQTT_BROKER)
+
+async def update_runtime_config(config: dict):
+    """Persist a config change in the state store, apply it here and push it to every other live worker"""
+    await state_store.save_config(config)
+    await apply_runtime_config(config)
+    for worker_id in await state_store.robot_workers(None):
+        if worker_id != WORKER_ID:
+            await state_store.send_to_worker(worker_id, {"type": "config", "config": config})
+
+async def bind_websocket_robot(websocket: WebSocket, robot_id: str):
+    """Assign a robot to a socket and update the shared robot→worker ownership"""
+    previous = websocket_robot_map.get(websocket)
+    websocket_robot_map[websocket] = robot_id
+    if previous is not None:
+        await state_store.remove_robot_socket(previous)
+    await state_store.add_robot_socket(robot_id)
+
+async def release_websocket(websocket: WebSocket):
+    """Forget a socket in every per-connection structure (local and shared); idempotent"""
+    connected_websockets.discard(websocket)
+    conversations.pop(websocket, None)
+    websocket_last_seen.pop(websocket, None)
+    robot_id = websocket_robot_map.pop(websocket, None)
+    if robot_id is not None:
+        await state_store.remove_robot_socket(robot_id)
+
+# ========= Traffic Capture (record for replay.py) =========
+CAPTURE_FILE = os.getenv("CAPTURE_FILE")  # e.g. captures/session.jsonl.gz; unset = off
+
+class TrafficCapture:
+    """
+    Append-only log of inbound traffic, one compact JSON array per line:
+      ["m", t, topic, payload]   MQTT message (before de-duplication)
+      ["o", t, conn]             WebSocket opened
+      ["w", t, conn, text]       WebSocket text frame (heartbeat pongs are not recorded)
+      ["c", t, conn]             WebSocket closed
+    t is seconds since capture start. Lines are written by a background thread,
+    so neither the event loop nor paho's thread waits on disk I/O.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.t0 = time.monotonic()
+        self.records = 0
+        self._queue = queue.SimpleQueue()
+        self._conn_ids = {}
+        self._next_conn = itertools.count(1)
+        opener = gzip.open if path.endswith(".gz") else open
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fp = opener(path, "at", encoding="utf-8")
+        self._fp.write(json.dumps({"capture": 1, "started": time.time(), "worker_id": WORKER_ID}) + "\n")
+        self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+        self._thread.start()
+        print(f"[CAPTURE] Recording inbound traffic to {path}")
+
+    def conn_id(self, websocket: WebSocket) -> int:
+        if websocket not in self._conn_ids:
+            self._conn_ids[websocket] = next(self._next_conn)
+        return self._conn_ids[websocket]
+
+    def record(self, kind: str, *fields):
+        self._queue.put([kind, round(time.monotonic() - self.t0, 4), *fields])
+
+    def record_ws(self, kind: str, websocket: WebSocket, *fields):
+        self.record(kind, self.conn_id(websocket), *fields)
+        if kind == "c":
+            self._conn_ids.pop(websocket, None)
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._fp.write(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.records += 1
+            if self._queue.empty():
+                self._fp.flush()
+        self._fp.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+traffic_capture = TrafficCapture(CAPTURE_FILE) if CAPTURE_FILE else None
+
+# ========= WebSocket Heartbeat / Reaper =========
+WS_PING_INTERVAL_SEC = float(os.getenv("WS_PING_INTERVAL_SEC", "20"))
+WS_IDLE_TIMEOUT_SEC  = float(os.getenv("WS_IDLE_TIMEOUT_SEC", "65"))  # ~3 missed pongs
+
+def is_heartbeat_frame(text: str, kind: str) -> bool:
+    """True for a {"type": kind, ...} heartbeat frame, whatever the JSON spacing or key order"""
+    if kind not in text:
+        return False
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(obj, dict) and obj.get("type") == kind
+
+websocket_last_seen = {}  # websocket -> monotonic time of the last frame received
+ws_reaped = {"idle_timeout": 0, "send_failed": 0}
+
+async def reap_websocket(websocket: WebSocket, reason: str):
+    """Close a dead/idle socket and clean up connections, conversations and robot map together"""
+    if websocket not in connected_websockets:
+        return
+    await release_websocket(websocket)
+    ws_reaped[reason] += 1
+    try:
+        await websocket.close(code=1001)
+    except Exception:
+        pass
+    print(f"[WS] Reaped connection ({reason}); {len(connected_websockets)} live")
+
+async def ping_websocket(ws: WebSocket, ping: str, now: float):
+    if now - websocket_last_seen.get(ws, now) > WS_IDLE_TIMEOUT_SEC:
+        await reap_websocket(ws, "idle_timeout")
+        return
+    try:
+        await asyncio.wait_for(ws.send_text(ping), timeout=WS_PING_INTERVAL_SEC)
+    except Exception:
+        await reap_websocket(ws, "send_failed")
+
+async def ping_all_websockets():
+    """One heartbeat round: all sockets concurrently, so a stalled client cannot delay the others"""
+    now = time.monotonic()
+    ping = json.dumps({"type": "ping", "ts": int(time.time())})
+    await asyncio.gather(*(ping_websocket(ws, ping, now) for ws in connected_websockets.copy()))
+
+async def websocket_heartbeat():
+    """Ping every socket each WS_PING_INTERVAL_SEC and reap those silent for WS_IDLE_TIMEOUT_SEC"""
+    while True:
+        await asyncio.sleep(WS_PING_INTERVAL_SEC)
+        await ping_all_websockets()
+
 # ========= MQTT Events =========
 async def broadcast_text_to_websockets(message: str):
     for ws in connected_websockets.copy():
@@ -457,9 +1150,9 @@ async def broadcast_text_to_websockets(message: str):
             await ws.send_text(message)
         except Exception as e:
             print(f"[WS] broadcast_text failed: {e}")
-            connected_websockets.discard(ws)
+            await reap_websocket(ws, "send_failed")
 
-def on_connect(client: mqtt.Client, userdata, flags, rc, properties=None):
+def on_connect(client: "mqtt.Client", userdata, flags, rc, properties=None):
     print(f"[MQTT] on_connect callback - rc={rc}")
     
     # Connection result codes
@@ -473,8 +1166,11 @@ def on_connect(client: mqtt.Client, userdata, flags, rc, properties=None):
     }
     
     if rc == 0:
+        mark_startup("mqtt_connected")
         print(f"[MQTT] ✅ Connected to {CURRENT_MQTT_BROKER}:{MQTT_PORT} successfully!")
         for t, q in MQTT_SUB_TOPICS:
+            if MQTT_SHARED_GROUP:
+                t = f"$share/{MQTT_SHARED_GROUP}/{t}"
             client.subscribe(t, qos=q)
             print(f"[MQTT] Subscribed to: {t} (qos={q})")
     else:
@@ -485,15 +1181,38 @@ def on_connect(client: mqtt.Client, userdata, flags, rc, properties=None):
         elif rc == 5:
             print(f"[MQTT] Check MQTT broker permissions for user: {MQTT_USERNAME}")
 
-def on_message(client: mqtt.Client, userdata, msg: mqtt.MQTTMessage):
+def on_message(client: "mqtt.Client", userdata, msg: "mqtt.MQTTMessage"):
     payload = msg.payload.decode("utf-8", errors="ignore")
     print(f"[MQTT] Received on {msg.topic}: {payload}")
+    dispatch_inbound_mqtt(msg.topic, payload)
+
+def dispatch_inbound_mqtt(topic: str, payload: str):
+    """
+    Thread-safe MQTT ingress (paho thread or replay tool): capture, de-duplicate
+    and schedule handling on the main loop. Returns the scheduled future, or None.
+    """
+    if traffic_capture:
+        traffic_capture.record("m", topic, payload)
+    key = event_idempotency_key(topic, payload)
+    if not inbound_dedup.check_and_mark(key):
+        print(f"[DEDUP] ⏭️  Suppressed duplicate message on {topic}")
+        return None
     if MAIN_LOOP and MAIN_LOOP.is_running():
-        asyncio.run_coroutine_threadsafe(handle_mqtt_message(msg.topic, payload), MAIN_LOOP)
-    else:
-        print("[MQTT] MAIN_LOOP not ready; dropping message")
+        return asyncio.run_coroutine_threadsafe(handle_inbound_mqtt(topic, payload, key), MAIN_LOOP)
+    print("[MQTT] MAIN_LOOP not ready; dropping message")
+    return None
+
+async def handle_inbound_mqtt(topic: str, raw_payload: str, key: str):
+    # Claim the event across workers so a duplicate delivered to another worker is dropped too
+    if not await state_store.claim_event(key, DEDUP_WINDOW_SEC):
+        inbound_dedup.note_suppressed()
+        print(f"[DEDUP] ⏭️  Event on {topic} already claimed by another worker")
+        return
+    await handle_mqtt_message(topic, raw_payload)
 
 def connect_mqtt(broker_host: str):
+    """Create the MQTT client and connect without blocking (paho's loop thread does the connect)"""
+    import paho.mqtt.client as mqtt
     global mqtt_client
     if mqtt_client is not None:
         try:
@@ -524,7 +1243,7 @@ def connect_mqtt(broker_host: str):
     
     print(f"[MQTT] Attempting to connect...")
     try:
-        mqtt_client.connect(broker_host, MQTT_PORT, keepalive=60)
+        mqtt_client.connect_async(broker_host, MQTT_PORT, keepalive=60)
         mqtt_client.loop_start()
         print(f"[MQTT] Connection loop started for {broker_host}:{MQTT_PORT}")
         print(f"[MQTT] Waiting for on_connect callback...")
@@ -546,6 +1265,9 @@ async def root():
             "robot_config": "/robot",
             "websocket": "/ws",
             "health": "/health",
+            "ready": "/ready",
+            "startup": "/startup",
+            "metrics": "/metrics",
             "test_say": "/test-say"
         },
         "websocket_commands": {
@@ -554,6 +1276,37 @@ async def root():
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for the backend"""
+    return {
+        "dedup": {
+            "mqtt_ingress": inbound_dedup.stats(),
+            "outbound_actions": action_dedup.stats(),
+        },
+        "ready_outbox": ready_outbox.stats() if ready_outbox else None,
+        "state": state_store.describe(),
+        "websockets": {
+            "live": len(connected_websockets),
+            "reaped": dict(ws_reaped),
+        },
+    }
+
+@app.get("/ready")
+async def ready():
+    """Readiness: MQTT connected and the OpenAI client built (liveness stays on /health)"""
+    checks = {
+        "mqtt_connected": bool(mqtt_client and mqtt_client.is_connected()),
+        "openai_ready": _openai_client is not None,
+    }
+    ok = all(checks.values())
+    return JSONResponse({"ready": ok, **checks}, status_code=200 if ok else 503)
+
+@app.get("/startup")
+async def startup_profile():
+    """Seconds from process import to each startup phase"""
+    return STARTUP_PROFILE
+
 @app.get("/health")
 async def health():
     return {
@@ -569,6 +1322,7 @@ async def get_robot_config():
     """Get current robot configuration"""
     return {
         "default_robot_id": DEFAULT_ROBOT_ID,
+        "worker_id": WORKER_ID,
         "active_connections": len(connected_websockets),
         "robot_assignments": {
             f"ws_{i}": robot_id 
@@ -578,16 +1332,14 @@ async def get_robot_config():
 
 @app.post("/robot")
 async def set_default_robot(request: Request):
-    """Set the default robot ID for new connections"""
-    global DEFAULT_ROBOT_ID
+    """Set the default robot ID for new connections (on every worker)"""
     body = await request.json()
     robot_id = body.get("robot_id")
     
     if not robot_id or not isinstance(robot_id, str):
         return {"ok": False, "error": "robot_id is required and must be a string"}
     
-    DEFAULT_ROBOT_ID = robot_id
-    print(f"[Config] Default robot_id changed to: {DEFAULT_ROBOT_ID}")
+    await update_runtime_config({"default_robot_id": robot_id})
     return {
         "ok": True,
         "default_robot_id": DEFAULT_ROBOT_ID,
@@ -601,13 +1353,11 @@ async def get_mqtt_broker():
 
 @app.post("/mqtt/broker")
 async def set_mqtt_broker(request: Request):
-    global CURRENT_MQTT_BROKER
     body = await request.json()
     broker = (body or {}).get("broker")
     if not broker or not isinstance(broker, str):
         return {"ok": False, "error": "broker 必填"}
-    CURRENT_MQTT_BROKER = broker.strip()
-    connect_mqtt(CURRENT_MQTT_BROKER)
+    await update_runtime_config({"mqtt_broker": broker.strip()})
     return {"ok": True, "broker": CURRENT_MQTT_BROKER}
 
 @app.post("/mqtt/test")
@@ -637,7 +1387,7 @@ async def test_mqtt_connection():
         # Wait a short time for the publish to complete
         await asyncio.sleep(0.1)
         
-        if result.rc == mqtt.MQTT_ERR_SUCCESS or result.rc == 0:
+        if result.rc == 0:  # MQTT_ERR_SUCCESS
             return {"ok": True, "message": "MQTT connection successful"}
         else:
             return {"ok": False, "error": f"MQTT publish failed with code {result.rc}"}
@@ -664,15 +1414,24 @@ async def test_language_detection(request: Request):
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     connected_websockets.add(websocket)
+    websocket_last_seen[websocket] = time.monotonic()
+    if traffic_capture:
+        traffic_capture.record_ws("o", websocket)
     conversations[websocket] = [{"role": "system", "content": SYSTEM_PROMPT}]
     # Initialize robot_id for this WebSocket connection
-    websocket_robot_map[websocket] = DEFAULT_ROBOT_ID
+    await bind_websocket_robot(websocket, DEFAULT_ROBOT_ID)
     print(f"[WebSocket] New connection, default robot_id: {DEFAULT_ROBOT_ID}")
     
     try:
         while True:
             data = await websocket.receive_text()
+            websocket_last_seen[websocket] = time.monotonic()
+            # Heartbeat reply: only refreshes liveness
+            if is_heartbeat_frame(data, "pong"):
+                continue
             print(f"WS RX: {data}")
+            if traffic_capture:
+                traffic_capture.record_ws("w", websocket, data)
             
             # Try to parse as JSON for special commands
             try:
@@ -687,7 +1446,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     # Handle robot_id setting
                     if msg_type == "set_robot_id":
                         robot_id = maybe_json.get("robot_id", DEFAULT_ROBOT_ID)
-                        websocket_robot_map[websocket] = robot_id
+                        await bind_websocket_robot(websocket, robot_id)
                         print(f"[WebSocket] Robot ID set to: {robot_id}")
                         await websocket.send_text(json.dumps({
                             "type": "robot_id_set",
@@ -730,22 +1489,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     try:
                         loop = asyncio.get_running_loop()
                         if loop.is_running():
-                            # 發布 coffee start event with robot_id
-                            event_payload = json.dumps({
-                                "event": "coffee",
-                                "value": "start",
-                                "robot_id": robot_id,
-                                "ts": uuid.uuid4().hex
-                            })
-                            print(f"[MQTT] Publishing: {event_payload} to {MQTT_PUB_TOPIC}")
-                            
-                            mqtt_publish_single(
-                                MQTT_PUB_TOPIC,
-                                event_payload,
-                                CURRENT_MQTT_BROKER
-                            )
-                            print(f"[Backend] ✅ Published EVENT to {MQTT_PUB_TOPIC}: coffee/start for robot {robot_id}")
-                            loop.create_task(on_ready_side_effects())
+                            # 發布 coffee start event with robot_id (deduplicated per robot)
+                            loop.create_task(start_coffee(robot_id))
                         else:
                             print(f"[ERROR] Event loop not running!")
                     except RuntimeError as e:
@@ -756,7 +1501,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         traceback.print_exc()
                 else:
                     # 其他 action 照常處理，傳入 robot_id
-                    publish_action_to_mqtt(detected_action, robot_id)
+                    await asyncio.to_thread(publish_action_to_mqtt, detected_action, robot_id)
 
                 # Always send response text, even if empty
                 if response_text:
@@ -774,10 +1519,13 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.send_text(response_text)
 
     except WebSocketDisconnect:
-        connected_websockets.remove(websocket)
-        conversations.pop(websocket, None)
-        websocket_robot_map.pop(websocket, None)
         print("WebSocket disconnected.")
+    except Exception as e:
+        print(f"[WS] connection error: {e}")
+    finally:
+        if traffic_capture:
+            traffic_capture.record_ws("c", websocket)
+        await release_websocket(websocket)
 
 # ========= Test API =========
 @app.post("/test-say")
@@ -787,18 +1535,19 @@ async def test_say(request: Request):
     message = body.get("message", "")
 
     if message:
-        temp = mqtt_conversation.copy()
+        temp = await load_mqtt_conversation()
         temp.append({"role": "user", "content": message})
         ai_response = await get_gpt_response_async(temp)
         await broadcast_text_to_websockets(ai_response)
         asyncio.create_task(synthesize_and_broadcast_tts(ai_response))
-        mqtt_conversation.append({"role": "user", "content": message})
-        print_context_remaining(mqtt_conversation, "Test endpoint")
-        mqtt_conversation.append({"role": "assistant", "content": ai_response})
-        trim_history(mqtt_conversation, max_messages=100)
+        print_context_remaining(temp, "Test endpoint")
+        await record_mqtt_exchange(
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": ai_response},
+        )
         return {"status": "ok", "message": message, "ai_response": ai_response, "via": "websocket+ai"}
 
-    publish_action_to_mqtt(action)
+    await asyncio.to_thread(publish_action_to_mqtt, action)
     return {"status": "ok", "action": action, "via": "mqtt"}
 
 # ========= [VOICE-CONFIG] 語音品質控制 =========
@@ -854,13 +1603,17 @@ async def test_distance(request: Request):
     payload = {
         "event": "start",
         "distance_cm": distance,
-        "robot_id": robot_id  # Include robot_id in payload
+        "robot_id": robot_id,  # Include robot_id in payload
+        "event_id": uuid.uuid4().hex  # Lets on_message drop the broker echo of this event
     }
     raw_payload = json.dumps(payload)
+    key = event_idempotency_key("robot/notify", raw_payload)
+    inbound_dedup.check_and_mark(key)
+    await state_store.claim_event(key, DEDUP_WINDOW_SEC)
 
     # 選擇性：真的發一筆到 MQTT broker 的 robot/notify
     if publish_mqtt:
-        mqtt_publish_single("robot/notify", raw_payload, CURRENT_MQTT_BROKER)
+        await asyncio.to_thread(mqtt_publish_single, "robot/notify", raw_payload, CURRENT_MQTT_BROKER)
         print(f"[HTTP /test/distance] Published to MQTT robot/notify: {payload}")
 
     # 無論如何，都走一次原本的處理邏輯（距離 < 10cm → 問名字）
@@ -876,6 +1629,137 @@ async def test_distance(request: Request):
     print(f"[DEBUG /test/distance] Returning response: {response}")  # DEBUG
     return response
 
+# ========= Debug: Sampling Profiler / Event-loop Lag =========
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # /debug/* endpoints are disabled unless set
+PROFILE_SAMPLE_SEC   = float(os.getenv("PROFILE_SAMPLE_SEC", "0.005"))  # 200 Hz
+PROFILE_MAX_SEC      = 60.0
+LOOP_LAG_INTERVAL_SEC  = float(os.getenv("LOOP_LAG_INTERVAL_SEC", "0.1"))
+LOOP_LAG_THRESHOLD_SEC = float(os.getenv("LOOP_LAG_THRESHOLD_SEC", "0.1"))
+
+_profile_lock = threading.Lock()
+
+def _is_admin(request: Request) -> bool:
+    # Header only: query strings end up in access and proxy logs
+    token = request.headers.get("x-admin-token")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode())
+
+def _collapse_stack(frame) -> list:
+    """Frame chain → ["module:function:line", ...] ordered root first"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def sample_stacks(seconds: float, interval: float = PROFILE_SAMPLE_SEC) -> Counter:
+    """
+    Sample every thread's Python stack (event loop, asyncio.to_thread workers, paho)
+    for `seconds`. Returns Counter of collapsed stacks "thread;frame;frame".
+    """
+    me = threading.get_ident()
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = _collapse_stack(frame)
+            samples[";".join([names.get(ident, f"thread-{ident}")] + stack)] += 1
+        time.sleep(interval)
+    return samples
+
+class LoopLagMonitor:
+    """
+    Measures how late scheduled callbacks run on the event loop.
+    A watchdog thread captures the loop thread's stack whenever the loop has not
+    ticked for LOOP_LAG_THRESHOLD_SEC, so blocking calls show up by name.
+    """
+    def __init__(self):
+        self.lags_ms = deque(maxlen=600)  # last minute at the default interval
+        self.max_lag_ms = 0.0
+        self.over_threshold = 0
+        self.blocking_stacks = Counter()
+        self._last_tick = time.monotonic()
+        self._loop_thread = None
+        self._stalled = False
+
+    async def run(self):
+        self._loop_thread = threading.get_ident()
+        threading.Thread(target=self._watchdog, name="loop-lag-watchdog", daemon=True).start()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL_SEC)
+            self._last_tick = time.monotonic()
+            lag_ms = max(0.0, (self._last_tick - start - LOOP_LAG_INTERVAL_SEC) * 1000.0)
+            self.lags_ms.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= LOOP_LAG_THRESHOLD_SEC * 1000.0:
+                self.over_threshold += 1
+                print(f"[LOOP] Event loop lag {lag_ms:.0f} ms")
+
+    def _watchdog(self):
+        while True:
+            time.sleep(LOOP_LAG_THRESHOLD_SEC / 2)
+            stalled = time.monotonic() - self._last_tick > LOOP_LAG_INTERVAL_SEC + LOOP_LAG_THRESHOLD_SEC
+            if stalled and not self._stalled:
+                frame = sys._current_frames().get(self._loop_thread)
+                # A loop parked in select() is idle, not blocked
+                idle = frame is not None and frame.f_code.co_filename.endswith("selectors.py")
+                if frame is not None and not idle and len(self.blocking_stacks) < 200:
+                    self.blocking_stacks[";".join(_collapse_stack(frame))] += 1
+            self._stalled = stalled
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags_ms)
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))], 2) if lags else None
+        return {
+            "interval_ms": LOOP_LAG_INTERVAL_SEC * 1000.0,
+            "threshold_ms": LOOP_LAG_THRESHOLD_SEC * 1000.0,
+            "samples": len(lags),
+            "current_ms": round(self.lags_ms[-1], 2) if self.lags_ms else None,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max_lag_ms, 2),
+            "over_threshold": self.over_threshold,
+            "blocking_stacks": [
+                {"count": n, "stack": stack} for stack, n in self.blocking_stacks.most_common(10)
+            ],
+        }
+
+loop_lag_monitor = LoopLagMonitor()
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 5.0):
+    """
+    Sample all threads for `seconds` and return collapsed stacks
+    (one "thread;frame;...;frame count" line each, ready for flamegraph.pl / speedscope).
+    """
+    if not _is_admin(request):
+        return JSONResponse({"ok": False, "error": "admin token required"}, status_code=403)
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse({"ok": False, "error": "a profile is already running"}, status_code=409)
+    try:
+        seconds = max(0.1, min(seconds, PROFILE_MAX_SEC))
+        samples = await asyncio.to_thread(sample_stacks, seconds)
+    finally:
+        _profile_lock.release()
+    body = "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+    return PlainTextResponse(body, headers={"Content-Disposition": f"attachment; filename=profile-{int(time.time())}.collapsed"})
+
+@app.get("/debug/loop-lag")
+async def debug_loop_lag(request: Request):
+    """Event-loop scheduling lag percentiles and the stacks seen while the loop was blocked"""
+    if not _is_admin(request):
+        return JSONResponse({"ok": False, "error": "admin token required"}, status_code=403)
+    return loop_lag_monitor.stats()
+
+mark_startup("imported")
+
 # ========= Main Entry Point for Production =========
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,266 @@
+"""
+Replay a traffic capture (CAPTURE_FILE) into the backend for deterministic benchmarking.
+
+The app runs in-process with the LLM and TTS stubbed (fixed reply text / fixed
+audio bytes after a configurable delay) and MQTT networking disabled, so a real
+competition session becomes a repeatable performance regression test.
+
+Usage (from the backend directory):
+    python replay.py captures/session.jsonl.gz              # 1x, original timing
+    python replay.py captures/session.jsonl.gz --speed 10   # 10x faster
+    python replay.py captures/session.jsonl.gz --speed 0    # as fast as possible
+    python replay.py capture.jsonl --llm-delay 0.4 --tts-delay 0.3 --json
+"""
+import argparse
+import asyncio
+import collections
+import gzip
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load_capture(path: str) -> list:
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as fp:
+        for line in fp:
+            item = json.loads(line)
+            if isinstance(item, list):  # skip header lines (one per recording session)
+                records.append(item)
+    return records
+
+def _summary(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.mean(values) * 1000, 2),
+        "p50_ms": round(values[len(values) // 2] * 1000, 2),
+        "p95_ms": round(values[min(len(values) - 1, int(0.95 * len(values)))] * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+def install_stubs(main, llm_delay: float, tts_delay: float, stats: collections.Counter):
+    reply_seq = itertools.count(1)
+
+    def fake_gpt(conversation_history, max_tokens=100):
+        stats["llm_calls"] += 1
+        time.sleep(llm_delay)
+        # Numbered, so a reply text names the one request it answers (see ReplayConnection)
+        return f"Replay reply {next(reply_seq)}."
+
+    async def fake_tts(text: str, lang: str = None):
+        stats["tts_jobs"] += 1
+        await asyncio.sleep(tts_delay)
+        await main.broadcast_audio_bytes(b"\x00" * 2048)
+
+    main.get_gpt_response = fake_gpt
+    main.synthesize_and_broadcast_tts = fake_tts
+    main.connect_mqtt = lambda broker_host: None
+    main.mqtt_publish_single = lambda topic, payload, hostname: stats.update(["mqtt_publishes"])
+    main.warm_up_clients = lambda: None
+
+class ReplayConnection:
+    """
+    One captured WebSocket connection replayed through the TestClient.
+    The app answers this socket's own frames in order, so those replies are paired
+    with send times FIFO. Replies routed here from MQTT handling are announced by
+    track_routed_replies() before they are sent; they are matched by text, counted
+    separately and never consume a send time.
+    """
+    def __init__(self, session, server_ws):
+        self.session = session
+        self.server_ws = server_ws  # the app-side WebSocket object for this connection
+        self.pending = collections.deque()  # send times of frames that expect a text reply
+        self.routed = collections.Counter()  # MQTT-routed reply texts announced but not yet received
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.expected = 0
+        self.text_received = 0
+        self.routed_received = 0
+        self.audio_received = 0
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def expect_routed(self, text: str):
+        with self.lock:
+            self.routed[text] += 1
+            self.expected += 1
+
+    def send(self, text: str):
+        if _expects_reply(text):
+            with self.lock:
+                self.pending.append(time.perf_counter())
+                self.expected += 1
+        self.session.send_text(text)
+
+    def drain(self, timeout: float):
+        deadline = time.perf_counter() + timeout
+        while self.text_received < self.expected and time.perf_counter() < deadline:
+            time.sleep(0.001)
+
+    def _receive(self):
+        try:
+            while True:
+                message = self.session.receive()
+                if message.get("type") == "websocket.close":
+                    break
+                if message.get("bytes") is not None:
+                    self.audio_received += 1
+                elif message.get("text") is not None:
+                    if _is_ping(message["text"]):
+                        self.session.send_text('{"type":"pong"}')
+                        continue
+                    self._on_text(message["text"], time.perf_counter())
+        except Exception:
+            pass
+
+    def _on_text(self, text: str, received: float):
+        with self.lock:
+            self.text_received += 1
+            if self.routed[text] > 0:
+                self.routed[text] -= 1
+                self.routed_received += 1
+            elif self.pending:
+                self.latencies.append(received - self.pending.popleft())
+
+def _is_ping(text: str) -> bool:
+    try:
+        obj = json.loads(text)
+    except Exception:
+        return False
+    return isinstance(obj, dict) and obj.get("type") == "ping"
+
+def _expects_reply(text: str) -> bool:
+    try:
+        obj = json.loads(text)
+    except Exception:
+        return True
+    return not (isinstance(obj, dict) and obj.get("type") == "user_meta")
+
+def _new_server_socket(main, before: set):
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        new = set(main.connected_websockets) - before
+        if new:
+            return new.pop()
+        time.sleep(0.001)
+    return None
+
+def track_routed_replies(main, connections: dict):
+    """Wrap deliver_reply_locally so each replayed socket knows which texts reach it via MQTT routing"""
+    deliver = main.deliver_reply_locally
+
+    async def deliver_and_track(robot_id, reply_text):
+        for conn in list(connections.values()):
+            ws = conn.server_ws
+            if ws in main.connected_websockets and (robot_id is None or main.websocket_robot_map.get(ws) == robot_id):
+                conn.expect_routed(reply_text)
+        return await deliver(robot_id, reply_text)
+
+    main.deliver_reply_locally = deliver_and_track
+
+def replay(path: str, speed: float, llm_delay: float, tts_delay: float, drain_sec: float) -> dict:
+    os.environ.setdefault("OPENAI_API_KEY", "sk-replay")
+    os.environ.pop("CAPTURE_FILE", None)
+    os.environ.pop("REDIS_URL", None)
+    sys.path.insert(0, HERE)
+    import main
+    from fastapi.testclient import TestClient
+
+    stats = collections.Counter()
+    install_stubs(main, llm_delay, tts_delay, stats)
+    records = load_capture(path)
+    mqtt_latencies = []
+    connections = {}
+    contexts = {}
+    track_routed_replies(main, connections)
+
+    with TestClient(main.app) as client:
+        start = time.perf_counter()
+        for kind, t, *fields in records:
+            if speed > 0:
+                delay = t / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == "m":
+                topic, payload = fields
+                sent = time.perf_counter()
+                future = main.dispatch_inbound_mqtt(topic, payload)
+                stats["mqtt_messages"] += 1
+                if future is None:
+                    stats["mqtt_suppressed"] += 1
+                    continue
+                future.result(timeout=60)
+                mqtt_latencies.append(time.perf_counter() - sent)
+            elif kind == "o":
+                before = set(main.connected_websockets)
+                ctx = client.websocket_connect("/ws")
+                contexts[fields[0]] = ctx
+                session = ctx.__enter__()
+                connections[fields[0]] = ReplayConnection(session, _new_server_socket(main, before))
+                stats["ws_connections"] += 1
+            elif kind == "w":
+                conn = connections.get(fields[0])
+                if conn:
+                    conn.send(fields[1])
+                    stats["ws_frames"] += 1
+            elif kind == "c":
+                ctx = contexts.pop(fields[0], None)
+                if ctx:
+                    # In the capture the client saw its replies before closing
+                    connections[fields[0]].drain(drain_sec)
+                    ctx.__exit__(None, None, None)
+        replay_sec = time.perf_counter() - start
+
+        # Let outstanding replies finish before closing the remaining sockets
+        for conn_id, ctx in contexts.items():
+            connections[conn_id].drain(drain_sec)
+            ctx.__exit__(None, None, None)
+        metrics = client.get("/metrics").json()
+
+    ws_latencies = [lat for c in connections.values() for lat in c.latencies]
+    captured_sec = records[-1][1] if records else 0.0
+    return {
+        "capture": path,
+        "speed": speed or "max",
+        "records": len(records),
+        "captured_sec": round(captured_sec, 3),
+        "replay_sec": round(replay_sec, 3),
+        "events_per_sec": round(len(records) / replay_sec, 1) if replay_sec else None,
+        "mqtt_handle": _summary(mqtt_latencies),
+        "ws_reply": _summary(ws_latencies),
+        "ws_text_received": sum(c.text_received for c in connections.values()),
+        "ws_routed_received": sum(c.routed_received for c in connections.values()),
+        "ws_audio_received": sum(c.audio_received for c in connections.values()),
+        "counters": dict(stats),
+        "dedup": metrics.get("dedup"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="capture file written with CAPTURE_FILE (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale: 1 = real time, N = N x faster, 0 = max speed")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="seconds the stubbed LLM call takes")
+    parser.add_argument("--tts-delay", type=float, default=0.0, help="seconds the stubbed TTS job takes")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON only")
+    args = parser.parse_args()
+
+    report = replay(args.capture, args.speed, args.llm_delay, args.tts_delay, args.drain)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    print("[REPLAY] report")
+    for key, value in report.items():
+        print(f"  {key:18}: {value}")
+
+if __name__ == "__main__":
+    main()
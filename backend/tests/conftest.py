@@ -0,0 +1,6 @@
+# main.py runs from backend/; it only checks that an OpenAI key is configured at import
+import os, sys
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.pop("REDIS_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+# Idempotency keys and the time-windowed de-duplication set
+import json
+
+import main
+from main import DedupWindow, event_idempotency_key
+
+def test_dedup_window_suppresses_inside_window(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    window = DedupWindow("test", window_sec=10.0)
+    assert window.check_and_mark("a")
+    assert not window.check_and_mark("a")
+    assert window.check_and_mark("b")
+    clock[0] += 10.0
+    assert window.check_and_mark("a")   # window expired
+    assert window.stats() == {"window_sec": 10.0, "tracked_keys": 1, "accepted": 3, "suppressed": 1, "evicted": 0}
+
+def test_dedup_window_bounded(monkeypatch):
+    monkeypatch.setattr(main.time, "monotonic", lambda: 1000.0)
+    window = DedupWindow("test", window_sec=10.0, max_keys=3)
+    for key in "abcd":
+        assert window.check_and_mark(key)
+    stats = window.stats()
+    assert stats["tracked_keys"] == 3 and stats["evicted"] == 1
+    assert window.check_and_mark("a")   # evicted early, so no longer a duplicate
+    assert not window.check_and_mark("d")
+
+def test_note_suppressed():
+    window = DedupWindow("test", window_sec=10.0)
+    window.note_suppressed()
+    assert window.stats()["suppressed"] == 1
+
+def test_key_uses_event_id_across_resends():
+    first = json.dumps({"event": "start", "ts": 100, "robot_id": "wro1", "event_id": "b00t-start-1"})
+    resent = json.dumps({"event": "start", "ts": 103, "robot_id": "wro1", "event_id": "b00t-start-1"})
+    nxt = json.dumps({"event": "start", "ts": 103, "robot_id": "wro1", "event_id": "b00t-start-2"})
+    assert event_idempotency_key("robot/notify", first) == event_idempotency_key("robot/notify", resent)
+    assert event_idempotency_key("robot/notify", first) != event_idempotency_key("robot/notify", nxt)
+    other_robot = first.replace("wro1", "wro2")
+    assert event_idempotency_key("robot/notify", first) != event_idempotency_key("robot/notify", other_robot)
+
+def test_key_without_event_id_is_payload_digest():
+    payload = json.dumps({"event": "start", "ts": 100, "robot_id": "wro1"})
+    assert event_idempotency_key("robot/notify", payload) == event_idempotency_key("robot/notify", payload)
+    assert event_idempotency_key("robot/notify", payload) != event_idempotency_key("robot/other", payload)
+    assert event_idempotency_key("robot/notify", "not json") != event_idempotency_key("robot/notify", "not json!")
@@ -0,0 +1,53 @@
+# WebSocket heartbeat: frame detection and one concurrent ping/reap round
+import asyncio, json, time
+
+import main
+from main import InMemoryStateStore, is_heartbeat_frame
+
+def test_is_heartbeat_frame():
+    assert is_heartbeat_frame('{"type":"pong"}', "pong")
+    assert is_heartbeat_frame('{ "ts": 1, "type" : "pong" }', "pong")
+    assert not is_heartbeat_frame('{"type":"ping"}', "pong")
+    assert not is_heartbeat_frame('{"text": "say pong"}', "pong")
+    assert not is_heartbeat_frame('{"type":"pong"', "pong")
+    assert not is_heartbeat_frame('["pong"]', "pong")
+    assert not is_heartbeat_frame("pong", "pong")
+
+class FakeSocket:
+    def __init__(self, name, stall=False):
+        self.name, self.stall = name, stall
+        self.sent, self.closed = [], None
+
+    async def send_text(self, text):
+        if self.stall:
+            await asyncio.sleep(3600)
+        self.sent.append((time.monotonic(), json.loads(text)))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+def test_ping_round_is_concurrent(monkeypatch):
+    interval = 0.3
+    monkeypatch.setattr(main, "WS_PING_INTERVAL_SEC", interval)
+    monkeypatch.setattr(main, "state_store", InMemoryStateStore())
+    monkeypatch.setattr(main, "ws_reaped", {"idle_timeout": 0, "send_failed": 0})
+    stalled, idle = FakeSocket("stalled", stall=True), FakeSocket("idle")
+    healthy = [FakeSocket(f"ok{i}") for i in range(3)]
+    sockets = [stalled, idle] + healthy
+    monkeypatch.setattr(main, "connected_websockets", set(sockets))
+    now = time.monotonic()
+    last_seen = {ws: now for ws in sockets}
+    last_seen[idle] = now - main.WS_IDLE_TIMEOUT_SEC - 1
+    monkeypatch.setattr(main, "websocket_last_seen", last_seen)
+
+    t0 = time.monotonic()
+    asyncio.run(main.ping_all_websockets())
+    elapsed = time.monotonic() - t0
+
+    assert elapsed < 2 * interval   # one timeout for the stalled socket, not one per socket
+    for ws in healthy:
+        (sent_at, frame), = ws.sent
+        assert frame["type"] == "ping" and sent_at - t0 < interval / 2
+    assert stalled.closed == 1001 and idle.closed == 1001 and idle.sent == []
+    assert main.ws_reaped == {"idle_timeout": 1, "send_failed": 1}
+    assert main.connected_websockets == set(healthy)
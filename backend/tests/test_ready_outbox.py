@@ -0,0 +1,74 @@
+# ReadyOutbox: per-robot coalescing, retry/backoff and shutdown flush, against a fake HTTP client
+import asyncio, types
+import pytest
+
+import main
+from main import ReadyOutbox
+
+class FakeHttp:
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)   # status codes or exceptions, then 200 forever
+        self.posts = []
+
+    async def post(self, url, json=None):
+        self.posts.append(json)
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        return types.SimpleNamespace(status_code=outcome)
+
+@pytest.fixture
+def http(monkeypatch):
+    fake = FakeHttp()
+    async def get_http_client():
+        return fake
+    monkeypatch.setattr(main, "get_http_client", get_http_client)
+    monkeypatch.setattr(main, "READY_POST_LINGER_SEC", 0.05)
+    monkeypatch.setattr(main, "READY_POST_BACKOFF_SEC", 0.0)
+    return fake
+
+def run_outbox(payload_batches, pause=0.0):
+    async def go():
+        outbox = ReadyOutbox("http://ocr.test/ready")
+        outbox.start()
+        for batch in payload_batches:
+            for payload in batch:
+                outbox.enqueue(payload)
+            await asyncio.sleep(pause)
+        await outbox.close()
+        return outbox
+    return asyncio.run(go())
+
+def ready(robot_id, ts):
+    return {"event": "ready", "robot_id": robot_id, "ts": ts}
+
+def test_coalesces_per_robot(http):
+    outbox = run_outbox([[ready("wro1", 1), ready("wro2", 1), ready("wro1", 2), ready("wro1", 3)]])
+    assert sorted(http.posts, key=lambda p: p["robot_id"]) == [
+        {"event": "ready", "robot_id": "wro1", "ts": 3, "coalesced": 3},
+        {"event": "ready", "robot_id": "wro2", "ts": 1},
+    ]
+    stats = outbox.stats()
+    assert stats["delivered"] == 2 and stats["coalesced"] == 2 and stats["depth"] == 0
+
+def test_separate_windows_are_not_coalesced(http):
+    run_outbox([[ready("wro1", 1)], [ready("wro1", 2)]], pause=0.2)
+    assert http.posts == [ready("wro1", 1), ready("wro1", 2)]
+
+def test_retries_server_errors_then_delivers(http):
+    http.outcomes = [503, ConnectionError("reset"), 429]
+    outbox = run_outbox([[ready("wro1", 1)]])
+    assert len(http.posts) == 4
+    assert outbox.stats()["retries"] == 3 and outbox.stats()["delivered"] == 1
+
+def test_client_errors_are_not_retried(http):
+    http.outcomes = [404]
+    outbox = run_outbox([[ready("wro1", 1)]])
+    assert len(http.posts) == 1 and outbox.stats()["retries"] == 0
+
+def test_gives_up_after_max_retries(http, monkeypatch):
+    monkeypatch.setattr(main, "READY_POST_MAX_RETRIES", 2)
+    http.outcomes = [500, 500, 500, 500]
+    outbox = run_outbox([[ready("wro1", 1)]])
+    assert len(http.posts) == 3
+    assert outbox.stats()["failed"] == 1 and outbox.stats()["delivered"] == 0
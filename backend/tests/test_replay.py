@@ -0,0 +1,61 @@
+# replay.py: pairing WebSocket replies with their requests when MQTT-routed replies interleave
+import collections, json, queue, time, types
+
+import replay
+from replay import ReplayConnection
+
+class FakeSession:
+    """TestClient WebSocket session fed from a queue"""
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.sent = []
+
+    def send_text(self, text):
+        self.sent.append(text)
+
+    def receive(self):
+        return self.inbox.get(timeout=5)
+
+    def deliver(self, text):
+        self.inbox.put({"type": "websocket.send", "text": text})
+
+    def close(self):
+        self.inbox.put({"type": "websocket.close"})
+
+def test_routed_replies_do_not_consume_send_times():
+    session = FakeSession()
+    conn = ReplayConnection(session, server_ws=None)
+    conn.send("make me a coffee")
+    conn.send(json.dumps({"type": "user_meta"}))   # no reply expected
+    time.sleep(0.05)
+    conn.expect_routed("Replay reply 1.")          # MQTT reply is delivered first
+    session.deliver("Replay reply 1.")
+    session.deliver('{"type":"ping","ts":1}')
+    session.deliver("Replay reply 2.")             # the answer to "make me a coffee"
+    conn.drain(2.0)
+    session.close()
+    conn.thread.join(2.0)
+    assert conn.text_received == conn.expected == 2
+    assert conn.routed_received == 1
+    assert len(conn.latencies) == 1 and conn.latencies[0] >= 0.05
+    assert session.sent[-1] == '{"type":"pong"}'
+
+def test_same_text_routed_twice():
+    session = FakeSession()
+    conn = ReplayConnection(session, server_ws=None)
+    conn.send("hello judges")
+    for _ in range(2):
+        conn.expect_routed("Hello judges!")
+    for text in ("Hello judges!", "Hello judges!", "Hello judges!"):
+        session.deliver(text)
+    conn.drain(2.0)
+    session.close()
+    conn.thread.join(2.0)
+    assert conn.routed_received == 2 and len(conn.latencies) == 1
+
+def test_fake_llm_replies_are_numbered():
+    stub = types.SimpleNamespace()
+    counters = collections.Counter()
+    replay.install_stubs(stub, 0.0, 0.0, counters)
+    assert [stub.get_gpt_response([]) for _ in range(2)] == ["Replay reply 1.", "Replay reply 2."]
+    assert counters["llm_calls"] == 2
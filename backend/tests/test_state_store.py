@@ -0,0 +1,115 @@
+# State stores (in-memory and Redis-protocol) and the cross-worker coffee/start claim
+import asyncio, threading
+import pytest
+
+import main
+from main import ACTION_DEDUP_SEC, DedupWindow, InMemoryStateStore, RedisStateStore
+
+def run(coro):
+    return asyncio.run(coro)
+
+# ========= In-memory (single worker) =========
+def test_memory_routes_only_robots_with_local_sockets():
+    async def go():
+        store = InMemoryStateStore()
+        assert await store.robot_workers("wro1") == set()
+        await store.add_robot_socket("wro1")
+        await store.add_robot_socket("wro1")
+        await store.remove_robot_socket("wro1")
+        assert await store.robot_workers("wro1") == {main.WORKER_ID}
+        await store.remove_robot_socket("wro1")
+        assert await store.robot_workers("wro1") == set()
+        assert await store.robot_workers(None) == {main.WORKER_ID}
+    run(go())
+
+def test_memory_send_to_worker_calls_handler():
+    got = []
+    async def handler(message):
+        got.append(message)
+    async def go():
+        store = InMemoryStateStore()
+        await store.send_to_worker(main.WORKER_ID, {"type": "dropped before start"})
+        await store.start(handler)
+        await store.send_to_worker(main.WORKER_ID, {"type": "config"})
+    run(go())
+    assert got == [{"type": "config"}]
+
+def test_memory_claim_defers_to_local_window():
+    async def go():
+        store = InMemoryStateStore()
+        return [await store.claim_event("k", 10) for _ in range(2)]
+    assert run(go()) == [True, True]
+
+def test_memory_conversation_and_config():
+    async def go():
+        store = InMemoryStateStore()
+        await store.append_conversation("mqtt", [{"n": i} for i in range(5)], max_messages=3)
+        await store.save_config({"default_robot_id": "wro2"})
+        await store.save_config({"mqtt_broker": "b"})
+        return await store.load_conversation("mqtt"), await store.load_config()
+    conv, config = run(go())
+    assert conv == [{"n": 2}, {"n": 3}, {"n": 4}]
+    assert config == {"default_robot_id": "wro2", "mqtt_broker": "b"}
+
+# ========= Redis-protocol (multi-worker) =========
+@pytest.fixture
+def redis_pair():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisStateStore(redis_client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+
+def test_redis_claim_is_exclusive_across_workers(redis_pair):
+    async def go():
+        a, b = redis_pair(), redis_pair()
+        return await a.claim_event("robot/notify|wro1|x", 10), await b.claim_event("robot/notify|wro1|x", 10)
+    assert run(go()) == (True, False)
+
+def test_redis_routes_to_live_workers_only(redis_pair, monkeypatch):
+    async def go():
+        a, b = redis_pair(), redis_pair()
+        monkeypatch.setattr(main, "WORKER_ID", "worker-a")
+        await a._heartbeat_once()
+        await a.add_robot_socket("wro1")
+        monkeypatch.setattr(main, "WORKER_ID", "worker-b")
+        await b.add_robot_socket("wro1")   # b never heartbeats: treated as dead
+        routed = await a.robot_workers("wro1"), await a.robot_workers(None), await a.robot_workers("wro2")
+        monkeypatch.setattr(main, "WORKER_ID", "worker-a")
+        await a.remove_robot_socket("wro1")
+        return routed + (await b.robot_workers("wro1"),)
+    assert run(go()) == ({"worker-a"}, {"worker-a"}, set(), set())
+
+def test_redis_conversation_is_shared(redis_pair):
+    async def go():
+        a, b = redis_pair(), redis_pair()
+        await a.append_conversation("mqtt", [{"role": "user", "content": "咖啡"}], max_messages=2)
+        await b.append_conversation("mqtt", [{"n": 1}, {"n": 2}], max_messages=2)
+        return await a.load_conversation("mqtt")
+    assert run(go()) == [{"n": 1}, {"n": 2}]
+
+# ========= coffee/start =========
+@pytest.fixture
+def published(monkeypatch):
+    sent = []
+    def publish(topic, payload, hostname):
+        sent.append((topic, threading.current_thread()))
+    monkeypatch.setattr(main, "mqtt_publish_single", publish)
+    monkeypatch.setattr(main, "action_dedup", DedupWindow("outbound_actions", ACTION_DEDUP_SEC))
+    return sent
+
+def test_coffee_start_published_once_off_the_loop(published, monkeypatch):
+    monkeypatch.setattr(main, "state_store", InMemoryStateStore())
+    async def go():
+        return [await main.publish_coffee_start("wro1") for _ in range(2)] + [await main.publish_coffee_start("wro2")]
+    assert run(go()) == [True, False, True]
+    assert [topic for topic, _ in published] == [main.MQTT_PUB_TOPIC] * 2
+    assert all(thread is not threading.main_thread() for _, thread in published)
+
+def test_coffee_start_claimed_by_another_worker(published, monkeypatch, redis_pair):
+    other = redis_pair()
+    monkeypatch.setattr(main, "state_store", redis_pair())
+    async def go():
+        assert await other.claim_event("coffee/start|wro1", ACTION_DEDUP_SEC)
+        return await main.publish_coffee_start("wro1")
+    assert run(go()) is False
+    assert published == []
+    assert main.action_dedup.stats()["suppressed"] == 1
@@ -4,13 +4,15 @@
 # PATROL(蛇形+擺頭) → TRACK(對準等待揮手，頭回正) → ADVANCE(前進接近)
 # 額外：強化 VS Code Output 收到日誌（stdout+stderr + 取消緩衝 + 心跳輸出）
 
-import json, time, sys, os
+import json, time, sys, os, uuid, queue, threading, collections
 import paho.mqtt.client as mqtt
 from ev3dev2.motor import MoveTank, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D, SpeedPercent
 from ev3dev2.sensor.lego import UltrasonicSensor
 from ev3dev2.sound import Sound
 
-# ========== 讓 VS Code Output 一定看得到 ==========
+from us_filter import DistanceFilter
+
+# ========== 日誌（VS Code Output 看得到，且不拖慢控制迴圈）==========
 def _set_line_buffered(stream):
     try:
         # Py 3.7+ 支援
@@ -25,17 +27,97 @@ def _set_line_buffered(stream):
 sys.stdout = _set_line_buffered(sys.stdout)
 sys.stderr = _set_line_buffered(sys.stderr)
 
-def log(*args):
-    s = " ".join(str(a) for a in args)
-    # 同時寫到 stdout / stderr（外掛兩邊都吃得到）
-    try:
-        sys.stdout.write(s + "\n"); sys.stdout.flush()
-    except Exception:
-        pass
-    try:
-        sys.stderr.write(s + "\n"); sys.stderr.flush()
-    except Exception:
-        pass
+# log() only formats the line and appends it to a ring buffer; a background thread writes
+# the batch to LOG_SINK every LOG_FLUSH_SEC (WARN/ERROR wake it at once). Lines repeated
+# within LOG_REPEAT_SEC are dropped and counted; the count is logged as "(xN suppressed)"
+# once the window ends (or at close). When the ring is full the oldest lines go.
+DEBUG, INFO, WARN, ERROR = 10, 20, 30, 40
+LOG_LEVEL      = INFO       # DEBUG prints every MQTT message
+LOG_SINK       = sys.stdout
+LOG_FLUSH_SEC  = 0.5
+LOG_RING_SIZE  = 500
+LOG_REPEAT_SEC = 2.0
+_LEVEL_TAG = {DEBUG: "D", INFO: "I", WARN: "W", ERROR: "E"}
+
+class RingLogger(object):
+    def __init__(self, sink):
+        self.sink = sink
+        self.ring = collections.deque(maxlen=LOG_RING_SIZE)
+        self.appended = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.repeats = {}   # text -> [last_time, suppressed, level]
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="log-flush", daemon=True)
+        self.thread.start()
+
+    def _append(self, now, level, text):
+        self.ring.append("{}.{:03d} {} {}".format(time.strftime("%H:%M:%S", time.localtime(now)),
+                                                 int(now * 1000) % 1000, _LEVEL_TAG.get(level, "I"), text))
+        self.appended += 1
+
+    def _end_repeat(self, now, text):
+        # Caller holds self.lock: log the suppressed count of `text`, then forget it
+        _, suppressed, level = self.repeats.pop(text)
+        if suppressed:
+            self._append(now, level, "{} (x{} suppressed)".format(text, suppressed))
+
+    def _expire_repeats(self, now, force=False):
+        for text in [t for t, seen in self.repeats.items() if force or now - seen[0] >= LOG_REPEAT_SEC]:
+            self._end_repeat(now, text)
+
+    def emit(self, level, text):
+        now = time.time()
+        with self.lock:
+            seen = self.repeats.get(text)
+            if seen is not None and now - seen[0] < LOG_REPEAT_SEC:
+                seen[1] += 1
+                return
+            if seen is not None:
+                self._end_repeat(now, text)
+            if len(self.repeats) > 256:
+                self._expire_repeats(now, force=True)
+            self.repeats[text] = [now, 0, level]
+            self._append(now, level, text)
+        if level >= WARN:
+            self.wake.set()
+
+    def flush(self, final=False):
+        with self.lock:
+            self._expire_repeats(time.time(), force=final)
+            lines = list(self.ring)
+            self.ring.clear()
+            dropped = self.appended - self.written - len(lines)
+            self.written = self.appended
+        if dropped > 0:
+            lines.insert(0, "[LOG] ring full, dropped {} line(s)".format(dropped))
+        if not lines:
+            return
+        try:
+            self.sink.write("\n".join(lines) + "\n")
+            self.sink.flush()
+        except Exception:
+            pass
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join(2.0)
+        self.flush(final=True)
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(LOG_FLUSH_SEC)
+            self.wake.clear()
+            self.flush()
+
+_logger = RingLogger(LOG_SINK)
+
+def log(*args, level=INFO):
+    if level < LOG_LEVEL:
+        return
+    _logger.emit(level, " ".join(str(a) for a in args))
 
 # ===== MQTT Configuration =====
 # Set USE_CLOUD_BROKER = True to use EMQX Cloud, False for local testing
@@ -58,10 +140,58 @@ MQTT_PORT = CLOUD_PORT if USE_CLOUD_BROKER else LOCAL_PORT
 # Topics
 TOPIC_IN     = "robot/events"   # Receive: pos, wave, coffee commands
 NOTIFY_TOPIC = "robot/notify"   # Send: notifications to backend
+ACTUATOR_TOPIC = "robot/notify/actuator"  # Send: actuator command completions (not read by the backend LLM)
 
 # Robot ID (IMPORTANT: Change this for each robot!)
 ROBOT_ID = "wro1"  # Options: wro1, wro2, lab1, etc.
 
+# ===== 事件通知（MQTT callback → 狀態機）=====
+# Callbacks update the state globals and then put (kind, rx_time) on EVENTS; every wait
+# in the main program blocks on this queue with a timeout instead of sleep-polling, so a
+# wave / coffee message wakes the state machine as soon as it arrives.
+LOOP_PERIOD  = 0.05   # control loop period when no message arrives
+WAIT_LOG_SEC = 2.0    # how often the pre-start waits log while idle
+EVENTS = queue.Queue()
+wake_n, wake_sum, wake_max = 0, 0.0, 0.0
+
+def signal(kind):
+    EVENTS.put((kind, time.time()))
+
+def wait_event(timeout):
+    """Block until an MQTT event arrives or `timeout` elapses; returns the event kind or None"""
+    global wake_n, wake_sum, wake_max
+    try:
+        kind, t_rx = EVENTS.get(timeout=timeout)
+    except queue.Empty:
+        return None
+    lat = time.time() - t_rx
+    wake_n += 1; wake_sum += lat; wake_max = max(wake_max, lat)
+    return kind
+
+def drain_events():
+    # Drop events queued during choreography sleeps so they don't count as wake latency
+    while True:
+        try:
+            EVENTS.get_nowait()
+        except queue.Empty:
+            return
+
+def wake_report():
+    global wake_n, wake_sum, wake_max
+    text = "wake n={} avg={:.1f}ms max={:.1f}ms".format(
+        wake_n, wake_sum / wake_n * 1000.0 if wake_n else 0.0, wake_max * 1000.0)
+    wake_n, wake_sum, wake_max = 0, 0.0, 0.0
+    return text
+
+def wait_until(cond, label):
+    next_log = 0.0
+    while not cond():
+        wait_event(WAIT_LOG_SEC)
+        now = time.time()
+        if now >= next_log:
+            next_log = now + WAIT_LOG_SEC
+            log("[WAIT]", label, wake_report())
+
 # ===== 方向/行為參數 =====
 YAW_DIR     = 1       # 左右反了就 -1
 FORWARD_DIR = -1      # 前後反了就 -1
@@ -99,6 +229,138 @@ us   = UltrasonicSensor()
 head = MediumMotor(OUTPUT_D)
 snd  = Sound()
 hand = MediumMotor(OUTPUT_A)
+
+# ===== 致動器佇列（手臂/頭部馬達）=====
+# Motor commands run in order on one worker thread per motor, so blocking moves (the
+# coffee sequence takes >10 s) never run in paho's network thread or the control loop.
+# Commands submitted with report=True send a completion over notify_event.
+COFFEE_HOLD_SEC = 10.0
+
+class Actuator(object):
+    def __init__(self, name, motor):
+        self.name = name
+        self.motor = motor
+        self.q = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="act-" + name, daemon=True)
+        self.thread.start()
+
+    def submit(self, label, fn, report=False):
+        self.q.put((label, fn, report))
+
+    def stop(self, timeout=30.0):
+        # Finish what is queued (e.g. raising the hand again) before the program exits
+        self.q.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                return
+            label, fn, report = item
+            t0 = time.time()
+            try:
+                fn(self.motor)
+                ok = True
+            except Exception as e:
+                ok = False
+                log("[ACT]", self.name, label, "error:", e, level=ERROR)
+            if report:
+                notify_event("actuator_done", "actuator", dest=ACTUATOR_TOPIC, motor=self.name,
+                             command=label, ok=ok, duration_ms=int((time.time() - t0) * 1000))
+
+head_act = Actuator("head", head)
+hand_act = Actuator("hand", hand)
+
+def coffee_sequence(motor):
+    global END
+    motor.on_for_degrees(SpeedPercent(100), -90, brake=True, block=True)
+    END = 1
+    signal("coffee")
+    log("Coffee action complete")
+    time.sleep(COFFEE_HOLD_SEC)
+    motor.on_for_degrees(SpeedPercent(100), 90, brake=True, block=True)
+
+# ===== 超音波取樣執行緒 =====
+# Samples the ultrasonic sensor at US_SAMPLE_HZ on its own thread by re-reading the sysfs
+# value0 file it keeps open (falls back to us.distance_centimeters off-brick), filters with
+# a median of the last US_MEDIAN_N readings followed by an EMA (DistanceFilter, us_filter.py),
+# and publishes the result as a single (distance, time) tuple the control loop reads without
+# locking. A lone spike at STOP_CM can no longer end the approach early.
+US_SAMPLE_HZ  = 20.0
+US_MEDIAN_N   = 5
+US_EMA_ALPHA  = 0.5
+US_STALE_SEC  = 0.5     # no good sample for this long -> report US_NO_READING
+US_NO_READING = 255
+
+class UltrasonicSampler(object):
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.latest = (float(US_NO_READING), 0.0)
+        self.filter = DistanceFilter(US_MEDIAN_N, US_EMA_ALPHA, US_STALE_SEC)
+        self.fp, self.scale = self._open_value_file()
+        self.stats_lock = threading.Lock()   # _run adds, report() swaps the interval counters out
+        self.n, self.errors, self.lat_sum, self.lat_max = 0, 0, 0.0, 0.0
+        self.since = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="us-sampler", daemon=True)
+        self.thread.start()
+
+    def _open_value_file(self):
+        try:
+            self.sensor.mode = self.sensor.MODE_US_DIST_CM
+            scale = 10.0 ** -int(self.sensor.decimals)
+            return open(os.path.join(self.sensor._path, "value0"), "rb", buffering=0), scale
+        except Exception as e:
+            log("[US] sysfs value0 unavailable, using distance_centimeters:", e, level=WARN)
+            return None, 1.0
+
+    def _read(self):
+        if self.fp is None:
+            return float(self.sensor.distance_centimeters)
+        self.fp.seek(0)
+        return int(self.fp.read()) * self.scale
+
+    def distance(self, now):
+        d, t = self.latest
+        return d if now - t <= US_STALE_SEC else float(US_NO_READING)
+
+    def report(self):
+        now = time.time()
+        with self.stats_lock:
+            n, errors, lat_sum, lat_max = self.n, self.errors, self.lat_sum, self.lat_max
+            self.n, self.errors, self.lat_sum, self.lat_max = 0, 0, 0.0, 0.0
+            since, self.since = self.since, now
+        return "us rate={:.1f}Hz read avg={:.2f}ms max={:.2f}ms err={}".format(
+            n / max(now - since, 1e-6), lat_sum / n * 1000.0 if n else 0.0, lat_max * 1000.0, errors)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(1.0)
+        if self.fp is not None:
+            self.fp.close()
+
+    def _run(self):
+        period = 1.0 / US_SAMPLE_HZ
+        next_t = time.time()
+        while self.running:
+            t0 = time.time()
+            try:
+                raw = self._read()
+                failed = 0
+            except Exception:
+                raw, failed = None, 1
+            lat = time.time() - t0
+            with self.stats_lock:
+                self.n += 1; self.errors += failed
+                self.lat_sum += lat; self.lat_max = max(self.lat_max, lat)
+            if raw is not None:
+                self.latest = (self.filter.add(raw, t0), t0)
+            next_t += period
+            time.sleep(max(0.0, next_t - time.time()))
+
+us_sampler = UltrasonicSampler(us)
+
 # ===== 狀態 =====
 STATE_PATROL  = "PATROL"
 STATE_TRACK   = "TRACK"
@@ -136,10 +398,9 @@ def head_to(out_deg, speed_pct=HEAD_SPEED, block=False):
     dir_sign = 1 if out_deg >= 0 else -1
     bias = (BACKLASH_OUT * dir_sign) if dir_sign != last_dir_sign else 0.0
     last_dir_sign = dir_sign
-    try:
-        head.on_to_position(SpeedPercent(speed_pct), out_to_motor_deg(out_deg + bias), block=block)
-    except Exception:
-        pass
+    target = out_to_motor_deg(out_deg + bias)
+    head_act.submit("head_to {}".format(int(out_deg)),
+                    lambda m: m.on_to_position(SpeedPercent(speed_pct), target, block=block))
 
 def swing_head(now):
     global next_swing_time, head_target_out
@@ -151,20 +412,38 @@ def swing_head(now):
 def center_head():
     head_to(0.0, speed_pct=HEAD_SPEED, block=False)
 
-# ===== MQTT: 接收（影像端→EV3） =====
-def on_connect_in(c, u, f, rc):
-    log("[DEBUG] on_connect_in callback fired! rc=", rc)
-    log("RX-MQTT connected rc=", rc, "broker=", BROKER_IP)
-    if rc == 0:
-        c.subscribe(TOPIC_IN)
-        log("RX-MQTT subscribed:", TOPIC_IN)
-    else:
-        log("[ERROR] RX-MQTT connection failed with rc=", rc)
+# ===== MQTT: 單一連線（接收 robot/events + 發送 robot/notify）=====
+# One client both subscribes and publishes: one TLS handshake, one keepalive stream and
+# one network thread. paho's loop thread reconnects with backoff (MQTT_RECONNECT_*) and
+# on_connect resubscribes after every (re)connect.
+MQTT_KEEPALIVE         = 60
+MQTT_RECONNECT_MIN_SEC = 1
+MQTT_RECONNECT_MAX_SEC = 30
+mqtt_connected = False
+mqtt_connect_start = 0.0
+
+def on_connect(c, u, f, rc):
+    global mqtt_connected
+    if rc != 0:
+        log("[ERROR] MQTT connection failed with rc=", rc, level=ERROR)
+        return
+    mqtt_connected = True
+    log("MQTT connected rc=", rc, "broker=", BROKER_IP,
+        "in {:.0f}ms".format((time.time() - mqtt_connect_start) * 1000.0))
+    c.subscribe(TOPIC_IN)
+    log("MQTT subscribed:", TOPIC_IN)
+
+def on_disconnect(c, u, rc):
+    global mqtt_connected, mqtt_connect_start
+    mqtt_connected = False
+    mqtt_connect_start = time.time()
+    if rc != 0:
+        log("MQTT disconnected rc=", rc, "- reconnecting", level=WARN)
 
 def on_message_in(c, u, msg):
-    global last_pos, last_pos_time, wave_request, have_person_until, move, ALL_START, END
+    global last_pos, last_pos_time, wave_request, have_person_until, move, ALL_START
     t = time.time()
-    log("[DEBUG] on_message_in fired! Topic:", msg.topic, "Payload:", msg.payload.decode())
+    log("[DEBUG] on_message_in fired! Topic:", msg.topic, "Payload:", msg.payload.decode(), level=DEBUG)
     try:
         p = json.loads(msg.payload.decode())
         ev, val = p.get("event"), p.get("value")
@@ -172,7 +451,7 @@ def on_message_in(c, u, msg):
         
         # Filter by robot_id (ignore messages for other robots)
         if msg_robot_id and msg_robot_id != ROBOT_ID:
-            log("[IGNORE] Message for robot '{}', I am '{}'".format(msg_robot_id, ROBOT_ID))
+            log("[IGNORE] Message for robot '{}', I am '{}'".format(msg_robot_id, ROBOT_ID), level=DEBUG)
             return
         
         # Process messages for this robot
@@ -180,7 +459,8 @@ def on_message_in(c, u, msg):
             last_pos = val
             last_pos_time = t
             have_person_until = t + PRESENCE_HOLD_SEC
-            log("RX pos:", val)
+            log("RX pos:", val, level=DEBUG)
+            signal("pos")
         elif ev == "wave" and val == "R":
             ALL_START = 1
             move = 1
@@ -188,121 +468,108 @@ def on_message_in(c, u, msg):
             last_pos_time = t
             have_person_until = t + PRESENCE_HOLD_SEC
             log("RX wave: R ->", ROBOT_ID)
+            signal("wave")
         elif ev == "coffee" and val == "start":
             log("[{}] RX coffee start command!".format(ROBOT_ID))
-            hand.on_for_degrees(SpeedPercent(100), -90, brake=True, block=True)
-            END = 1
-            log("Coffee action complete")
-            time.sleep(10)
-            hand.on_for_degrees(SpeedPercent(100), 90, brake=True, block=True)
+            hand_act.submit("coffee", coffee_sequence, report=True)
         else:
             log("RX unknown:", ev, "val:", val)
     except Exception as e:
-        log("parse error:", e)
+        log("parse error:", e, level=ERROR)
 
-client_in = mqtt.Client(protocol=mqtt.MQTTv311)
+client = mqtt.Client(client_id="ev3-{}-{}".format(ROBOT_ID, uuid.uuid4().hex[:6]), protocol=mqtt.MQTTv311)
 
 # Enable SSL/TLS for cloud broker
 if USE_CLOUD_BROKER:
     try:
-        client_in.username_pw_set(CLOUD_USERNAME, CLOUD_PASSWORD)
-        client_in.tls_set()  # Use default CA certificates
+        client.username_pw_set(CLOUD_USERNAME, CLOUD_PASSWORD)
+        client.tls_set()  # Use default CA certificates
         log("MQTT SSL/TLS enabled for cloud broker")
     except Exception as e:
-        log("SSL setup error:", e)
+        log("SSL setup error:", e, level=ERROR)
 
-client_in.on_connect = on_connect_in
-client_in.on_message = on_message_in
+client.on_connect = on_connect
+client.on_disconnect = on_disconnect
+client.on_message = on_message_in
+client.reconnect_delay_set(MQTT_RECONNECT_MIN_SEC, MQTT_RECONNECT_MAX_SEC)
 
-log("[DEBUG] RX-MQTT: About to connect to {}:{}".format(BROKER_IP, MQTT_PORT))
 try:
-    client_in.connect(BROKER_IP, MQTT_PORT, 60)
-    log("[DEBUG] RX-MQTT: connect() call succeeded")
-    client_in.loop_start()
-    log("[DEBUG] RX-MQTT: loop_start() called")
+    mqtt_connect_start = time.time()
+    # connect_async: the loop thread keeps retrying if the broker isn't reachable yet
+    client.connect_async(BROKER_IP, MQTT_PORT, MQTT_KEEPALIVE)
+    client.loop_start()
     log("Connecting to MQTT broker: {}:{}".format(BROKER_IP, MQTT_PORT))
 except Exception as e:
-    log("MQTT connection error:", e)
-    import traceback
-    traceback.print_exc()
-
-# ===== MQTT: 通知（EV3→Backend） =====
-notify = mqtt.Client(protocol=mqtt.MQTTv311)
-
-# Enable SSL/TLS for cloud broker (notify channel)
-if USE_CLOUD_BROKER:
-    try:
-        notify.username_pw_set(CLOUD_USERNAME, CLOUD_PASSWORD)
-        notify.tls_set()
-        log("TX-MQTT SSL/TLS enabled")
-    except Exception as e:
-        log("TX-MQTT SSL setup error:", e)
-
-notify_connected = False
-def on_connect_notify(c, u, f, rc):
-    global notify_connected
-    notify_connected = True
-    log("TX-MQTT connected rc=", rc, "broker=", BROKER_IP)
-
-notify.on_connect = on_connect_notify
-try:
-    notify.connect_async(BROKER_IP, MQTT_PORT, 60)
-    notify.loop_start()
-    log("TX-MQTT connecting to {}:{}".format(BROKER_IP, MQTT_PORT))
-except Exception as _e:
-    log("TX-MQTT connect_async failed:", _e)
-
-def notify_event(event, topic, **kv):
-    payload = {
-        "event": event, 
-        "ts": int(time.time()),
-        "robot_id": ROBOT_ID  # CRITICAL: Include robot_id for backend filtering
-    }
-    payload.update(kv)
-    
-    try:
-        if topic == "hello":
-            # Special "hello" message with action + robot_id
-            pl = json.dumps({
-                "action": "Say something like hello judges, then use the system prompt I give you to start the conversation, dont say too many things",
-                "robot_id": ROBOT_ID  # CRITICAL: Include robot_id here too
-            })
-            notify.publish(NOTIFY_TOPIC, pl, qos=0)
-            log("TX [hello]:", pl)
-        else:
-            # Standard event message with robot_id
-            notify.publish(NOTIFY_TOPIC, json.dumps(payload), qos=0)
-            log("TX:", payload)
-    except Exception as e:
-        log("TX error:", e)
+    log("MQTT connection error:", e, level=ERROR)
+
+# Idempotency: an event_id names one physical event (boot + event + per-boot sequence), so the
+# backend drops every re-send of it. Retries below, or a caller passing event_id back in,
+# reuse the id instead of minting a new one.
+BOOT_ID = uuid.uuid4().hex[:8]
+NOTIFY_RETRIES = 3
+NOTIFY_RETRY_SEC = 1.0
+_event_seq = collections.Counter()
+_event_seq_lock = threading.Lock()   # actuator threads notify too
+
+def new_event_id(event):
+    with _event_seq_lock:
+        _event_seq[event] += 1
+        return "{}-{}-{}".format(BOOT_ID, event, _event_seq[event])
+
+def notify_event(event, topic, dest=NOTIFY_TOPIC, event_id=None, **kv):
+    """Publish one event (retrying while MQTT is down) and return its event_id"""
+    event_id = event_id or new_event_id(event)
+    if topic == "hello":
+        # Special "hello" message with action + robot_id
+        dest, payload = NOTIFY_TOPIC, {
+            "action": "Say something like hello judges, then use the system prompt I give you to start the conversation, dont say too many things",
+            "robot_id": ROBOT_ID,  # CRITICAL: Include robot_id here too
+            "event_id": event_id
+        }
+    else:
+        # Standard event message with robot_id
+        payload = {
+            "event": event,
+            "ts": int(time.time()),
+            "robot_id": ROBOT_ID,  # CRITICAL: Include robot_id for backend filtering
+            "event_id": event_id
+        }
+        payload.update(kv)
+    pl = json.dumps(payload)
+
+    for attempt in range(NOTIFY_RETRIES):
+        try:
+            if client.publish(dest, pl, qos=0).rc == mqtt.MQTT_ERR_SUCCESS:
+                log("TX [{}]:".format(topic), pl)
+                return event_id
+            log("TX [{}] not connected, retry {}/{}".format(topic, attempt + 1, NOTIFY_RETRIES), level=WARN)
+        except Exception as e:
+            log("TX error:", e, level=ERROR)
+        time.sleep(NOTIFY_RETRY_SEC)
+    log("TX [{}] gave up:".format(topic), pl, level=ERROR)
+    return event_id
 
 # ===== 心跳輸出（每 N 秒印一次狀態，方便在 Output 監看）=====
 DEBUG_HEARTBEAT_SEC = 2.0
 _last_hb = 0.0
+_last_cpu = time.process_time()
 def heartbeat(now, dist_cm):
-    global _last_hb
+    global _last_hb, _last_cpu
     if now - _last_hb >= DEBUG_HEARTBEAT_SEC:
-        _last_hb = now
-        log("[HB] state=", state, "pos=", last_pos, "dist_cm=", int(dist_cm))
+        cpu = time.process_time()
+        cpu_pct = (cpu - _last_cpu) / (now - _last_hb) * 100.0 if _last_hb else 0.0
+        _last_hb, _last_cpu = now, cpu
+        log("[HB] state=", state, "pos=", last_pos, "dist_cm=", int(dist_cm), "mqtt=", mqtt_connected,
+            "cpu={:.0f}%".format(cpu_pct), wake_report(), us_sampler.report())
 
 # ===== 主迴圈 =====
 try:
     log("=== PROGRAM START ===")
-    log("BROKER_IN =", BROKER_IP, "TOPIC_IN =", TOPIC_IN)
-    log("BROKER_NOTIFY =", BROKER_IP, "TOPIC =", NOTIFY_TOPIC)
+    log("BROKER =", BROKER_IP, "TOPIC_IN =", TOPIC_IN, "NOTIFY_TOPIC =", NOTIFY_TOPIC)
     dist_cm = 255
     #hand.on_for_degrees(SpeedPercent(100), 90, brake=True, block=True)
-    while True:
-        try:
-            dist_cm = us.distance_centimeters
-        except Exception:
-            dist_cm = 255
-        #log("dist_cm = ",dist_cm)
-        log("ALL_START = ",ALL_START)
-        if ALL_START == 1:
-            break
-            #pass
-        time.sleep(0.5)
+    wait_until(lambda: ALL_START == 1, "ALL_START")
+    dist_cm = us_sampler.distance(time.time())
     #tank.on(SpeedPercent(PATROL_SPEED * FORWARD_DIR), SpeedPercent(PATROL_SPEED * FORWARD_DIR))
     snd.beep()
     time.sleep(2)
@@ -313,11 +580,8 @@ try:
     time.sleep(3)
     notify_event("hello", "hello", distance_cm=int(dist_cm))
     move=0
-    while True:
-        log(move)
-        if move==1:
-            break
-        time.sleep(0.5)
+    drain_events()
+    wait_until(lambda: move == 1, "move")
     center_head()
     wave_request = False
     time.sleep(3)
@@ -329,17 +593,15 @@ try:
     next_swing_time = time.time() + HEAD_PERIOD
     head_scanning = True
     log("Head scan: ON")
+    drain_events()
 
     person_announced = False
     while True:
         now = time.time()
         present = ((now - last_pos_time) <= NO_POS_TIMEOUT) or (now < have_person_until)
 
-        # 距離（容錯）
-        try:
-            dist_cm = us.distance_centimeters
-        except Exception:
-            dist_cm = 255
+        # 距離（取樣執行緒的濾波值，過期則 255）
+        dist_cm = us_sampler.distance(now)
 
         # 頭掃描（PATROL）
         if head_scanning:
@@ -424,25 +686,24 @@ try:
                 # head_scanning = True
                 log("Reached {} cm -> {}".format(STOP_CM, state))
                 notify_event("start", "start", distance_cm=int(dist_cm))
-                while True:
-                    if END == 1:
-                        break
-                    # log("End(Waiting for motor)")
-                    time.sleep(0.5)
+                wait_until(lambda: END == 1, "END")
                 break
 
-        time.sleep(0.05)
+        # 下一週期或 MQTT 訊息到達（先到者）就重新評估狀態機
+        wait_event(LOOP_PERIOD)
     
 
 except KeyboardInterrupt:
     pass
 finally:
     tank.off(brake=True)
-    client_in.loop_stop()
-    client_in.disconnect()
+    us_sampler.stop()
+    hand_act.stop()
+    head_act.stop(timeout=2.0)
     try:
-        notify.loop_stop()
-        notify.disconnect()
+        client.disconnect()
+        client.loop_stop()
     except Exception:
         pass
     log("=== PROGRAM END ===")
+    _logger.close()
@@ -0,0 +1,4 @@
+# main.py runs from ev3_movement/ and imports us_filter as a top-level module
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+# Ultrasonic median + EMA filter
+from us_filter import DistanceFilter
+
+def feed(f, readings, dt=0.05, t0=0.0):
+    return [f.add(raw, t0 + i * dt) for i, raw in enumerate(readings)]
+
+def test_single_spike_is_rejected():
+    f = DistanceFilter(5, 0.5, 0.5)
+    out = feed(f, [80, 80, 80, 3, 80, 80])
+    assert out == [80, 80, 80, 80, 80, 80]
+
+def test_ema_smooths_a_step():
+    f = DistanceFilter(1, 0.5, 0.5)
+    assert feed(f, [100, 60, 60, 60]) == [100, 80, 70, 65]
+
+def test_median_then_ema():
+    f = DistanceFilter(3, 0.5, 0.5)
+    # medians: 100, 100 (of 100/40 -> upper), 40, 40
+    assert feed(f, [100, 40, 40, 40]) == [100, 100, 70, 55]
+
+def test_dropout_restarts_the_filter():
+    f = DistanceFilter(5, 0.5, 0.5)
+    feed(f, [200, 200, 200])
+    # next good reading arrives after the stale window: no blending with 200
+    assert f.add(30, 0.1 + 0.5 + 0.01) == 30
+    assert list(f.window) == [30]
+
+def test_gap_within_stale_window_keeps_history():
+    f = DistanceFilter(5, 0.5, 0.5)
+    feed(f, [200, 200, 200])
+    assert f.add(30, 0.1 + 0.4) == 200
@@ -0,0 +1,28 @@
+# coding: utf-8
+# Median + EMA filter for the ultrasonic sampler in main.py. Kept free of ev3dev2 so it
+# can be exercised off-brick; stays Python 3.5 compatible like main.py.
+import collections
+
+class DistanceFilter(object):
+    """
+    Median of the last `median_n` readings followed by an EMA with weight `alpha`.
+    A reading more than `stale_sec` after the previous one starts the filter fresh
+    instead of blending with the old distance.
+    """
+    def __init__(self, median_n, alpha, stale_sec):
+        self.alpha = alpha
+        self.stale_sec = stale_sec
+        self.window = collections.deque(maxlen=median_n)
+        self.ema = None
+        self.last_t = None
+
+    def add(self, raw, t):
+        """Feed one raw reading taken at time `t`; returns the filtered distance"""
+        if self.last_t is not None and t - self.last_t > self.stale_sec:
+            self.window.clear()
+            self.ema = None
+        self.last_t = t
+        self.window.append(raw)
+        med = sorted(self.window)[len(self.window) // 2]
+        self.ema = med if self.ema is None else self.ema + self.alpha * (med - self.ema)
+        return self.ema
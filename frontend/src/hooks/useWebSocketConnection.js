@@ -7,6 +7,17 @@
 
 import { useState, useEffect, useRef, useCallback } from 'react';
 
+// 後端心跳訊框 {"type": "ping", ...}：解析 JSON 判斷，不依賴序列化的空白或鍵順序
+function isPing(data) {
+    if (!data.includes("ping")) return false;
+    try {
+        const msg = JSON.parse(data);
+        return msg !== null && typeof msg === "object" && msg.type === "ping";
+    } catch (e) {
+        return false;
+    }
+}
+
 // WebSocket連線配置（SSR安全）
 function getWsUrl() {
     const envHost = process.env.REACT_APP_WS_HOST;
@@ -97,6 +108,11 @@ class WebSocketManager {
                     this.connectionState.pendingAudio = url;
                     this.notifyListeners('audioReceived', url);
                 } else {
+                    // 後端心跳：回覆 pong，不當作文字回覆
+                    if (isPing(event.data)) {
+                        this.ws.send(JSON.stringify({ type: "pong" }));
+                        return;
+                    }
                     // 文字回覆
                     this.connectionState.latestReply = event.data;
                     this.notifyListeners('textReceived', event.data);
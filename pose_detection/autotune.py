@@ -0,0 +1,150 @@
+# Autotune: sweep speed settings on a recorded clip and write pose_config.json
+import cv2, time, os, json
+
+from gestures import GestureState, analyze_pose, first_person
+from backends import load_model, read_frames
+from tracking import FULL_IMGSZ, KeypointTracker
+
+# ========= Autotune =========
+# python pc_publisher.py --autotune clip.mp4 sweeps capture width, model input size,
+# inference threads, OpenCV threads and frame skip (--infer-every) on a recorded clip.
+# Each trial replays the clip through the real gesture logic, with clip time as the
+# clock, and is compared with a reference run (native resolution, 640, every frame).
+# The fastest setting that still agrees with the reference on waves and positions is
+# written to POSE_CONFIG_PATH, which parse_args loads as defaults at startup.
+POSE_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pose_config.json")
+TUNED_KEYS = ("model", "threads", "imgsz", "cv2_threads", "cap_width", "cap_height", "infer_every")
+AUTOTUNE_FRAMES = 300
+AUTOTUNE_MIN_WAVE_AGREEMENT = 0.9
+AUTOTUNE_MIN_POS_AGREEMENT = 0.95
+AUTOTUNE_WAVE_TOLERANCE = 0.5   # seconds between matching wave events
+AUTOTUNE_SPACE = {
+    "cap_width":   [0, 960, 640, 480],     # 0 = clip's native width
+    "imgsz":       [640, 512, 416, 320],
+    "threads":     sorted({0, 1, 2, max(1, (os.cpu_count() or 2) // 2), os.cpu_count() or 2}),
+    "cv2_threads": [-1, 0, 1],             # -1 = OpenCV default
+    "infer_every": [1, 2, 3, 4],
+}
+
+def load_config(path=POSE_CONFIG_PATH):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            config = json.load(fp)
+    except Exception as e:
+        print(f"[CONFIG] ignoring {path}: {e}")
+        return {}
+    config = {k: v for k, v in config.items() if k in TUNED_KEYS}
+    print(f"[CONFIG] loaded {path}: {config}")
+    return config
+
+CV2_DEFAULT_THREADS = cv2.getNumThreads()
+
+def simulate(backend, frames, clip_fps, cfg):
+    """Replay frames through inference + gesture logic with one configuration"""
+    h0, w0 = frames[0].shape[:2]
+    width = cfg["cap_width"] or w0
+    size = (width, int(round(h0 * width / w0)))
+    events, positions = [], []
+    clock = [0.0]
+    st = GestureState(publish=lambda event, value, topic: events.append((clock[0], event, value)))
+    tracker = KeypointTracker(cfg["infer_every"]) if cfg["infer_every"] > 1 else None
+    infer_ms = []
+    # Always set it: a -1 trial must not inherit the count a previous trial left behind
+    cv2.setNumThreads(cfg["cv2_threads"] if cfg["cv2_threads"] >= 0 else CV2_DEFAULT_THREADS)
+    t_start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        now = clock[0] = i / clip_fps
+        if size != (w0, h0):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        kpts, gray = None, None
+        if tracker:
+            gray = tracker.prepare(frame)
+            if not tracker.due():
+                kpts = tracker.track(gray, True)
+        if kpts is None:
+            t0 = time.perf_counter()
+            kpts = first_person(backend.predict(frame, cfg["imgsz"]), True)
+            infer_ms.append((time.perf_counter() - t0) * 1000.0)
+            if tracker:
+                tracker.reset(gray, kpts)
+        pos = None
+        if kpts is not None:
+            _, pos = analyze_pose(kpts, size[0], size[1], now, True, st)
+        positions.append(pos)
+    elapsed = time.perf_counter() - t_start
+    cv2.setNumThreads(-1)
+    return {
+        "fps": len(frames) / elapsed,
+        "infer_ms": sum(infer_ms) / len(infer_ms) if infer_ms else 0.0,
+        "waves": [t for t, event, _ in events if event == "wave"],
+        "positions": positions,
+        "size": size,
+    }
+
+def wave_agreement(ref, cand):
+    if not ref and not cand:
+        return 1.0
+    unmatched = list(cand)
+    matched = 0
+    for t in ref:
+        hit = next((c for c in unmatched if abs(c - t) <= AUTOTUNE_WAVE_TOLERANCE), None)
+        if hit is not None:
+            unmatched.remove(hit)
+            matched += 1
+    return matched / max(len(ref), len(cand))
+
+def autotune(clip, model_path, count, out_path=POSE_CONFIG_PATH):
+    cap = cv2.VideoCapture(clip)
+    clip_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    frames = read_frames(clip, count)
+    if not frames:
+        print(f"[TUNE] no frames from {clip}")
+        return None
+    h0, w0 = frames[0].shape[:2]
+    backends = {}
+
+    def backend_for(threads):
+        if threads not in backends:
+            backends[threads] = load_model(model_path, threads)
+        return backends[threads]
+
+    def trial(cfg):
+        return simulate(backend_for(cfg["threads"]), frames, clip_fps, cfg)
+
+    best = {"model": model_path, "threads": 0, "imgsz": FULL_IMGSZ, "cv2_threads": -1, "cap_width": 0, "infer_every": 1}
+    reference = trial(best)
+    print(f"[TUNE] clip={clip} frames={len(frames)} fps={clip_fps:.1f} {w0}x{h0} "
+          f"reference: {reference['fps']:.1f} fps, {len(reference['waves'])} wave(s)")
+    if not reference["waves"]:
+        print("[TUNE] warning: no waves in the reference run; wave agreement cannot reject anything")
+    best_fps = reference["fps"]
+
+    # One parameter at a time, keeping the best value found so far for the others
+    for key, values in AUTOTUNE_SPACE.items():
+        for value in values:
+            if value == best[key] or (key == "cap_width" and value >= w0):
+                continue
+            cfg = dict(best, **{key: value})
+            result = trial(cfg)
+            wave_ok = wave_agreement(reference["waves"], result["waves"])
+            pos_ok = sum(a == b for a, b in zip(reference["positions"], result["positions"])) / len(frames)
+            accepted = (wave_ok >= AUTOTUNE_MIN_WAVE_AGREEMENT and pos_ok >= AUTOTUNE_MIN_POS_AGREEMENT
+                        and result["fps"] > best_fps)
+            print(f"[TUNE] {key}={value}: {result['fps']:.1f} fps infer={result['infer_ms']:.1f}ms "
+                  f"wave_agree={wave_ok:.0%} pos_agree={pos_ok:.0%} {'-> best' if accepted else ''}")
+            if accepted:
+                best, best_fps = cfg, result["fps"]
+
+    if best["cap_width"]:
+        best["cap_height"] = int(round(h0 * best["cap_width"] / w0))
+    else:
+        best["cap_height"] = 0
+    best["_measured"] = {"fps": round(best_fps, 1), "reference_fps": round(reference["fps"], 1),
+                         "clip": clip, "frames": len(frames)}
+    with open(out_path, "w", encoding="utf-8") as fp:
+        json.dump(best, fp, indent=2)
+    print(f"[TUNE] best {best_fps:.1f} fps (reference {reference['fps']:.1f}) -> {out_path}")
+    return best
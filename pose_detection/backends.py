@@ -0,0 +1,240 @@
+# Pose model backends (PyTorch, ONNX Runtime, OpenVINO) and the backend benchmark
+import abc, cv2, time, os
+import numpy as np
+
+from gestures import first_person
+from overlay import draw_keypoints
+from tracking import KeypointEval
+
+# ========= Model =========
+# --model picks the inference backend from the file:
+#   yolov8n-pose.pt                  PyTorch eager (ultralytics), default
+#   yolov8n-pose.onnx                ONNX Runtime, CPU execution provider
+#   yolov8n-pose_openvino_model/     OpenVINO (directory with the .xml/.bin, or the .xml itself)
+# Export once with:  python pc_publisher.py --export onnx|openvino [--imgsz 640]
+# Exported models have a fixed input size (the export imgsz); a different requested imgsz is letterboxed to it.
+MODEL_PATH = 'yolov8n-pose.pt'
+MODEL_CONF = 0.5
+NMS_IOU = 0.7
+WARMUP_RUNS = 3
+
+class PoseResult:
+    """
+    Backend-independent output: kpts (N, 17, 3) and boxes (N, 4) xyxy in input-image pixels, best first.
+    ids (N,) are tracker ids when the backend tracks (torch with --gesture-engine), else None.
+    """
+    __slots__ = ("kpts", "boxes", "raw", "ids")
+
+    def __init__(self, kpts, boxes, raw=None, ids=None):
+        self.kpts, self.boxes, self.raw, self.ids = kpts, boxes, raw, ids
+
+    def plot(self, img):
+        if self.raw is not None:
+            # Draw skeleton (labels=False prevents mirrored text)
+            return self.raw.plot(img=img, labels=False, conf=False, boxes=False)
+        return draw_keypoints(img, self.kpts[0]) if len(self.kpts) else img
+
+_torch_default_threads = None   # torch's own thread count, read before anything changes it
+
+class TorchBackend:
+    name = "torch"
+    last_post_ms = 0.0
+
+    def __init__(self, path, threads):
+        # Imported here so processes that never run inference (capture, publish) skip torch
+        global _torch_default_threads
+        import torch
+        from ultralytics import YOLO
+        if _torch_default_threads is None:
+            _torch_default_threads = torch.get_num_threads()
+        self.torch = torch
+        self.threads = threads if threads > 0 else _torch_default_threads
+        self._pin_threads()
+        self.model = YOLO(path)
+        self.track_ids = False   # run the ultralytics tracker so results carry persistent ids
+
+    def _pin_threads(self):
+        # set_num_threads is process-global: re-apply ours in case another backend in this
+        # process (autotune keeps one per thread count) changed it since
+        if self.torch.get_num_threads() != self.threads:
+            self.torch.set_num_threads(self.threads)
+
+    def predict(self, image, imgsz=None):
+        self._pin_threads()
+        kwargs = {"imgsz": imgsz} if imgsz else {}
+        if self.track_ids:
+            r = self.model.track(image, persist=True, verbose=False, conf=MODEL_CONF, **kwargs)[0]
+        else:
+            r = self.model(image, verbose=False, conf=MODEL_CONF, **kwargs)[0]
+        t0 = time.perf_counter()
+        result = self._to_result(r)
+        self.last_post_ms = (time.perf_counter() - t0) * 1000.0   # .cpu().numpy() transfer
+        return result
+
+    def predict_batch(self, images, imgsz=None):
+        """One forward pass over several frames -> list of PoseResult"""
+        self._pin_threads()
+        kwargs = {"imgsz": imgsz} if imgsz else {}
+        rs = self.model(list(images), verbose=False, conf=MODEL_CONF, **kwargs)
+        t0 = time.perf_counter()
+        results = [self._to_result(r) for r in rs]
+        self.last_post_ms = (time.perf_counter() - t0) * 1000.0
+        return results
+
+    @staticmethod
+    def _to_result(r):
+        if r.keypoints is None or len(r.keypoints) == 0:
+            return PoseResult(np.zeros((0, 17, 3), np.float32), np.zeros((0, 4), np.float32), r)
+        ids = r.boxes.id.cpu().numpy().astype(np.int64) if r.boxes.id is not None else None
+        return PoseResult(r.keypoints.data.cpu().numpy(), r.boxes.xyxy.cpu().numpy(), r, ids)
+
+class ExportedBackend(abc.ABC):
+    """Shared letterbox pre-processing and YOLOv8-pose decoding for exported (static-shape) models"""
+    input_size = 640
+    last_post_ms = 0.0   # output decoding + NMS
+
+    @abc.abstractmethod
+    def _run(self, blob):
+        """(1, 3, size, size) float blob -> raw model output, (1, 56, anchors)"""
+
+    def predict_batch(self, images, imgsz=None):
+        # Exports are static-shape (batch 1), so views run back to back on the same session
+        return [self.predict(image, imgsz) for image in images]
+
+    def predict(self, image, imgsz=None):
+        h, w = image.shape[:2]
+        size = self.input_size
+        r = min(size / h, size / w)
+        nh, nw = int(round(h * r)), int(round(w * r))
+        pad_x, pad_y = (size - nw) // 2, (size - nh) // 2
+        canvas = np.full((size, size, 3), 114, np.uint8)
+        canvas[pad_y:pad_y + nh, pad_x:pad_x + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+
+        pred = self._run(blob)[0].T   # (anchors, 4 box + 1 score + 17 * 3 keypoints)
+        t0 = time.perf_counter()
+        result = self._decode(pred, r, pad_x, pad_y)
+        self.last_post_ms = (time.perf_counter() - t0) * 1000.0
+        return result
+
+    def _decode(self, pred, r, pad_x, pad_y):
+        pred = pred[pred[:, 4] > MODEL_CONF]
+        if not len(pred):
+            return PoseResult(np.zeros((0, 17, 3), np.float32), np.zeros((0, 4), np.float32))
+        xywh = pred[:, :4].copy()
+        xywh[:, :2] -= xywh[:, 2:] / 2
+        keep = np.array(cv2.dnn.NMSBoxes(xywh.tolist(), pred[:, 4].tolist(), MODEL_CONF, NMS_IOU)).reshape(-1)
+        boxes = np.concatenate([xywh[keep, :2], xywh[keep, :2] + xywh[keep, 2:]], axis=1)
+        kpts = pred[keep, 5:].reshape(-1, 17, 3).copy()
+        # Undo the letterbox
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / r
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / r
+        kpts[:, :, 0] = (kpts[:, :, 0] - pad_x) / r
+        kpts[:, :, 1] = (kpts[:, :, 1] - pad_y) / r
+        return PoseResult(kpts.astype(np.float32), boxes.astype(np.float32))
+
+class OnnxBackend(ExportedBackend):
+    name = "onnxruntime"
+
+    def __init__(self, path, threads):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.input_size = int(inp.shape[2])
+
+    def _run(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+class OpenVinoBackend(ExportedBackend):
+    name = "openvino"
+
+    def __init__(self, path, threads):
+        import openvino as ov
+        if os.path.isdir(path):
+            path = next(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".xml"))
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads > 0:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = ov.Core().compile_model(path, "CPU", config)
+        self.input_size = int(self.compiled.input(0).shape[2])
+
+    def _run(self, blob):
+        return self.compiled(blob)[0]
+
+def load_model(path=MODEL_PATH, threads=0, track=False):
+    """Load the backend for `path`, pin its thread count (0 = library default) and warm it up"""
+    if path.endswith(".onnx"):
+        backend_cls = OnnxBackend
+    elif path.endswith(".xml") or os.path.isdir(path):
+        backend_cls = OpenVinoBackend
+    else:
+        backend_cls = TorchBackend
+    print(f"Loading pose model {path} ({backend_cls.name}, threads={threads or 'default'})...")
+    backend = backend_cls(path, threads)
+    t0 = time.perf_counter()
+    dummy = np.zeros((480, 640, 3), np.uint8)
+    for _ in range(WARMUP_RUNS):
+        backend.predict(dummy)
+    print(f"[MODEL] {backend.name} warmed up in {(time.perf_counter() - t0) * 1000:.0f}ms ({WARMUP_RUNS} runs)")
+    if track and hasattr(backend, "track_ids"):
+        backend.track_ids = True   # after warmup, so the dummy frames never reach the tracker
+    return backend
+
+def export_model(fmt, imgsz):
+    from ultralytics import YOLO
+    out = YOLO(MODEL_PATH).export(format=fmt, imgsz=imgsz)
+    print(f"[MODEL] exported {MODEL_PATH} -> {out}")
+
+# ========= Backend benchmark =========
+BENCH_FRAMES = 100
+
+def read_frames(source, count):
+    """Grab `count` frames from a video file or camera index (default camera) for benchmarking"""
+    cap = cv2.VideoCapture(int(source)) if source.isdigit() else cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def bench_backends(paths, source, count, threads):
+    """
+    Run every model on the same frames and compare latency and, against the first
+    model, keypoint agreement on the six keypoints the gesture logic uses.
+    """
+    frames = read_frames(source, count)
+    if not frames:
+        print(f"[BENCH] no frames from {source}")
+        return
+    h, w = frames[0].shape[:2]
+    reference = None
+    for path in paths:
+        backend = load_model(path, threads)
+        latencies, people = [], []
+        for frame in frames:
+            t0 = time.perf_counter()
+            result = backend.predict(frame)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            people.append(first_person(result, True))
+        latencies.sort()
+        line = (f"[BENCH] {path} ({backend.name}) frames={len(frames)} "
+                f"avg={sum(latencies) / len(latencies):.1f}ms p50={latencies[len(latencies) // 2]:.1f}ms "
+                f"p95={latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]:.1f}ms "
+                f"fps={1000.0 * len(latencies) / sum(latencies):.1f}")
+        if reference is None:
+            reference = people
+        else:
+            agreement = KeypointEval("vs_" + os.path.basename(paths[0]))
+            for candidate, ref in zip(people, reference):
+                agreement.add(candidate, ref, w, h, True)
+            line += " " + agreement.report()
+        print(line)
@@ -0,0 +1,152 @@
+# Camera capture and the motion gate
+import cv2, time, os, threading
+
+# ========= Camera =========
+CAMERA_INDEX = 0
+USE_CAPTURE_THREAD = True   # read the camera on a background thread, infer on the newest frame only
+CAP_REPORT_SEC = 5.0        # how often to print capture stats
+
+def open_camera(width=0, height=0, index=CAMERA_INDEX):
+    # DirectShow only exists on Windows; let OpenCV pick (V4L2, AVFoundation) elsewhere
+    cap = cv2.VideoCapture(index, cv2.CAP_DSHOW if os.name == "nt" else cv2.CAP_ANY)
+    if width and height:   # 0 = driver default
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return cap
+
+class LatestFrameGrabber:
+    """
+    Reads the camera on a background thread and keeps only the newest frame
+    (single-slot buffer), so inference never runs on frames queued in the driver.
+    """
+    def __init__(self, cap):
+        self.cap = cap
+        self.captured = 0
+        self.dropped = 0   # frames overwritten before inference picked them up
+        self._cond = threading.Condition()
+        self._frame, self._frame_t = None, 0.0
+        self._seq, self._read_seq = 0, 0
+        self._ok = True
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            ok, frame = self.cap.read()
+            t = time.time()
+            with self._cond:
+                if not ok:
+                    self._ok = False
+                    self._cond.notify_all()
+                    return
+                if self._seq != self._read_seq:
+                    self.dropped += 1
+                self._frame, self._frame_t = frame, t
+                self._seq += 1
+                self.captured += 1
+                self._cond.notify_all()
+
+    def read(self, timeout=2.0):
+        """Wait for a frame newer than the last one returned -> (ok, frame, capture_time)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != self._read_seq or not self._ok, timeout)
+            if self._seq == self._read_seq:
+                return False, None, 0.0
+            self._read_seq = self._seq
+            return True, self._frame, self._frame_t
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+
+# ========= Motion gate =========
+# --motion-gate drops inference to GATE_IDLE_FPS while the scene is static and nobody is
+# detected. Motion is judged by differencing downscaled, blurred grayscale frames, and any
+# motion returns the loop to full rate on the same frame.
+GATE_WIDTH = 160            # px, frame differencing runs at this width
+GATE_PIXEL_DELTA = 18       # grayscale change that counts a pixel as moving
+GATE_MOTION_RATIO = 0.01    # fraction of moving pixels that counts as motion
+GATE_IDLE_AFTER_SEC = 3.0   # no motion and nobody detected for this long -> idle
+GATE_IDLE_FPS = 1.0         # inference rate while idle (catches someone standing perfectly still)
+
+class MotionGate:
+    """
+    Decides per frame whether the model should run. It also reports idle time share,
+    process CPU% while active vs idle, and wake latency: capture of the first moving
+    frame -> end of the first inference after waking.
+    """
+    def __init__(self, idle_after=GATE_IDLE_AFTER_SEC, idle_fps=GATE_IDLE_FPS):
+        self.idle_after = idle_after
+        self.idle_interval = 1.0 / idle_fps if idle_fps > 0 else float("inf")
+        self.prev = None
+        self.idle = False
+        self.last_activity = time.time()
+        self.last_idle_infer = 0.0
+        self.wake_frame_t = None
+        self.skipped = 0
+        self.wakes = 0
+        self.wake_ms = []
+        self._cpu_t, self._wall_t = time.process_time(), time.perf_counter()
+        self.cpu = {False: [0.0, 0.0], True: [0.0, 0.0]}   # idle -> [cpu seconds, wall seconds]
+
+    def _motion(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (GATE_WIDTH, max(1, h * GATE_WIDTH // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        prev, self.prev = self.prev, gray
+        if prev is None or prev.shape != gray.shape:
+            return True
+        moving = cv2.absdiff(gray, prev) > GATE_PIXEL_DELTA
+        return moving.mean() >= GATE_MOTION_RATIO
+
+    def _account(self):
+        cpu, wall = time.process_time(), time.perf_counter()
+        bucket = self.cpu[self.idle]
+        bucket[0] += cpu - self._cpu_t
+        bucket[1] += wall - self._wall_t
+        self._cpu_t, self._wall_t = cpu, wall
+
+    def allow(self, frame, frame_t, now):
+        """True if this frame should be inferred"""
+        self._account()
+        if self._motion(frame):
+            self.last_activity = now
+            if self.idle:
+                self.idle = False
+                self.wakes += 1
+                self.wake_frame_t = frame_t
+            return True
+        if not self.idle and now - self.last_activity >= self.idle_after:
+            self.idle = True
+        if self.idle and now - self.last_idle_infer < self.idle_interval:
+            self.skipped += 1
+            return False
+        if self.idle:
+            self.last_idle_infer = now
+        return True
+
+    def observe(self, person_found, now):
+        """After an inference: a detected person keeps the gate awake even if they stand still"""
+        if person_found:
+            self.last_activity = now
+            if self.idle:
+                self.idle = False
+                self.wakes += 1
+        if self.wake_frame_t is not None:
+            self.wake_ms.append((time.time() - self.wake_frame_t) * 1000.0)
+            self.wake_frame_t = None
+
+    def report(self):
+        self._account()
+        def pct(bucket):
+            return f"{bucket[0] / bucket[1] * 100:.0f}%" if bucket[1] > 0 else "n/a"
+        active, idle = self.cpu[False], self.cpu[True]
+        total = active[1] + idle[1]
+        text = (f"gate={'idle' if self.idle else 'active'} idle_share={idle[1] / total if total else 0:.0%} "
+                f"cpu active={pct(active)} idle={pct(idle)} skipped={self.skipped} wakes={self.wakes}")
+        if self.wake_ms:
+            text += f" wake avg={sum(self.wake_ms) / len(self.wake_ms):.0f}ms max={max(self.wake_ms):.0f}ms"
+        self.cpu = {False: [0.0, 0.0], True: [0.0, 0.0]}
+        self.skipped, self.wakes, self.wake_ms = 0, 0, []
+        return text
@@ -0,0 +1,309 @@
+# Position / wave detection from pose keypoints: single-person logic and the multi-person engine
+import numpy as np
+
+from mqtt_events import publish_event
+
+# ========= Detection parameters =========
+CENTER_LEFT_RATIO, CENTER_RIGHT_RATIO = 0.40, 0.50
+DX_L, DX_R = 0.05, 0.05
+DT = 0.7
+COOLDOWN = 1.5
+SHOW_MS = 600
+POS_KEEPALIVE_SEC = 2.0     # resend an unchanged pos this often (EV3 NO_POS_TIMEOUT is 4.0)
+ZONE_HYSTERESIS = 0.03      # fraction of width the hip center must cross past a zone boundary
+ZONE_MIN_DWELL_SEC = 0.15   # a new zone must hold this long before it is published
+
+# ========= Pose / Gesture logic =========
+def keypoint_indices(mirrored):
+    # ★★★ Dynamic Index Mapping ★★★
+    if mirrored:
+        # In Mirror Mode: YOLO sees "Left Hand (ID 9)" but it is actually the user's "Right Hand".
+        # We need to swap the indices logic.
+        return {
+            "L_SHOULDER": 6,   # YOLO Right Shoulder -> Real Left Shoulder
+            "R_SHOULDER": 5,   # YOLO Left Shoulder -> Real Right Shoulder
+            "L_WRIST":    10,  # YOLO Right Wrist -> Real Left Wrist
+            "R_WRIST":    9,   # YOLO Left Wrist -> Real Right Wrist
+            "L_HIP":      12,
+            "R_HIP":      11,
+        }
+    # In Normal Mode: Direct mapping to standard COCO indices.
+    return {
+        "L_SHOULDER": 5,
+        "R_SHOULDER": 6,
+        "L_WRIST":    9,
+        "R_WRIST":    10,
+        "L_HIP":      11,
+        "R_HIP":      12,
+    }
+
+class GestureState:
+    """Per-target state carried between frames by analyze_pose / publish_position"""
+    def __init__(self, publish=None):
+        self.publish = publish or publish_event   # autotune swaps in a recorder
+        self.zone = None                          # last classified zone, for hysteresis
+        self.zone_candidate, self.zone_since = None, 0.0
+        self.last_x_R, self.last_t_R = None, None
+        self.last_x_L, self.last_t_L = None, None
+        self.show_until, self.show_text = 0.0, ""
+        self.last_pos_sent_value, self.last_pos_sent_time = "", 0.0
+
+def shoulders_visible(kpts, mirrored):
+    idx = keypoint_indices(mirrored)
+    return kpts[idx["L_SHOULDER"]][2] > 0.3 and kpts[idx["R_SHOULDER"]][2] > 0.3
+
+def classify_position(kpts, w, mirrored, prev=None):
+    """
+    Hip-center zone of one person's keypoints -> (location_text, pos).
+    With `prev`, the boundaries next to the current zone move outward by ZONE_HYSTERESIS,
+    so jitter on a boundary does not flip the zone.
+    """
+    idx = keypoint_indices(mirrored)
+
+    # ===== 1. Position Logic (Left / Center / Right) =====
+    lh_x = kpts[idx["L_HIP"]][0] / w
+    rh_x = kpts[idx["R_HIP"]][0] / w
+
+    cx_ratio = (lh_x + rh_x) / 2.0
+    cx_pixel = int(cx_ratio * w)
+
+    left_ratio, right_ratio = CENTER_LEFT_RATIO, CENTER_RIGHT_RATIO
+    if prev == "center":
+        left_ratio, right_ratio = left_ratio - ZONE_HYSTERESIS, right_ratio + ZONE_HYSTERESIS
+    elif prev == "left":
+        left_ratio += ZONE_HYSTERESIS
+    elif prev == "right":
+        right_ratio -= ZONE_HYSTERESIS
+    left_px = int(left_ratio * w)
+    right_px = int(right_ratio * w)
+
+    # Logic is based on visual position on screen:
+    # If person is on the right side of the screen -> Right
+
+    if left_px <= cx_pixel <= right_px:
+        return "Center", "center"
+    elif cx_pixel < left_px:
+        return "Left", "left"
+    return "Right", "right"
+
+def analyze_pose(kpts, w, h, now, mirrored, st):
+    """
+    Position + wave logic for one person's (17, 3) keypoints in pixel coordinates.
+    Publishes wave events; returns (location_text, pos).
+    """
+    idx = keypoint_indices(mirrored)
+
+    def get_norm_point(name):
+        px, py, conf = kpts[idx[name]]
+        return px / w, py / h, conf
+
+    location_text, pos = classify_position(kpts, w, mirrored, st.zone)
+    st.zone = pos
+
+    # ===== 2. Right Hand Wave (Physical Right Hand) =====
+    rw_x, rw_y, _ = get_norm_point("R_WRIST")
+    rs_x, rs_y, _ = get_norm_point("R_SHOULDER")
+
+    above_R = (rw_y < rs_y)
+
+    if st.last_x_R is not None and st.last_t_R is not None:
+        dx_R = abs(rw_x - st.last_x_R)
+        dt_R = now - st.last_t_R
+        if dx_R > DX_R and dt_R < DT and above_R and (now > st.show_until + COOLDOWN):
+            st.show_text = "Right Wave!"
+            st.show_until = now + SHOW_MS/1000.0
+            st.publish("wave", "R", 2)
+    st.last_x_R, st.last_t_R = rw_x, now
+
+    # ===== 3. Left Hand Wave (Physical Left Hand) =====
+    lw_x, lw_y, _ = get_norm_point("L_WRIST")
+    ls_x, ls_y, _ = get_norm_point("L_SHOULDER")
+
+    above_L = (lw_y < ls_y)
+
+    if st.last_x_L is not None and st.last_t_L is not None:
+        dx_L = abs(lw_x - st.last_x_L)
+        dt_L = now - st.last_t_L
+        if dx_L > DX_L and dt_L < DT and above_L and (now > st.show_until + COOLDOWN):
+            st.show_text = "Left Wave!"
+            st.show_until = now + SHOW_MS/1000.0
+            # [USER REQUEST] Left wave still sends "R"
+            st.publish("wave", "R", 2)
+
+    st.last_x_L, st.last_t_L = lw_x, now
+    return location_text, pos
+
+def publish_position(pos, now, st):
+    # ===== Send position on change (once it has held ZONE_MIN_DWELL_SEC) + keepalive =====
+    if pos:
+        if pos != st.zone_candidate:
+            st.zone_candidate, st.zone_since = pos, now
+        changed = pos != st.last_pos_sent_value and now - st.zone_since >= ZONE_MIN_DWELL_SEC
+        keepalive = pos == st.last_pos_sent_value and now - st.last_pos_sent_time > POS_KEEPALIVE_SEC
+        if changed or keepalive:
+            st.publish("pos", pos, 1)
+            st.last_pos_sent_value = pos
+            st.last_pos_sent_time  = now
+
+# ========= Gesture engine (multi-person) =========
+# --gesture-engine replaces the frame-to-frame wrist test for everyone in the frame:
+#   - each person keeps a slot in fixed-size NumPy ring buffers (ENGINE_SLOTS x ENGINE_WINDOW),
+#     keyed by tracker id when the backend provides one, otherwise by nearest torso center
+#   - a wave is an oscillation of either wrist above its shoulder inside WAVE_WINDOW_SEC:
+#     enough direction reversals of x (jitter below WAVE_JITTER ignored) and a peak-to-peak
+#     swing of at least WAVE_MIN_AMPLITUDE, evaluated for all slots in one vectorized pass
+#   - position follows the target person: whoever waved last (for TARGET_HOLD_SEC), else the
+#     largest or most central person (--target size|center)
+# All arrays are preallocated, so per-frame cost does not grow with the number of people.
+ENGINE_SLOTS = 10           # people tracked at once (extra detections are ignored)
+ENGINE_WINDOW = 32          # samples kept per person
+WAVE_WINDOW_SEC = 1.5
+WAVE_MIN_REVERSALS = 2      # e.g. right-left-right
+WAVE_MIN_AMPLITUDE = 0.06   # peak-to-peak wrist x, fraction of frame width
+WAVE_JITTER = 0.008         # per-sample x change treated as noise
+WAVE_ABOVE_RATIO = 0.6      # share of window samples with the wrist above the shoulder
+MATCH_DIST = 0.15           # torso-center distance (fraction of width) for id-less matching
+SLOT_TTL_SEC = 1.0          # free a slot after this long unseen
+TARGET_HOLD_SEC = 5.0
+
+class GestureEngine:
+    def __init__(self, target="size", slots=ENGINE_SLOTS, window=ENGINE_WINDOW):
+        self.target_mode = target
+        self.slots, self.window = slots, window
+        self.wrist_x = np.zeros((slots, window, 2), np.float32)     # normalized x of (left, right) wrist
+        self.above = np.zeros((slots, window, 2), bool)             # wrist above its shoulder
+        self.t = np.full((slots, window), -np.inf)                  # sample time (-inf = empty)
+        self.head = 0
+        self.slot_id = np.full(slots, -1, np.int64)                 # tracker id per slot (-1 = none)
+        self.slot_center = np.full((slots, 2), np.nan, np.float32)  # last torso center, normalized
+        self.slot_seen = np.full(slots, -np.inf)
+        self.last_fire = np.full(slots, -np.inf)
+        self.target_slot, self.target_until = -1, 0.0
+
+    def _assign(self, ids, centers, now):
+        """Slot index per detection (-1 = no free slot)"""
+        stale = now - self.slot_seen > SLOT_TTL_SEC
+        self.slot_id[stale] = -1
+        self.slot_center[stale] = np.nan
+        self.t[stale] = -np.inf
+        out = np.full(len(centers), -1)
+        free = list(np.flatnonzero(stale))
+        if ids is not None:
+            for i, pid in enumerate(ids):
+                hit = np.flatnonzero(self.slot_id == pid)
+                if len(hit):
+                    out[i] = hit[0]
+                elif free:
+                    out[i] = free.pop(0)
+                    self.slot_id[out[i]] = pid
+                    self.t[out[i]] = -np.inf
+            return out
+        dist = np.linalg.norm(centers[:, None, :] - self.slot_center[None, :, :], axis=2)   # (N, slots)
+        dist[:, stale] = np.inf
+        dist = np.nan_to_num(dist, nan=np.inf)
+        taken = set()
+        for i in np.argsort(dist.min(axis=1)):
+            order = [j for j in np.argsort(dist[i]) if dist[i, j] < MATCH_DIST and j not in taken]
+            if order:
+                out[i] = order[0]
+            elif free:
+                out[i] = free.pop(0)
+                self.t[out[i]] = -np.inf
+            if out[i] >= 0:
+                taken.add(out[i])
+        return out
+
+    def update(self, result, w, h, now, mirrored):
+        """Feed one frame -> (target keypoints or None, list of slots that just waved)"""
+        idx = keypoint_indices(mirrored)
+        kpts = result.kpts[:self.slots] if len(result.kpts) else np.zeros((0, 17, 3), np.float32)
+        ids = None
+        if len(kpts):
+            # same shoulder visibility rule as the single-person path
+            visible = (kpts[:, [idx["L_SHOULDER"], idx["R_SHOULDER"]], 2] > 0.3).all(axis=1)
+            kpts = kpts[visible]
+            if result.ids is not None:
+                ids = result.ids[:self.slots][visible]
+        wrists = kpts[:, [idx["L_WRIST"], idx["R_WRIST"]]] if len(kpts) else np.zeros((0, 2, 3), np.float32)
+        shoulders = kpts[:, [idx["L_SHOULDER"], idx["R_SHOULDER"]]] if len(kpts) else np.zeros((0, 2, 3), np.float32)
+        hips = kpts[:, [idx["L_HIP"], idx["R_HIP"]]] if len(kpts) else np.zeros((0, 2, 3), np.float32)
+        centers = np.concatenate([shoulders[:, :, :2], hips[:, :, :2]], axis=1).mean(axis=1) / (w, w)
+
+        slots = self._assign(ids, centers, now) if len(kpts) else np.zeros(0, int)
+        ok = slots >= 0
+        s = slots[ok]
+        self.head = (self.head + 1) % self.window
+        self.t[:, self.head] = -np.inf
+        self.t[s, self.head] = now
+        self.wrist_x[s, self.head] = wrists[ok, :, 0] / w
+        self.above[s, self.head] = wrists[ok, :, 1] < shoulders[ok, :, 1]
+        self.slot_center[s] = centers[ok]
+        self.slot_seen[s] = now
+
+        waved = self._detect(now)
+        if len(waved):
+            self.target_slot, self.target_until = int(waved[-1]), now + TARGET_HOLD_SEC
+        return self._target(kpts[ok], s, shoulders[ok], hips[ok], w, h, now), waved
+
+    def _detect(self, now):
+        order = (np.arange(1, self.window + 1) + self.head) % self.window   # oldest -> newest
+        t = self.t[:, order]
+        x = self.wrist_x[:, order]                                         # (slots, window, 2)
+        valid = (t >= now - WAVE_WINDOW_SEC)[:, :, None] & np.ones((1, 1, 2), bool)
+        n = valid.sum(axis=1)                                              # (slots, 2)
+        dx = np.diff(x, axis=1)
+        pair = valid[:, 1:] & valid[:, :-1]
+        sign = np.where(pair & (np.abs(dx) > WAVE_JITTER), np.sign(dx), 0.0)
+        # forward-fill zero steps so a pause between swings is not read as a reversal
+        pos = np.where(sign != 0, np.arange(sign.shape[1])[None, :, None], 0)
+        pos = np.maximum.accumulate(pos, axis=1)
+        filled = np.take_along_axis(sign, pos, axis=1)
+        reversals = ((filled[:, 1:] * filled[:, :-1]) < 0).sum(axis=1)
+        amplitude = np.where(n > 0, np.where(valid, x, -np.inf).max(axis=1) - np.where(valid, x, np.inf).min(axis=1), 0.0)
+        above_ratio = np.where(n > 0, (self.above[:, order] & valid).sum(axis=1) / np.maximum(n, 1), 0.0)
+        hit = ((reversals >= WAVE_MIN_REVERSALS) & (amplitude >= WAVE_MIN_AMPLITUDE)
+               & (above_ratio >= WAVE_ABOVE_RATIO)).any(axis=1)
+        hit &= now > self.last_fire + COOLDOWN
+        fired = np.flatnonzero(hit)
+        self.last_fire[fired] = now
+        return fired
+
+    def _target(self, kpts, slots, shoulders, hips, w, h, now):
+        if not len(kpts):
+            return None
+        if now < self.target_until:
+            held = np.flatnonzero(slots == self.target_slot)
+            if len(held):
+                return kpts[held[0]]
+        if self.target_mode == "center":
+            cx = np.concatenate([shoulders[:, :, 0], hips[:, :, 0]], axis=1).mean(axis=1) / w
+            best = int(np.argmin(np.abs(cx - 0.5)))
+        else:
+            # shoulder width + torso height as a size proxy that works without boxes
+            width = np.abs(shoulders[:, 0, 0] - shoulders[:, 1, 0])
+            torso = np.abs(hips[:, :, 1].mean(axis=1) - shoulders[:, :, 1].mean(axis=1))
+            best = int(np.argmax(width + torso))
+        return kpts[best]
+
+def engine_step(engine, result, w, h, now, mirrored, st):
+    """Gesture engine in place of analyze_pose -> (target keypoints, location_text, pos)"""
+    kpts, waved = engine.update(result, w, h, now, mirrored)
+    if len(waved):   # the engine applies COOLDOWN per person
+        st.show_text = "Wave!"
+        st.show_until = now + SHOW_MS/1000.0
+        # [USER REQUEST] every wave is sent as "R"
+        st.publish("wave", "R", 2)
+    if kpts is None:
+        return None, "", None
+    location_text, pos = classify_position(kpts, w, mirrored, st.zone)
+    st.zone = pos
+    return kpts, location_text, pos
+
+def first_person(results, mirrored):
+    """Keypoints of the first detected person if their shoulders are visible, else None"""
+    if len(results.kpts) > 0:
+        person = results.kpts[0]
+        # Simple check if shoulders are detected (using mapped IDs)
+        if shoulders_visible(person, mirrored):
+            return person
+    return None
@@ -0,0 +1,131 @@
+# MQTT connection and rate-capped pos/wave publishing (used by every pc_publisher.py mode)
+import time, json
+import paho.mqtt.client as mqtt
+
+# ========= MQTT Configuration =========
+USE_CLOUD_BROKER = True
+CLOUD_BROKER = "i27312ff.ala.asia-southeast1.emqxsl.com"
+CLOUD_PORT = 8883
+CLOUD_USERNAME = "wro-robot"
+CLOUD_PASSWORD = "V!cT0rl11"
+
+LOCAL_BROKER = "192.168.1.3"
+LOCAL_PORT = 1883
+
+MQTT_BROKER = CLOUD_BROKER if USE_CLOUD_BROKER else LOCAL_BROKER
+MQTT_PORT = CLOUD_PORT if USE_CLOUD_BROKER else LOCAL_PORT
+
+ONE_TOPIC    = "robot/events"
+SECOND_TOPIC = "robot/waves"
+TARGET_ROBOT_ID = "wro1"
+
+# ========= Setup MQTT Client =========
+client = None
+
+def connect_mqtt():
+    global client
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    except (TypeError, AttributeError):
+        client = mqtt.Client()
+
+    if USE_CLOUD_BROKER:
+        try:
+            client.username_pw_set(CLOUD_USERNAME, CLOUD_PASSWORD)
+            client.tls_set()
+            print(f"MQTT SSL/TLS enabled")
+        except Exception as e:
+            print(f"SSL setup error: {e}")
+
+    print(f"Connecting to: {MQTT_BROKER}:{MQTT_PORT}")
+    try:
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_start()
+        print(f"✅ MQTT connected!")
+    except Exception as e:
+        print(f"❌ MQTT error: {e}")
+
+def disconnect_mqtt():
+    if client:
+        client.loop_stop()
+        client.disconnect()
+
+# ========= Event publishing =========
+# Payloads are compact JSON (same keys the EV3 parses), encoded once per (event, value) and reused.
+# Each event type has a rate cap; events arriving faster are coalesced to the newest value and
+# sent by flush() once the interval opens. Nothing in this repo subscribes to robot/waves, so
+# the duplicate wave publish is off unless ALSO_PUBLISH_WAVES_TOPIC is set.
+EVENT_MIN_INTERVAL = {"pos": 0.2, "wave": 1.0}   # seconds between sends per event type
+ALSO_PUBLISH_WAVES_TOPIC = False
+LOG_POS_KEEPALIVE = False   # print keepalive pos sends too (changes and waves are always printed)
+
+class EventPublisher:
+    def __init__(self):
+        self._payloads = {}
+        self._last_sent = {}
+        self._last_value = {}
+        self._pending = {}   # event -> (value, topic), newest wins
+        self.msgs = self.bytes = self.coalesced = 0
+        self._report_t = time.time()
+
+    def _payload(self, event, value):
+        key = (event, value)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = self._payloads[key] = json.dumps(
+                {"event": event, "value": value, "robot_id": TARGET_ROBOT_ID}, separators=(",", ":")).encode()
+        return payload
+
+    def publish(self, event, value, topic):
+        now = time.time()
+        if now - self._last_sent.get(event, 0.0) < EVENT_MIN_INTERVAL.get(event, 0.0):
+            if event in self._pending:
+                self.coalesced += 1
+            self._pending[event] = (value, topic)
+            return
+        self._pending.pop(event, None)
+        self._send(event, value, topic, now)
+
+    def flush(self):
+        """Send coalesced events whose rate-cap interval has passed"""
+        if not self._pending:
+            return
+        now = time.time()
+        for event, (value, topic) in list(self._pending.items()):
+            if now - self._last_sent.get(event, 0.0) >= EVENT_MIN_INTERVAL.get(event, 0.0):
+                del self._pending[event]
+                self._send(event, value, topic, now)
+
+    def _send(self, event, value, topic, now):
+        payload = self._payload(event, value)
+        if topic == 2 and ALSO_PUBLISH_WAVES_TOPIC:
+            client.publish(SECOND_TOPIC, payload, qos=0)
+            self.msgs, self.bytes = self.msgs + 1, self.bytes + len(payload)
+        client.publish(ONE_TOPIC, payload, qos=0)
+        self.msgs, self.bytes = self.msgs + 1, self.bytes + len(payload)
+        if event != "pos" or value != self._last_value.get(event) or LOG_POS_KEEPALIVE:
+            print(f"PUB: {payload.decode()}")
+        self._last_sent[event] = now
+        self._last_value[event] = value
+
+    def report(self):
+        now = time.time()
+        elapsed = max(now - self._report_t, 1e-6)
+        text = f"pub msgs/s={self.msgs / elapsed:.2f} bytes/s={self.bytes / elapsed:.0f} coalesced={self.coalesced}"
+        self.msgs = self.bytes = self.coalesced = 0
+        self._report_t = now
+        return text
+
+publisher = EventPublisher()
+
+def publish_event(event, value, topic):
+    publisher.publish(event, value, topic)
+
+METRICS_TOPIC = "robot/metrics/pose"
+
+def publish_metrics(summary, extra=None):
+    """Periodic timing summary on METRICS_TOPIC (not rate-capped, not printed)"""
+    if client is None:
+        return
+    payload = {"robot_id": TARGET_ROBOT_ID, "ts": round(time.time(), 3), **summary, **(extra or {})}
+    client.publish(METRICS_TOPIC, json.dumps(payload, separators=(",", ":")), qos=0)
@@ -0,0 +1,199 @@
+# Several cameras / files batched through one model, fused into one pos/wave stream
+import cv2, time, os
+import multiprocessing as mp
+import numpy as np
+
+from mqtt_events import publisher
+from gestures import (COOLDOWN, SHOW_MS, GestureState, analyze_pose, first_person,
+    keypoint_indices, publish_position)
+from overlay import Display
+from backends import load_model, read_frames
+from capture import CAP_REPORT_SEC, LatestFrameGrabber, open_camera
+
+# ========= Multi-camera =========
+# --sources 0 1 side.mp4 captures several views (camera indices or files) in one process,
+# runs them through one model as a single batch per tick, and fuses them into one pos/wave
+# stream for TARGET_ROBOT_ID:
+#   - pos comes from a single "primary" view, starting with the first source. The views are
+#     not calibrated into a common frame: left/center/right are zones of the primary camera's
+#     image, so list the camera that looks the way the robot does first. The primary is kept
+#     fixed and only hands over (to the view whose person looks best: size x keypoint
+#     confidence) after it has lost its person for FUSE_HOLD_SEC, so pos does not flip
+#     between cameras on a momentary quality difference.
+#   - a wave seen in any view is published once; waves from other views inside COOLDOWN
+#     are folded into it.
+# --bench-multi compares this with one process per source on the same frames.
+FUSE_HOLD_SEC = 1.0
+
+def open_source(source, width=0, height=0):
+    return open_camera(width, height, int(source)) if str(source).isdigit() else cv2.VideoCapture(source)
+
+def view_quality(kpts, w, mirrored):
+    """Size (shoulder width + torso height, fraction of width) x mean confidence of the six used keypoints"""
+    if kpts is None:
+        return 0.0
+    idx = keypoint_indices(mirrored)
+    used = kpts[list(idx.values())]
+    sh = kpts[[idx["L_SHOULDER"], idx["R_SHOULDER"]]]
+    hip = kpts[[idx["L_HIP"], idx["R_HIP"]]]
+    size = (abs(sh[0, 0] - sh[1, 0]) + abs(hip[:, 1].mean() - sh[:, 1].mean())) / w
+    return float(size * used[:, 2].mean())
+
+class ViewFusion:
+    def __init__(self, n_views, fused_st):
+        self.fused_st = fused_st
+        self.primary = 0
+        self.primary_lost_since = None
+        self.last_wave = -float("inf")
+        self.folded_waves = 0
+        self.views = [GestureState(publish=self._view_publisher(i)) for i in range(n_views)]
+
+    def _view_publisher(self, view):
+        def publish(event, value, topic):
+            now = time.time()
+            if event != "wave":
+                return
+            if now - self.last_wave < COOLDOWN:
+                self.folded_waves += 1
+                return
+            self.last_wave = now
+            self.fused_st.show_text, self.fused_st.show_until = f"Wave! (view {view})", now + SHOW_MS/1000.0
+            self.fused_st.publish(event, value, topic)
+        return publish
+
+    def fuse(self, positions, qualities, now):
+        """positions/qualities per view -> (pos of the primary view, primary view index)"""
+        if qualities[self.primary] > 0.0:
+            self.primary_lost_since = None
+        elif self.primary_lost_since is None:
+            self.primary_lost_since = now
+        elif now - self.primary_lost_since >= FUSE_HOLD_SEC:
+            best = int(np.argmax(qualities))
+            if qualities[best] > 0.0:
+                self.primary, self.primary_lost_since = best, None
+        return positions[self.primary], self.primary
+
+def run_multi(args):
+    if args.cv2_threads >= 0:
+        cv2.setNumThreads(args.cv2_threads)
+    caps = [open_source(src, args.cap_width, args.cap_height) for src in args.sources]
+    # Cameras keep only their newest frame; files are read in step so no frame is skipped
+    grabbers = [LatestFrameGrabber(cap) if str(src).isdigit() else None for src, cap in zip(args.sources, caps)]
+    display = Display(args.display, args.preview_port, args.preview_fps)
+    model = load_model(args.model, args.threads)
+    st = GestureState()
+    fusion = ViewFusion(len(caps), st)
+    is_mirrored = not args.no_mirror
+    live = [True] * len(caps)
+    ticks, frames_in, infer_ms_sum = 0, 0, 0.0
+    last_report = time.time()
+    print(f"[MULTI] {len(caps)} source(s): {args.sources}")
+
+    try:
+        while any(live):
+            views = []
+            for i, grabber in enumerate(grabbers):
+                if not live[i]:
+                    continue
+                if grabber is not None:
+                    ok, frame, frame_t = grabber.read()
+                else:
+                    (ok, frame), frame_t = caps[i].read(), time.time()
+                if not ok:
+                    live[i] = False
+                    print(f"[MULTI] source {args.sources[i]} ended")
+                    continue
+                views.append((i, cv2.flip(frame, 1) if is_mirrored else frame, frame_t))
+            if not views:
+                continue
+            now = time.time()
+
+            t0 = time.perf_counter()
+            results = model.predict_batch([frame for _, frame, _ in views], args.imgsz)
+            infer_ms_sum += (time.perf_counter() - t0) * 1000.0
+            ticks += 1
+            frames_in += len(views)
+
+            positions = [None] * len(caps)
+            qualities = [0.0] * len(caps)
+            shown = {}
+            for (i, frame, frame_t), result in zip(views, results):
+                h, w = frame.shape[:2]
+                kpts = first_person(result, is_mirrored)
+                location_text = ""
+                if kpts is not None:
+                    location_text, positions[i] = analyze_pose(kpts, w, h, now, is_mirrored, fusion.views[i])
+                    qualities[i] = view_quality(kpts, w, is_mirrored)
+                shown[i] = (frame, kpts, result, location_text, (now - frame_t) * 1000.0)
+
+            pos, primary = fusion.fuse(positions, qualities, now)
+            publish_position(pos, now, st)
+            publisher.flush()
+
+            if primary in shown:
+                frame, kpts, result, location_text, age_ms = shown[primary]
+                quit_requested, is_mirrored = display.show(frame, kpts, result, location_text, st, is_mirrored, age_ms, now)
+                if quit_requested:
+                    break
+
+            if now - last_report >= CAP_REPORT_SEC:
+                elapsed = now - last_report
+                print(f"[MULTI] tick_fps={ticks / elapsed:.1f} frames/s={frames_in / elapsed:.1f} "
+                      f"batch_infer avg={infer_ms_sum / max(ticks, 1):.1f}ms primary={primary} "
+                      f"views={[p or '-' for p in positions]} folded_waves={fusion.folded_waves} "
+                      f"dropped={[g.dropped if g else 0 for g in grabbers]} {publisher.report()}")
+                ticks, frames_in, infer_ms_sum = 0, 0, 0.0
+                fusion.folded_waves = 0
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for grabber in grabbers:
+            if grabber is not None:
+                grabber.stop()
+        for cap in caps:
+            cap.release()
+        display.close()
+
+def _bench_single_source(model_path, threads, imgsz, frames, start_event, out_q):
+    model = load_model(model_path, threads)
+    out_q.put("ready")
+    start_event.wait()
+    t0 = time.perf_counter()
+    for frame in frames:
+        model.predict(frame, imgsz)
+    out_q.put(time.perf_counter() - t0)
+
+def bench_multi(sources, count, model_path, threads, imgsz):
+    """Same frames: one batched process vs one process per source (each with cores / N threads)"""
+    per_source = [read_frames(src, count) for src in sources]
+    count = min(len(f) for f in per_source)
+    if count == 0:
+        print("[BENCH] a source produced no frames")
+        return
+    per_source = [f[:count] for f in per_source]
+    n = len(sources)
+    total = n * count
+
+    model = load_model(model_path, threads)
+    t0 = time.perf_counter()
+    for i in range(count):
+        model.predict_batch([f[i] for f in per_source], imgsz)
+    batched = time.perf_counter() - t0
+    print(f"[BENCH] batched  1 process : {total / batched:.1f} frames/s ({count} ticks x {n} views)")
+    del model
+
+    split_threads = threads or max(1, (os.cpu_count() or 2) // n)
+    start_event, out_q = mp.Event(), mp.Queue()
+    procs = [mp.Process(target=_bench_single_source, args=(model_path, split_threads, imgsz, f, start_event, out_q))
+             for f in per_source]
+    for proc in procs:
+        proc.start()
+    # Start together once every process has loaded and warmed up its own model copy
+    for _ in procs:
+        out_q.get()
+    start_event.set()
+    elapsed = [out_q.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    print(f"[BENCH] separate {n} processes: {total / max(elapsed):.1f} frames/s ({split_threads} thread(s) each)")
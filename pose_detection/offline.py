@@ -0,0 +1,154 @@
+# Offline replay: video or keypoint log through the gesture logic, with a labeled report
+import cv2, time, os, json
+import numpy as np
+
+from gestures import GestureEngine, GestureState, analyze_pose, engine_step, first_person, publish_position
+from backends import PoseResult, load_model
+from pipeline import MAX_PEOPLE
+from autotune import AUTOTUNE_WAVE_TOLERANCE
+
+# ========= Offline replay =========
+# Runs without a camera, window or MQTT, so it works on a Linux build box:
+#   --video clip.mp4 [--dump-keypoints clip.npz]   decode + infer as fast as possible, optionally log keypoints
+#   --replay-keypoints clip.npz                    feed a keypoint log straight into the wave/position logic
+#   --labels clip.json                             compare the emitted events with ground truth
+# Labels file: {"waves": [t, ...], "positions": [[t, "left" | "center" | "right" | null], ...]}
+# "positions" are change points: each zone holds from its t until the next entry. Times are
+# seconds of clip time (frame index / fps).
+def _stage_summary(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    return (f"avg={sum(values) / len(values):.2f}ms p95={values[min(len(values) - 1, int(0.95 * len(values)))]:.2f}ms")
+
+def label_position(changes, t):
+    zone = None
+    for start, value in changes:
+        if start > t:
+            break
+        zone = value
+    return zone
+
+def score_events(labels, wave_times, positions):
+    """Wave precision/recall against labeled times, per-frame position accuracy against labeled zones"""
+    truth = list(labels.get("waves", []))
+    matched = 0
+    unmatched = list(wave_times)
+    for t in truth:
+        hit = next((c for c in unmatched if abs(c - t) <= AUTOTUNE_WAVE_TOLERANCE), None)
+        if hit is not None:
+            unmatched.remove(hit)
+            matched += 1
+    precision = matched / len(wave_times) if wave_times else (1.0 if not truth else 0.0)
+    recall = matched / len(truth) if truth else 1.0
+    changes = sorted(labels.get("positions", []), key=lambda c: c[0])
+    pos_total = pos_ok = 0
+    if changes:
+        for t, pos in positions:
+            pos_total += 1
+            pos_ok += int(label_position(changes, t) == pos)
+    return {
+        "wave_truth": len(truth), "wave_detected": len(wave_times), "wave_matched": matched,
+        "wave_precision": round(precision, 3), "wave_recall": round(recall, 3),
+        "pos_accuracy": round(pos_ok / pos_total, 3) if pos_total else None,
+    }
+
+def run_offline(args):
+    mirrored = not args.no_mirror
+    engine = GestureEngine(args.target) if args.gesture_engine else None
+    events = []
+    clock = [0.0]
+    st = GestureState(publish=lambda event, value, topic: events.append((clock[0], event, value)))
+    positions = []
+    decode_ms, infer_ms, gesture_ms = [], [], []
+    dump_t, dump_count, dump_kpts = [], [], []
+    empty_boxes = np.zeros((0, 4), np.float32)
+
+    if args.replay_keypoints:
+        log = np.load(args.replay_keypoints)
+        fps, w, h = float(log["fps"]), int(log["width"]), int(log["height"])
+        mirrored = bool(log["mirrored"])
+        all_kpts = log["kpts"].astype(np.float32)
+        source = ((float(t), PoseResult(all_kpts[i, :int(n)], empty_boxes))
+                  for i, (t, n) in enumerate(zip(log["t"], log["count"])))
+        model = None
+    else:
+        cap = cv2.VideoCapture(args.video)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        w = h = 0
+        model = load_model(args.model, args.threads, track=args.gesture_engine)
+
+        def frames():
+            i = 0
+            while True:
+                t0 = time.perf_counter()
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                if mirrored:
+                    frame = cv2.flip(frame, 1)
+                decode_ms.append((time.perf_counter() - t0) * 1000.0)
+                yield i / fps, frame
+                i += 1
+            cap.release()
+
+    def infer_all():
+        nonlocal w, h
+        for t, frame in frames():
+            h, w = frame.shape[:2]
+            t0 = time.perf_counter()
+            result = model.predict(frame, args.imgsz)
+            infer_ms.append((time.perf_counter() - t0) * 1000.0)
+            yield t, result
+
+    t_start = time.perf_counter()
+    n_frames = 0
+    for t, result in (source if model is None else infer_all()):
+        n_frames += 1
+        clock[0] = t
+        if args.dump_keypoints:
+            padded = np.zeros((MAX_PEOPLE, 17, 3), np.float16)
+            n = min(len(result.kpts), MAX_PEOPLE)
+            padded[:n] = result.kpts[:n]
+            dump_t.append(t)
+            dump_count.append(n)
+            dump_kpts.append(padded)
+        t0 = time.perf_counter()
+        pos = None
+        if engine:
+            _, _, pos = engine_step(engine, result, w, h, t, mirrored, st)
+        else:
+            kpts = first_person(result, mirrored)
+            if kpts is not None:
+                _, pos = analyze_pose(kpts, w, h, t, mirrored, st)
+        publish_position(pos, t, st)
+        gesture_ms.append((time.perf_counter() - t0) * 1000.0)
+        positions.append((t, pos))
+    elapsed = time.perf_counter() - t_start
+
+    if args.dump_keypoints:
+        np.savez_compressed(args.dump_keypoints, t=np.array(dump_t, np.float32), count=np.array(dump_count, np.uint8),
+                            kpts=np.array(dump_kpts, np.float16).reshape(-1, MAX_PEOPLE, 17, 3),
+                            fps=fps, width=w, height=h, mirrored=mirrored)
+        print(f"[OFFLINE] wrote {n_frames} frame(s) of keypoints -> {args.dump_keypoints} "
+              f"({os.path.getsize(args.dump_keypoints)} bytes)")
+
+    wave_times = [t for t, event, _ in events if event == "wave"]
+    report = {
+        "source": args.replay_keypoints or args.video,
+        "frames": n_frames,
+        "clip_sec": round(n_frames / fps, 2) if fps else None,
+        "fps": round(n_frames / elapsed, 1) if elapsed else None,
+        "decode": _stage_summary(decode_ms),
+        "infer": _stage_summary(infer_ms),
+        "gesture": _stage_summary(gesture_ms),
+        "waves": [round(t, 2) for t in wave_times],
+        "pos_events": sum(1 for _, event, _ in events if event == "pos"),
+    }
+    if args.labels:
+        with open(args.labels, "r", encoding="utf-8") as fp:
+            report.update(score_events(json.load(fp), wave_times, positions))
+    print("[OFFLINE] report")
+    for key, value in report.items():
+        print(f"  {key:15}: {value}")
+    return report
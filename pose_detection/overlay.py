@@ -0,0 +1,215 @@
+# Overlay drawing, MJPEG preview and the Display front end
+import cv2, time, threading
+
+from gestures import CENTER_LEFT_RATIO, CENTER_RIGHT_RATIO, keypoint_indices
+
+# ========= Overlay =========
+WINDOW_NAME = "YOLO Control"
+
+# COCO skeleton edges, used where the ultralytics Results object is not available (pipeline mode)
+COCO_SKELETON = [(5, 6), (5, 7), (7, 9), (6, 8), (8, 10), (5, 11), (6, 12), (11, 12),
+                 (11, 13), (13, 15), (12, 14), (14, 16)]
+
+def draw_keypoints(img, kpts, min_conf=0.3):
+    for a, b in COCO_SKELETON:
+        if kpts[a][2] > min_conf and kpts[b][2] > min_conf:
+            cv2.line(img, (int(kpts[a][0]), int(kpts[a][1])), (int(kpts[b][0]), int(kpts[b][1])), (0, 255, 255), 2)
+    for x, y, c in kpts:
+        if c > min_conf:
+            cv2.circle(img, (int(x), int(y)), 4, (0, 0, 255), -1)
+    return img
+
+def draw_overlay(display, w, h, location_text, st, mirrored, age_ms, stats_lines=()):
+    cv2.rectangle(display, (int(CENTER_LEFT_RATIO*w), 0), (int(CENTER_RIGHT_RATIO*w), h), (255,255,0), 2)
+
+    # Rolling timing summary (StageTimer.overlay_lines), top right
+    for i, text in enumerate(stats_lines):
+        cv2.putText(display, text, (w - 260, 20 + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 255, 255), 1)
+
+    # Display current mode
+    mode_str = "Mode: MIRROR" if mirrored else "Mode: NORMAL"
+    cv2.putText(display, mode_str, (10, h - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    cv2.putText(display, "[M] to toggle", (10, h - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+    cv2.putText(display, f"age {age_ms:.0f}ms", (w - 140, h - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+
+    if location_text:
+        cv2.putText(display, location_text, (30, 25),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.1, (255,255,255), 2, cv2.LINE_AA)
+
+    if time.time() < st.show_until and st.show_text:
+        cv2.putText(display, st.show_text, (30, 70),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0,0,255), 4, cv2.LINE_AA)
+
+def draw_used_keypoints(img, kpts, mirrored, min_conf=0.3):
+    """Lightweight preview: only the six keypoints the gesture logic reads"""
+    idx = keypoint_indices(mirrored)
+    pts = {name: kpts[i] for name, i in idx.items()}
+    for a, b in (("L_SHOULDER", "R_SHOULDER"), ("L_SHOULDER", "L_WRIST"), ("R_SHOULDER", "R_WRIST"),
+                 ("L_HIP", "R_HIP")):
+        if pts[a][2] > min_conf and pts[b][2] > min_conf:
+            cv2.line(img, (int(pts[a][0]), int(pts[a][1])), (int(pts[b][0]), int(pts[b][1])), (0, 255, 255), 2)
+    for x, y, c in pts.values():
+        if c > min_conf:
+            cv2.circle(img, (int(x), int(y)), 5, (0, 0, 255), -1)
+    return img
+
+def open_window():
+    cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+    cv2.resizeWindow(WINDOW_NAME, 960, 720)
+
+# ========= Preview (MJPEG) =========
+# --display mjpeg serves the preview at http://<host>:PREVIEW_PORT/ instead of opening a window
+PREVIEW_PORT = 8090
+PREVIEW_FPS = 10            # max frames encoded per second, regardless of inference rate
+PREVIEW_WIDTH = 480         # preview is downscaled before drawing + encoding
+PREVIEW_JPEG_QUALITY = 70
+
+class PreviewServer:
+    """
+    Rate-limited MJPEG stream of the preview. Frames are only drawn and encoded
+    while at least one client is connected, and at most PREVIEW_FPS times a second.
+    """
+    def __init__(self, port=PREVIEW_PORT, fps=PREVIEW_FPS):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.min_interval = 1.0 / fps if fps > 0 else 0.0
+        self.clients = 0
+        self.encoded = 0
+        self._cond = threading.Condition()
+        self._jpeg, self._seq = None, 0
+        self._last_submit = 0.0
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                preview._stream(self.wfile)
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="preview", daemon=True)
+        self._thread.start()
+        print(f"[PREVIEW] MJPEG stream on http://0.0.0.0:{port}/ (max {fps} fps)")
+
+    def wants_frame(self, now):
+        return self.clients > 0 and now - self._last_submit >= self.min_interval
+
+    def submit(self, img, now):
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_JPEG_QUALITY])
+        if not ok:
+            return
+        with self._cond:
+            self._jpeg = buf.tobytes()
+            self._seq += 1
+            self._last_submit = now
+            self.encoded += 1
+            self._cond.notify_all()
+
+    def _stream(self, wfile):
+        with self._cond:
+            self.clients += 1
+            seen = self._seq
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq != seen, timeout=5.0)
+                    if self._seq == seen:
+                        continue
+                    jpeg, seen = self._jpeg, self._seq
+                wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                            + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def render_preview(frame, kpts, location_text, st, mirrored, age_ms, stats_lines=()):
+    """Downscale, then draw the light overlay (six keypoints + zone + text) on the copy"""
+    h, w = frame.shape[:2]
+    scale = PREVIEW_WIDTH / w if w > PREVIEW_WIDTH else 1.0
+    img = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else frame.copy()
+    if kpts is not None:
+        scaled = kpts.copy()
+        scaled[:, :2] *= scale
+        draw_used_keypoints(img, scaled, mirrored)
+    draw_overlay(img, img.shape[1], img.shape[0], location_text, st, mirrored, age_ms, stats_lines)
+    return img
+
+class Display:
+    """
+    Output side of the loop, selected with --display:
+      window    full ultralytics skeleton + overlay in a cv2 window (M toggles mirror, ESC quits)
+      mjpeg     six-keypoint preview as a rate-limited MJPEG stream, no GUI
+      headless  no rendering at all
+    Per-frame render cost is tracked so the modes can be compared in the [CAP] report.
+    """
+    def __init__(self, mode, port=PREVIEW_PORT, fps=PREVIEW_FPS):
+        self.mode = mode
+        self.preview = PreviewServer(port, fps) if mode == "mjpeg" else None
+        self.render_sum, self.render_max, self.render_n = 0.0, 0.0, 0
+        self.last_draw_ms = self.last_present_ms = 0.0
+        self.stats_lines = []   # set by the loop from StageTimer.overlay_lines()
+        if mode == "window":
+            open_window()
+
+    def show(self, frame, kpts, results, location_text, st, mirrored, age_ms, now):
+        """Render one frame -> (quit, mirrored). Splits its cost into last_draw_ms / last_present_ms."""
+        t0 = time.perf_counter()
+        t_draw = t0
+        quit_requested = False
+        if self.mode == "window":
+            display = frame
+            if kpts is not None:
+                if results is not None:
+                    display = results.plot(frame)
+                else:
+                    draw_keypoints(display, kpts)
+            draw_overlay(display, display.shape[1], display.shape[0], location_text, st, mirrored, age_ms, self.stats_lines)
+            t_draw = time.perf_counter()
+            cv2.imshow(WINDOW_NAME, display)
+            quit_requested, mirrored = poll_keys(mirrored)
+        elif self.preview and self.preview.wants_frame(now):
+            img = render_preview(frame, kpts, location_text, st, mirrored, age_ms, self.stats_lines)
+            t_draw = time.perf_counter()
+            self.preview.submit(img, now)
+        t_end = time.perf_counter()
+        self.last_draw_ms = (t_draw - t0) * 1000.0
+        self.last_present_ms = (t_end - t_draw) * 1000.0
+        render_ms = (t_end - t0) * 1000.0
+        self.render_sum, self.render_max, self.render_n = self.render_sum + render_ms, max(self.render_max, render_ms), self.render_n + 1
+        return quit_requested, mirrored
+
+    def report(self):
+        """Render stats since the last call, for the periodic log line"""
+        avg = self.render_sum / self.render_n if self.render_n else 0.0
+        text = f"render[{self.mode}] avg={avg:.2f}ms max={self.render_max:.2f}ms"
+        if self.preview:
+            text += f" preview_clients={self.preview.clients} encoded={self.preview.encoded}"
+        self.render_sum, self.render_max, self.render_n = 0.0, 0.0, 0
+        return text
+
+    def close(self):
+        if self.preview:
+            self.preview.close()
+        if self.mode == "window":
+            cv2.destroyAllWindows()
+
+def poll_keys(mirrored):
+    """Keyboard listener -> (quit, mirrored)"""
+    key = cv2.waitKey(1) & 0xFF
+    if key == 27: # ESC to exit
+        return True, mirrored
+    if key == ord('m') or key == ord('M'):
+        mirrored = not mirrored # Toggle mode
+        print(f"Switched Mirror Mode to: {mirrored}")
+    return False, mirrored
@@ -1,227 +1,281 @@
 # pc_publisher_yolo_toggle.py
 # Press 'M' key to toggle Mirror/Normal mode
 # Automatically corrects left/right hand mapping logic based on the mode
-
-import cv2, time, os, json
+#
+# Modes:
+#   python pc_publisher.py                 single-process loop (default)
+#   python pc_publisher.py --pipeline      capture / inference / gesture+publish in separate
+#                                          processes, frames passed through shared memory
+#   --display window|mjpeg|headless        cv2 window (default), MJPEG preview stream, or no rendering
+#   --infer-every N [--track-eval]         infer every Nth frame, optical-flow tracking in between
+#   --roi [--roi-imgsz 320] [--roi-eval]   infer on a crop around the last person at a smaller input size
+#   --motion-gate                          idle the model on static, empty scenes
+#   --model yolov8n-pose.onnx --threads 4  exported ONNX Runtime / OpenVINO backend (see backends.py)
+#   --bench-backends a.pt a.onnx ...       compare backends on the same frames
+#   --autotune clip.mp4                    sweep speed settings, write pose_config.json (loaded at startup)
+#   --video clip.mp4 / --replay-keypoints  offline benchmark, keypoint logs and labeled accuracy report
+#   --gesture-engine [--target size|center] multi-person windowed wave detection
+#   --sources 0 1 [--bench-multi]          several cameras/files batched through one model, one pos/wave stream
+#
+# Modules (next to this script):
+#   mqtt_events  MQTT connection, rate-capped pos/wave publisher, metrics
+#   gestures     position / wave logic and the multi-person gesture engine
+#   backends     PyTorch / ONNX Runtime / OpenVINO backends, --bench-backends
+#   capture      camera, latest-frame grabber, motion gate
+#   tracking     optical-flow tracking, ROI crops, PoseRunner
+#   overlay      drawing, MJPEG preview, Display
+#   timing       per-stage timers
+#   multicam / pipeline / autotune / offline   the modes of the same names
+
+import cv2, time, os, argparse
 import numpy as np
-import paho.mqtt.client as mqtt
-from ultralytics import YOLO
-
-# ========= MQTT Configuration =========
-USE_CLOUD_BROKER = True  
-CLOUD_BROKER = "i27312ff.ala.asia-southeast1.emqxsl.com"
-CLOUD_PORT = 8883 
-CLOUD_USERNAME = "wro-robot"
-CLOUD_PASSWORD = "V!cT0rl11"
-
-LOCAL_BROKER = "192.168.1.3" 
-LOCAL_PORT = 1883
-
-MQTT_BROKER = CLOUD_BROKER if USE_CLOUD_BROKER else LOCAL_BROKER
-MQTT_PORT = CLOUD_PORT if USE_CLOUD_BROKER else LOCAL_PORT
 
-ONE_TOPIC    = "robot/events" 
-SECOND_TOPIC = "robot/waves"   
-TARGET_ROBOT_ID = "wro1" 
+from mqtt_events import METRICS_TOPIC, connect_mqtt, disconnect_mqtt, publish_metrics, publisher
+from gestures import GestureEngine, GestureState, analyze_pose, engine_step, publish_position
+from overlay import PREVIEW_FPS, PREVIEW_PORT, Display
+from backends import BENCH_FRAMES, MODEL_PATH, PoseResult, bench_backends, export_model, load_model
+from capture import (CAMERA_INDEX, CAP_REPORT_SEC, USE_CAPTURE_THREAD, LatestFrameGrabber,
+    MotionGate, open_camera)
+from tracking import FULL_IMGSZ, ROI_IMGSZ, KeypointEval, KeypointTracker, PoseRunner, RoiSelector
+from timing import METRICS_INTERVAL_SEC, OVERLAY_STATS_SEC, StageTimer
+from multicam import bench_multi, run_multi
+from pipeline import run_pipeline
+from autotune import AUTOTUNE_FRAMES, POSE_CONFIG_PATH, autotune, load_config
+from offline import run_offline
+
+# ========= Single-process loop =========
+def run_single_process(args):
+    if args.cv2_threads >= 0:
+        cv2.setNumThreads(args.cv2_threads)
+    cap = open_camera(args.cap_width, args.cap_height)
+    grabber = LatestFrameGrabber(cap) if USE_CAPTURE_THREAD else None
+    display = Display(args.display, args.preview_port, args.preview_fps)
+    model = load_model(args.model, args.threads, track=args.gesture_engine)
+    engine = GestureEngine(args.target) if args.gesture_engine else None
+    tracker = KeypointTracker(args.infer_every) if args.infer_every > 1 else None
+    evaluator = KeypointEval("track") if tracker and args.track_eval else None
+    roi = RoiSelector(args.roi_imgsz, args.imgsz) if args.roi else None
+    roi_evaluator = KeypointEval("roi") if roi and args.roi_eval else None
+    run_model = PoseRunner(model, roi, roi_evaluator, args.imgsz)
+    gate = MotionGate() if args.motion_gate else None
+    timer = StageTimer(args.timing_dump)
+    last_overlay_stats = last_metrics = time.time()
+
+    st = GestureState()
+
+    # Capture stats (frame age = time from capture to inference start)
+    age_sum, age_max, age_n = 0.0, 0.0, 0
+    infer_n, infer_ms_sum, track_n, track_ms_sum = 0, 0.0, 0, 0.0
+    last_cap_report = time.time()
+
+    # ★★★ Control Variable: Default to Mirror Mode. Press 'M' if incorrect. ★★★
+    is_mirrored = not args.no_mirror
 
-# ========= Setup MQTT Client =========
-try:
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-except (TypeError, AttributeError):
-    client = mqtt.Client()
-
-if USE_CLOUD_BROKER:
     try:
-        client.username_pw_set(CLOUD_USERNAME, CLOUD_PASSWORD)
-        client.tls_set() 
-        print(f"MQTT SSL/TLS enabled")
-    except Exception as e:
-        print(f"SSL setup error: {e}")
-
-print(f"Connecting to: {MQTT_BROKER}:{MQTT_PORT}")
-try:
-    client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
-    client.loop_start()
-    print(f"✅ MQTT connected!")
-except Exception as e:
-    print(f"❌ MQTT error: {e}")
-
-def publish_event(event, value, topic):
-    payload = json.dumps({
-        "event": event,
-        "value": value,
-        "robot_id": TARGET_ROBOT_ID 
-    })
-    if topic == 2:
-        client.publish(SECOND_TOPIC, payload, qos=0)
-    client.publish(ONE_TOPIC, payload, qos=0)
-    print(f"PUB: {payload}")
-
-# ========= Detection parameters =========
-CENTER_LEFT_RATIO, CENTER_RIGHT_RATIO = 0.40, 0.50
-DX_L, DX_R = 0.05, 0.05
-DT = 0.7       
-COOLDOWN = 1.5 
-SHOW_MS = 600  
-POS_HEARTBEAT = 0.5
-
-# ========= Camera =========
-cap = cv2.VideoCapture(0, cv2.CAP_DSHOW) 
-cv2.namedWindow("YOLO Control", cv2.WINDOW_NORMAL)
-cv2.resizeWindow("YOLO Control", 960, 720)
-
-print("Loading YOLOv8 model...")
-model = YOLO('yolov8n-pose.pt')
-
-# State variables
-last_x_R, last_t_R = None, None
-last_x_L, last_t_L = None, None
-show_until, show_text = 0.0, ""
-last_pos_sent_value, last_pos_sent_time = "", 0.0
-
-# ★★★ Control Variable: Default to Mirror Mode. Press 'M' if incorrect. ★★★
-IS_MIRRORED = True 
-
-while True:
-    ok, frame = cap.read()
-    if not ok: break
-
-    # 1. Flip frame based on the toggle switch
-    if IS_MIRRORED:
-        frame = cv2.flip(frame, 1)
-
-    h, w = frame.shape[:2]
-    now = time.time()
-
-    # 2. Run Inference
-    results = model(frame, verbose=False, conf=0.5) 
-    
-    location_text = ""
-    pos = None
-
-    if results and len(results[0].keypoints) > 0:
-        kpts = results[0].keypoints.data[0].cpu().numpy()
-        
-        # ★★★ Dynamic Index Mapping ★★★
-        if IS_MIRRORED:
-            # In Mirror Mode: YOLO sees "Left Hand (ID 9)" but it is actually the user's "Right Hand".
-            # We need to swap the indices logic.
-            IDX_L_SHOULDER = 6   # YOLO Right Shoulder -> Real Left Shoulder
-            IDX_R_SHOULDER = 5   # YOLO Left Shoulder -> Real Right Shoulder
-            IDX_L_WRIST    = 10  # YOLO Right Wrist -> Real Left Wrist
-            IDX_R_WRIST    = 9   # YOLO Left Wrist -> Real Right Wrist
-            IDX_L_HIP      = 12
-            IDX_R_HIP      = 11
-        else:
-            # In Normal Mode: Direct mapping to standard COCO indices.
-            IDX_L_SHOULDER = 5
-            IDX_R_SHOULDER = 6
-            IDX_L_WRIST    = 9
-            IDX_R_WRIST    = 10
-            IDX_L_HIP      = 11
-            IDX_R_HIP      = 12
-
-        # Simple check if shoulders are detected (using mapped IDs)
-        if kpts[IDX_L_SHOULDER][2] > 0.3 and kpts[IDX_R_SHOULDER][2] > 0.3:
-            
-            # Draw skeleton (labels=False prevents mirrored text)
-            annotated_frame = results[0].plot(img=frame, labels=False, conf=False, boxes=False)
-            
-            def get_norm_point(index):
-                px, py, conf = kpts[index]
-                return px / w, py / h, conf
-
-            # ===== 1. Position Logic (Left / Center / Right) =====
-            lh_x, _, _ = get_norm_point(IDX_L_HIP) 
-            rh_x, _, _ = get_norm_point(IDX_R_HIP)
-            
-            cx_ratio = (lh_x + rh_x) / 2.0
-            cx_pixel = int(cx_ratio * w)
-            
-            left_px = int(CENTER_LEFT_RATIO * w)
-            right_px = int(CENTER_RIGHT_RATIO * w)
-
-            # Logic is based on visual position on screen:
-            # If person is on the right side of the screen -> Right
-            
-            if left_px <= cx_pixel <= right_px:
-                location_text, pos = "Center", "center"
-            elif cx_pixel < left_px:
-                location_text, pos = "Left", "left"
+        while True:
+            timer.start()
+            if grabber:
+                ok, frame, frame_t = grabber.read()
             else:
-                location_text, pos = "Right", "right"
-
-            # ===== 2. Right Hand Wave (Physical Right Hand) =====
-            rw_x, rw_y, _ = get_norm_point(IDX_R_WRIST)
-            rs_x, rs_y, _ = get_norm_point(IDX_R_SHOULDER)
-            
-            above_R = (rw_y < rs_y)
-
-            if last_x_R is not None and last_t_R is not None:
-                dx_R = abs(rw_x - last_x_R)
-                dt_R = now - last_t_R
-                if dx_R > DX_R and dt_R < DT and above_R and (now > show_until + COOLDOWN):
-                    show_text = "Right Wave!"
-                    show_until = now + SHOW_MS/1000.0
-                    publish_event("wave", "R", 2)
-            last_x_R, last_t_R = rw_x, now
-
-            # ===== 3. Left Hand Wave (Physical Left Hand) =====
-            lw_x, lw_y, _ = get_norm_point(IDX_L_WRIST)
-            ls_x, ls_y, _ = get_norm_point(IDX_L_SHOULDER)
-            
-            above_L = (lw_y < ls_y)
-
-            if last_x_L is not None and last_t_L is not None:
-                dx_L = abs(lw_x - last_x_L)
-                dt_L = now - last_t_L
-                if dx_L > DX_L and dt_L < DT and above_L and (now > show_until + COOLDOWN):
-                    show_text = "Left Wave!"
-                    show_until = now + SHOW_MS/1000.0
-                    # [USER REQUEST] Left wave still sends "R"
-                    publish_event("wave", "R", 2) 
-                    
-            last_x_L, last_t_L = lw_x, now
+                ok, frame = cap.read()
+                frame_t = time.time()
+            if not ok: break
+            timer.lap("capture")
+
+            # 1. Flip frame based on the toggle switch
+            if is_mirrored:
+                frame = cv2.flip(frame, 1)
+
+            h, w = frame.shape[:2]
+            now = time.time()
+
+            age_ms = (now - frame_t) * 1000.0
+            age_sum, age_max, age_n = age_sum + age_ms, max(age_max, age_ms), age_n + 1
+            if now - last_cap_report >= CAP_REPORT_SEC:
+                elapsed = now - last_cap_report
+                dropped = grabber.dropped if grabber else 0
+                line = (f"[CAP] update_fps={age_n / elapsed:.1f} infer_fps={infer_n / elapsed:.1f} dropped={dropped} "
+                        f"frame_age avg={age_sum / age_n:.0f}ms max={age_max:.0f}ms "
+                        f"infer avg={infer_ms_sum / max(infer_n, 1):.1f}ms")
+                if tracker:
+                    line += f" track avg={track_ms_sum / max(track_n, 1):.2f}ms tracked={track_n} lost={tracker.lost}"
+                if evaluator:
+                    line += " " + evaluator.report()
+                if roi:
+                    line += " " + roi.report()
+                if roi_evaluator:
+                    line += " " + roi_evaluator.report()
+                if gate:
+                    line += " " + gate.report()
+                print(line + " " + display.report() + " " + publisher.report())
+                age_sum, age_max, age_n = 0.0, 0.0, 0
+                infer_n, infer_ms_sum, track_n, track_ms_sum = 0, 0.0, 0, 0.0
+                last_cap_report = now
+            if now - last_overlay_stats >= OVERLAY_STATS_SEC:
+                display.stats_lines = timer.overlay_lines()
+                last_overlay_stats = now
+            if args.metrics_interval > 0 and now - last_metrics >= args.metrics_interval:
+                publish_metrics(timer.summary(), {"dropped": grabber.dropped if grabber else 0})
+                last_metrics = now
+            timer.lap("preprocess")
+
+            # 2. Run Inference (or track from the last one)
+            results, kpts = None, None
+            gray = None
+            if tracker:
+                t0 = time.perf_counter()
+                gray = tracker.prepare(frame)
+                if not tracker.due():
+                    kpts = tracker.track(gray, is_mirrored)
+                    if kpts is not None:
+                        track_n += 1
+                track_ms_sum += (time.perf_counter() - t0) * 1000.0
+                timer.lap("track")
+
+            if (kpts is None or evaluator) and (gate is None or gate.allow(frame, frame_t, now)):
+                t0 = time.perf_counter()
+                results, inferred = run_model(frame, is_mirrored, now)
+                infer_ms_sum += (time.perf_counter() - t0) * 1000.0
+                infer_n += 1
+                timer.lap("infer")
+                timer.move("infer", "transfer", model.last_post_ms)
+                if gate:
+                    gate.observe(inferred is not None, now)
+                if evaluator and kpts is not None:
+                    evaluator.add(kpts, inferred, w, h, is_mirrored)
+                    results = None   # the tracked keypoints drive this frame
+                else:
+                    kpts = inferred
+                    if tracker:
+                        tracker.reset(gray, kpts)
+
+            location_text = ""
+            pos = None
+            if engine:
+                # Everyone from a full inference; on tracked / ROI frames just the one followed person
+                people = results if results is not None else PoseResult(
+                    kpts[None] if kpts is not None else np.zeros((0, 17, 3), np.float32), np.zeros((0, 4), np.float32))
+                target, location_text, pos = engine_step(engine, people, w, h, now, is_mirrored, st)
+                if tracker and results is not None:
+                    tracker.reset(gray, target)   # follow the target, not just the first detection
+                kpts = target
+            elif kpts is not None:
+                location_text, pos = analyze_pose(kpts, w, h, now, is_mirrored, st)
+            timer.lap("gesture")
+
+            publish_position(pos, now, st)
+            publisher.flush()
+            timer.lap("publish")
+
+            was_mirrored = is_mirrored
+            quit_requested, is_mirrored = display.show(frame, kpts, results, location_text, st, is_mirrored, age_ms, now)
+            timer.lap("display")
+            timer.move("display", "draw", display.last_draw_ms)
+            timer.end()
+            if tracker and is_mirrored != was_mirrored:
+                tracker.reset(None, None)   # next frame is flipped: start over from a fresh inference
+            if quit_requested:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if grabber:
+            grabber.stop()
+        cap.release()
+        display.close()
+        timer.close()
+
+# ========= Main =========
+def parse_args():
+    parser = argparse.ArgumentParser(description="YOLO pose -> MQTT pos/wave publisher")
+    parser.add_argument("--model", default=MODEL_PATH,
+                        help="pose model: .pt (PyTorch), .onnx (ONNX Runtime) or OpenVINO .xml / export directory")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="inference threads per model instance (0 = library default; pipeline: cores / workers)")
+    parser.add_argument("--export", choices=("onnx", "openvino"), help="export MODEL_PATH to this format and exit")
+    parser.add_argument("--imgsz", type=int, default=FULL_IMGSZ, help="model input size (and size for --export)")
+    parser.add_argument("--cv2-threads", type=int, default=-1, help="cv2.setNumThreads (-1 = OpenCV default)")
+    parser.add_argument("--cap-width", type=int, default=0, help="requested camera width (0 = driver default)")
+    parser.add_argument("--cap-height", type=int, default=0, help="requested camera height (0 = driver default)")
+    parser.add_argument("--autotune", metavar="CLIP",
+                        help=f"sweep speed settings on a recorded clip and write the best to {os.path.basename(POSE_CONFIG_PATH)}")
+    parser.add_argument("--config", default=POSE_CONFIG_PATH, help="tuned settings loaded as defaults at startup")
+    parser.add_argument("--bench-backends", nargs="+", metavar="MODEL",
+                        help="benchmark these models on the same frames and exit (first one is the reference)")
+    parser.add_argument("--source", default=str(CAMERA_INDEX), help="video file or camera index for --bench-backends")
+    parser.add_argument("--bench-frames", type=int, default=BENCH_FRAMES)
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run capture, inference and gesture/publish in separate processes")
+    parser.add_argument("--infer-workers", type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                        help="inference processes in --pipeline mode")
+    parser.add_argument("--display", choices=("window", "mjpeg", "headless"), default="window",
+                        help="window: full overlay in a cv2 window; mjpeg: six-keypoint preview stream; "
+                             "headless: no rendering (Ctrl+C to quit)")
+    parser.add_argument("--preview-port", type=int, default=PREVIEW_PORT, help="MJPEG preview port")
+    parser.add_argument("--preview-fps", type=float, default=PREVIEW_FPS, help="max MJPEG preview frame rate")
+    parser.add_argument("--infer-every", type=int, default=1,
+                        help="run the model every N frames and track keypoints with optical flow in between "
+                             "(single-process mode)")
+    parser.add_argument("--track-eval", action="store_true",
+                        help="with --infer-every: still infer every frame and report tracked-vs-inferred error")
+    parser.add_argument("--roi", action="store_true",
+                        help="infer on a crop around the last detected person at --roi-imgsz (single-process mode)")
+    parser.add_argument("--roi-imgsz", type=int, default=ROI_IMGSZ, help="model input size for ROI crops")
+    parser.add_argument("--roi-eval", action="store_true",
+                        help="with --roi: also infer the full frame and report ROI-vs-full error and latency")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="drop to a low inference rate while the scene is static (single-process mode)")
+    parser.add_argument("--no-mirror", action="store_true",
+                        help="start in normal (non-mirrored) mode; M toggles it in window mode")
+    parser.add_argument("--timing-dump", metavar="PATH",
+                        help="write per-frame stage timings to PATH (.csv, or .jsonl for JSON lines)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL_SEC,
+                        help=f"seconds between timing summaries on {METRICS_TOPIC} (0 = off)")
+    parser.add_argument("--sources", nargs="+", metavar="SRC",
+                        help="multi-camera: camera indices and/or video files, batched through one model")
+    parser.add_argument("--bench-multi", action="store_true",
+                        help="with --sources: compare batched inference with one process per source and exit")
+    parser.add_argument("--gesture-engine", action="store_true",
+                        help="multi-person windowed wave detection with target selection (single-process / offline)")
+    parser.add_argument("--target", choices=("size", "center"), default="size",
+                        help="with --gesture-engine: follow the largest or the most central person")
+    parser.add_argument("--video", help="offline: run on this video file as fast as possible (no camera/window/MQTT)")
+    parser.add_argument("--dump-keypoints", metavar="NPZ", help="offline: save per-frame keypoints of --video")
+    parser.add_argument("--replay-keypoints", metavar="NPZ", help="offline: run the gesture logic on a keypoint log")
+    parser.add_argument("--labels", help="offline: ground-truth JSON to score wave/position events against")
+    # Tuned settings replace the built-in defaults; explicit flags still win
+    pre, _ = parser.parse_known_args()
+    if not pre.autotune:
+        parser.set_defaults(**load_config(pre.config))
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.export:
+        export_model(args.export, args.imgsz)
+        return
+    if args.bench_backends:
+        bench_backends(args.bench_backends, args.source, args.bench_frames, args.threads)
+        return
+    if args.autotune:
+        autotune(args.autotune, args.model, AUTOTUNE_FRAMES, args.config)
+        return
+    if args.video or args.replay_keypoints:
+        run_offline(args)
+        return
+    if args.sources and args.bench_multi:
+        bench_multi(args.sources, args.bench_frames, args.model, args.threads, args.imgsz)
+        return
+    connect_mqtt()
+    try:
+        if args.sources:
+            run_multi(args)
+        elif args.pipeline:
+            run_pipeline(args)
         else:
-            annotated_frame = frame
-    else:
-        annotated_frame = frame
-
-    # ===== Send position heartbeat =====
-    if pos:
-        if (pos != last_pos_sent_value) or (now - last_pos_sent_time > POS_HEARTBEAT):
-            publish_event("pos", pos, 1)
-            last_pos_sent_value = pos
-            last_pos_sent_time  = now
-
-    display = annotated_frame
-    
-    cv2.rectangle(display, (int(CENTER_LEFT_RATIO*w), 0), (int(CENTER_RIGHT_RATIO*w), h), (255,255,0), 2)
-
-    # Display current mode
-    mode_str = "Mode: MIRROR" if IS_MIRRORED else "Mode: NORMAL"
-    cv2.putText(display, mode_str, (10, h - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    cv2.putText(display, "[M] to toggle", (10, h - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
-
-    if location_text:
-        cv2.putText(display, location_text, (30, 25),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.1, (255,255,255), 2, cv2.LINE_AA)
-
-    if time.time() < show_until and show_text:
-        cv2.putText(display, show_text, (30, 70),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0,0,255), 4, cv2.LINE_AA)
-
-    cv2.imshow("YOLO Control", display)
-    
-    # Keyboard listener
-    key = cv2.waitKey(1) & 0xFF
-    if key == 27: # ESC to exit
-        break
-    elif key == ord('m') or key == ord('M'):
-        IS_MIRRORED = not IS_MIRRORED # Toggle mode
-        print(f"Switched Mirror Mode to: {IS_MIRRORED}")
-
-cap.release()
-cv2.destroyAllWindows()
-client.loop_stop()
-client.disconnect()
+            run_single_process(args)
+    finally:
+        disconnect_mqtt()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# Multi-process pipeline: capture / inference / gesture+publish with frames in shared memory
+import cv2, time, os, queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from mqtt_events import publisher
+from gestures import GestureState, analyze_pose, publish_position, shoulders_visible
+from overlay import Display
+from backends import load_model
+from capture import CAP_REPORT_SEC, open_camera
+
+# ========= Multi-process pipeline =========
+# capture process ──frames (shared memory ring)──▶ N inference processes ──keypoints (queue)──▶ main: gesture + publish + display
+PIPELINE_SLOTS = 6          # frame slots in the shared-memory ring
+PIPELINE_WIDTH, PIPELINE_HEIGHT = 640, 480
+MAX_PEOPLE = 10             # keypoint rows passed back per frame
+
+# Control words in SharedFrameRing.ctrl
+CTRL_LATEST_SEQ, CTRL_LATEST_SLOT, CTRL_CLAIMED_SEQ, CTRL_CAPTURED, CTRL_DROPPED, CTRL_MIRRORED = range(6)
+
+class SharedFrameRing:
+    """
+    Ring of fixed-size BGR frames in multiprocessing.shared_memory.
+    The writer never overwrites a slot that a reader holds; readers always take the
+    newest unclaimed frame and run on the shared buffer directly (no pickling copies).
+    """
+    def __init__(self, slots, height, width, name=None, ctrl=None, in_use=None, meta=None, cond=None):
+        self.slots, self.height, self.width = slots, height, width
+        self.shape = (slots, height, width, 3)
+        size = int(np.prod(self.shape))
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.frames = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.cond = cond if cond is not None else mp.Condition()
+        self.ctrl = ctrl if ctrl is not None else mp.Array('q', 6, lock=False)
+        self.in_use = in_use if in_use is not None else mp.Array('i', slots, lock=False)   # readers per slot, -1 = writing
+        self.meta = meta if meta is not None else mp.Array('d', slots * 2, lock=False)     # (seq, capture time) per slot
+        if self.owner:
+            self.ctrl[CTRL_LATEST_SEQ] = -1
+            self.ctrl[CTRL_CLAIMED_SEQ] = -1
+            self.ctrl[CTRL_MIRRORED] = 1
+
+    def handle(self):
+        """Picklable arguments for attaching from a child process"""
+        return (self.slots, self.height, self.width, self.shm.name, self.ctrl, self.in_use, self.meta, self.cond)
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(*handle)
+
+    # ----- writer -----
+    def begin_write(self):
+        with self.cond:
+            latest = self.ctrl[CTRL_LATEST_SLOT] if self.ctrl[CTRL_LATEST_SEQ] >= 0 else -1
+            for i in range(1, self.slots + 1):
+                slot = (latest + i) % self.slots
+                if self.in_use[slot] == 0 and slot != latest:
+                    self.in_use[slot] = -1
+                    # seqlock: invalidate the slot's seq while it is rewritten, so a
+                    # copy_if_current overlapping this write sees the change and bails out
+                    self.meta[slot * 2] = -1
+                    return slot
+        return None  # every slot busy: drop this frame
+
+    def commit(self, slot, t):
+        with self.cond:
+            seq = self.ctrl[CTRL_LATEST_SEQ] + 1
+            if self.ctrl[CTRL_LATEST_SEQ] > self.ctrl[CTRL_CLAIMED_SEQ]:
+                self.ctrl[CTRL_DROPPED] += 1   # previous frame was never picked up
+            self.meta[slot * 2], self.meta[slot * 2 + 1] = seq, t
+            self.in_use[slot] = 0
+            self.ctrl[CTRL_LATEST_SEQ], self.ctrl[CTRL_LATEST_SLOT] = seq, slot
+            self.ctrl[CTRL_CAPTURED] += 1
+            self.cond.notify_all()
+
+    # ----- readers -----
+    def claim_latest(self, stop_event, timeout=0.5):
+        """Wait for a frame nobody has claimed yet -> (slot, seq, capture_time) or None"""
+        with self.cond:
+            ready = self.cond.wait_for(
+                lambda: self.ctrl[CTRL_LATEST_SEQ] > self.ctrl[CTRL_CLAIMED_SEQ] or stop_event.is_set(), timeout)
+            if not ready or stop_event.is_set():
+                return None
+            slot, seq = int(self.ctrl[CTRL_LATEST_SLOT]), int(self.ctrl[CTRL_LATEST_SEQ])
+            self.ctrl[CTRL_CLAIMED_SEQ] = seq
+            self.in_use[slot] += 1
+            return slot, seq, self.meta[slot * 2 + 1]
+
+    def release(self, slot):
+        with self.cond:
+            self.in_use[slot] -= 1
+
+    def copy_if_current(self, slot, seq):
+        """Copy a slot for display, or None if the writer already reused it"""
+        if self.meta[slot * 2] != seq:
+            return None
+        frame = self.frames[slot].copy()
+        return frame if self.meta[slot * 2] == seq else None
+
+    def close(self):
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def capture_worker(ring_handle, stop_event, cap_width=0, cap_height=0):
+    ring = SharedFrameRing.attach(ring_handle)
+    cap = open_camera(cap_width, cap_height)
+    try:
+        while not stop_event.is_set():
+            ok, frame = cap.read()
+            t = time.time()
+            if not ok:
+                break
+            slot = ring.begin_write()
+            if slot is None:
+                continue
+            if frame.shape[:2] != (ring.height, ring.width):
+                frame = cv2.resize(frame, (ring.width, ring.height))
+            if ring.ctrl[CTRL_MIRRORED]:
+                cv2.flip(frame, 1, dst=ring.frames[slot])
+            else:
+                ring.frames[slot][:] = frame
+            ring.commit(slot, t)
+    finally:
+        stop_event.set()
+        cap.release()
+        ring.close()
+
+def inference_worker(ring_handle, results_q, stop_event, worker_id, model_path, threads, imgsz=None):
+    ring = SharedFrameRing.attach(ring_handle)
+    model = load_model(model_path, threads)
+    try:
+        while not stop_event.is_set():
+            claimed = ring.claim_latest(stop_event)
+            if claimed is None:
+                continue
+            slot, seq, frame_t = claimed
+            mirrored = bool(ring.ctrl[CTRL_MIRRORED])
+            t0 = time.time()
+            try:
+                results = model.predict(ring.frames[slot], imgsz)
+            finally:
+                ring.release(slot)
+            infer_ms = (time.time() - t0) * 1000.0
+            kpts = None
+            if len(results.kpts) > 0:
+                kpts = results.kpts[:MAX_PEOPLE].astype(np.float32)
+            results_q.put((seq, slot, frame_t, mirrored, infer_ms, worker_id, kpts))
+    finally:
+        ring.close()
+
+def run_pipeline(args):
+    ring = SharedFrameRing(PIPELINE_SLOTS, PIPELINE_HEIGHT, PIPELINE_WIDTH)
+    results_q = mp.Queue(maxsize=args.infer_workers * 2)
+    stop_event = mp.Event()
+    threads = args.threads or max(1, (os.cpu_count() or 2) // args.infer_workers)
+
+    procs = [mp.Process(target=capture_worker, name="capture", daemon=True,
+                        args=(ring.handle(), stop_event, args.cap_width, args.cap_height))]
+    for i in range(args.infer_workers):
+        procs.append(mp.Process(target=inference_worker, name=f"infer-{i}", daemon=True,
+                                args=(ring.handle(), results_q, stop_event, i, args.model, threads, args.imgsz)))
+    for p in procs:
+        p.start()
+    print(f"[PIPE] capture + {args.infer_workers} inference process(es), {threads} inference thread(s) each")
+
+    ring.ctrl[CTRL_MIRRORED] = int(not args.no_mirror)
+    display = Display(args.display, args.preview_port, args.preview_fps)
+    st = GestureState()
+    w, h = PIPELINE_WIDTH, PIPELINE_HEIGHT
+    last_seq = -1
+    processed, stale = 0, 0
+    age_sum, infer_sum = 0.0, 0.0
+    last_report = time.time()
+    is_mirrored = bool(ring.ctrl[CTRL_MIRRORED])
+
+    try:
+        while not stop_event.is_set():
+            try:
+                seq, slot, frame_t, frame_mirrored, infer_ms, worker_id, people = results_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if seq <= last_seq:
+                stale += 1   # a slower worker finished an older frame after a newer one
+                continue
+            last_seq = seq
+            now = time.time()
+            processed += 1
+            age_ms = (now - frame_t) * 1000.0
+            age_sum += age_ms
+            infer_sum += infer_ms
+
+            location_text, pos = "", None
+            kpts = people[0] if people is not None and len(people) > 0 else None
+            if kpts is not None and shoulders_visible(kpts, frame_mirrored):
+                location_text, pos = analyze_pose(kpts, w, h, now, frame_mirrored, st)
+            publish_position(pos, now, st)
+            publisher.flush()
+
+            # Headless mode never touches the frame; otherwise copy it out before the ring reuses the slot
+            quit_requested = False
+            if display.mode == "window" or (display.preview and display.preview.wants_frame(now)):
+                frame = ring.copy_if_current(slot, seq)
+                if frame is not None:
+                    quit_requested, is_mirrored = display.show(
+                        frame, kpts if location_text else None, None, location_text, st, is_mirrored, age_ms, now)
+                    ring.ctrl[CTRL_MIRRORED] = int(is_mirrored)
+            if quit_requested:
+                break
+
+            if now - last_report >= CAP_REPORT_SEC:
+                elapsed = now - last_report
+                print(f"[PIPE] e2e_fps={processed / elapsed:.1f} captured={ring.ctrl[CTRL_CAPTURED]} "
+                      f"dropped={ring.ctrl[CTRL_DROPPED]} stale={stale} "
+                      f"frame_age avg={age_sum / processed:.0f}ms infer avg={infer_sum / processed:.0f}ms "
+                      f"{display.report()} {publisher.report()}")
+                processed, age_sum, infer_sum = 0, 0.0, 0.0
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        with ring.cond:
+            ring.cond.notify_all()
+        for p in procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        ring.close()
+        display.close()
@@ -0,0 +1,4 @@
+# The pose scripts run from pose_detection/ and import each other as top-level modules
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
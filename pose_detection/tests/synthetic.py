@@ -0,0 +1,64 @@
+# Synthetic keypoints and event recorders shared by the pose tests
+import numpy as np
+
+from backends import PoseResult
+from gestures import GestureState
+from pipeline import MAX_PEOPLE
+
+W, H = 640, 480
+FPS = 15.0
+
+def person(cx, wave_dx=None, scale=1.0, w=W, h=H):
+    """
+    (17, 3) pixel keypoints of a person whose hip center is at cx (fraction of width), non-mirrored.
+    wave_dx=None keeps both wrists at the hips; a number raises them above the shoulders, shifted by it.
+    """
+    kpts = np.zeros((17, 3), np.float32)
+    kpts[:, 2] = 0.9
+    half = 0.05 * scale
+    kpts[5], kpts[6] = ((cx - half) * w, 0.35 * h, 0.9), ((cx + half) * w, 0.35 * h, 0.9)      # shoulders
+    kpts[11], kpts[12] = ((cx - 0.8 * half) * w, 0.65 * h, 0.9), ((cx + 0.8 * half) * w, 0.65 * h, 0.9)   # hips
+    if wave_dx is None:
+        kpts[9], kpts[10] = ((cx - 2 * half) * w, 0.7 * h, 0.9), ((cx + 2 * half) * w, 0.7 * h, 0.9)
+    else:
+        kpts[9] = ((cx - 2 * half + wave_dx) * w, 0.2 * h, 0.9)
+        kpts[10] = ((cx + 2 * half + wave_dx) * w, 0.2 * h, 0.9)
+    return kpts
+
+def wave_dx(t):
+    # 2.5 Hz, +-0.1 of the width: fast enough for the frame-to-frame DX test at 15 fps
+    return 0.1 * np.sin(2 * np.pi * 2.5 * t)
+
+def result(*people):
+    kpts = np.stack(people) if people else np.zeros((0, 17, 3), np.float32)
+    return PoseResult(kpts, np.zeros((len(kpts), 4), np.float32))
+
+class Recorder:
+    """GestureState publish hook that keeps (now, event, value)"""
+    def __init__(self):
+        self.events = []
+        self.now = 0.0
+
+    def __call__(self, event, value, topic):
+        self.events.append((self.now, event, value))
+
+    def values(self, event):
+        return [value for _, e, value in self.events if e == event]
+
+    def times(self, event):
+        return [t for t, e, _ in self.events if e == event]
+
+def recording_state():
+    rec = Recorder()
+    return rec, GestureState(publish=rec)
+
+def write_log(path, seconds=6.0):
+    """--dump-keypoints style log: left until 2 s, then right; hands up at 3-4.5 s with a wave burst from 3.5 s"""
+    n = int(seconds * FPS)
+    kpts = np.zeros((n, MAX_PEOPLE, 17, 3), np.float16)
+    t = np.arange(n) / FPS
+    for i in range(n):
+        raised, waving = int(3.0 * FPS) <= i < int(4.5 * FPS), i >= int(3.5 * FPS)
+        kpts[i, 0] = person(0.2 if i < int(2 * FPS) else 0.8, (wave_dx(t[i]) if waving else 0.0) if raised else None)
+    np.savez_compressed(path, t=t.astype(np.float32), count=np.ones(n, np.uint8), kpts=kpts,
+                        fps=FPS, width=W, height=H, mirrored=False)
@@ -0,0 +1,16 @@
+# Autotune scoring: wave agreement between the reference and a candidate configuration
+import pytest
+
+from autotune import AUTOTUNE_WAVE_TOLERANCE, wave_agreement
+
+def test_wave_agreement():
+    assert wave_agreement([], []) == 1.0
+    assert wave_agreement([1.0, 4.0], [1.3, 4.2]) == 1.0
+    assert wave_agreement([1.0, 4.0], [1.3]) == 0.5
+    assert wave_agreement([1.0], [1.3, 1.4, 6.0]) == pytest.approx(1 / 3)
+
+def test_wave_agreement_tolerance():
+    assert wave_agreement([1.0], [1.0 + AUTOTUNE_WAVE_TOLERANCE]) == 1.0
+    assert wave_agreement([1.0], [1.0 + AUTOTUNE_WAVE_TOLERANCE + 0.01]) == 0.0
+    # each candidate matches at most one reference wave
+    assert wave_agreement([1.0, 1.2], [1.1]) == 0.5
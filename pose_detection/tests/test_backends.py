@@ -0,0 +1,60 @@
+# Exported-model backends: letterbox + YOLOv8-pose decoding, independent of the runtime
+import numpy as np
+import pytest
+
+from backends import MODEL_CONF, ExportedBackend
+
+class FixedOutput(ExportedBackend):
+    """Returns a canned raw output in letterboxed input coordinates"""
+    name = "fixed"
+
+    def __init__(self, pred, input_size=640):
+        self.pred, self.input_size = pred, input_size
+        self.blob_shape = None
+
+    def _run(self, blob):
+        self.blob_shape = blob.shape
+        return self.pred.T[None]
+
+def anchor(cx, cy, bw, bh, score, kpt_xy):
+    row = np.zeros(56, np.float32)
+    row[:5] = cx, cy, bw, bh, score
+    kpts = np.zeros((17, 3), np.float32)
+    kpts[:, :2], kpts[:, 2] = kpt_xy, 0.9
+    row[5:] = kpts.reshape(-1)
+    return row
+
+def test_exported_backend_requires_run():
+    with pytest.raises(TypeError):
+        ExportedBackend()
+
+def test_decode_undoes_letterbox():
+    # 480x640 frame into a 640 input: scale 1, 80 px of padding top and bottom
+    pred = np.stack([anchor(320, 380, 100, 200, 0.9, (300, 360)),
+                     anchor(320, 380, 100, 200, MODEL_CONF / 2, (0, 0))])
+    backend = FixedOutput(pred)
+    result = backend.predict(np.zeros((480, 640, 3), np.uint8))
+    assert backend.blob_shape == (1, 3, 640, 640)
+    assert result.kpts.shape == (1, 17, 3) and result.ids is None
+    np.testing.assert_allclose(result.boxes[0], [270, 200, 370, 400])
+    np.testing.assert_allclose(result.kpts[0, :, :2], np.tile([300, 280], (17, 1)))
+
+def test_decode_scales_to_smaller_input():
+    # 480x640 frame into a 320 input: scale 0.5, 40 px of padding top and bottom
+    pred = np.stack([anchor(160, 190, 50, 100, 0.9, (150, 180))])
+    result = FixedOutput(pred, 320).predict(np.zeros((480, 640, 3), np.uint8))
+    np.testing.assert_allclose(result.boxes[0], [270, 200, 370, 400])
+    np.testing.assert_allclose(result.kpts[0, 0, :2], [300, 280])
+
+def test_nms_keeps_one_of_overlapping_boxes():
+    pred = np.stack([anchor(320, 380, 100, 200, 0.9, (300, 360)),
+                     anchor(322, 381, 100, 200, 0.8, (0, 0)),
+                     anchor(100, 380, 60, 120, 0.7, (100, 360))])
+    result = FixedOutput(pred).predict_batch([np.zeros((480, 640, 3), np.uint8)])[0]
+    assert len(result.kpts) == 2
+    np.testing.assert_allclose(sorted(result.kpts[:, 0, 0]), [100, 300])
+
+def test_no_detections():
+    pred = np.stack([anchor(320, 380, 100, 200, 0.1, (0, 0))])
+    result = FixedOutput(pred).predict(np.zeros((480, 640, 3), np.uint8))
+    assert result.kpts.shape == (0, 17, 3) and result.boxes.shape == (0, 4)
@@ -0,0 +1,113 @@
+# Position / wave logic on synthetic keypoints
+import numpy as np
+
+from gestures import (COOLDOWN, POS_KEEPALIVE_SEC, ZONE_MIN_DWELL_SEC, GestureEngine, analyze_pose,
+                      classify_position, engine_step, publish_position)
+from synthetic import FPS, H, W, person, recording_state, result, wave_dx
+
+# ========= Single-person logic =========
+def test_analyze_pose_wave_respects_cooldown():
+    rec, st = recording_state()
+    for i in range(int(4 * FPS)):
+        t = 2.0 + i / FPS
+        rec.now = t
+        analyze_pose(person(0.45, wave_dx(t)), W, H, t, False, st)
+    waves = rec.times("wave")
+    assert rec.values("wave") == ["R"] * len(waves)
+    assert len(waves) == 2
+    assert waves[1] - waves[0] > COOLDOWN
+
+def test_analyze_pose_ignores_lowered_wrists():
+    rec, st = recording_state()
+    for i in range(int(3 * FPS)):
+        t = 2.0 + i / FPS
+        kpts = person(0.45)
+        kpts[[9, 10], 0] += wave_dx(t) * W
+        analyze_pose(kpts, W, H, t, False, st)
+    assert rec.events == []
+
+def test_classify_position_mirrored_swaps_hips():
+    kpts = person(0.2)
+    assert classify_position(kpts, W, True) == classify_position(kpts, W, False)
+
+def test_classify_position_hysteresis():
+    w = 1000
+    at = lambda cx: person(cx, w=w)
+    assert classify_position(at(0.41), w, False)[1] == "center"
+    assert classify_position(at(0.39), w, False)[1] == "left"
+    # boundary jitter does not flip an established zone...
+    assert classify_position(at(0.39), w, False, prev="center")[1] == "center"
+    assert classify_position(at(0.42), w, False, prev="left")[1] == "left"
+    assert classify_position(at(0.52), w, False, prev="center")[1] == "center"
+    # ...but a clear move past the margin does
+    assert classify_position(at(0.36), w, False, prev="center")[1] == "left"
+    assert classify_position(at(0.44), w, False, prev="left")[1] == "center"
+    assert classify_position(at(0.54), w, False, prev="center")[1] == "right"
+
+def test_publish_position_dwell_and_keepalive():
+    rec, st = recording_state()
+    steps = [(0.0, "left"), (0.1, "left"), (ZONE_MIN_DWELL_SEC + 0.01, "left"),
+             (0.25, "right"), (0.3, "left"),                  # one-frame flicker: nothing sent
+             (1.0, "right"), (1.1, "right"), (1.2, "right"),  # sent once it held ZONE_MIN_DWELL_SEC
+             (2.0, None), (2.5, "right"),
+             (1.2 + POS_KEEPALIVE_SEC + 0.1, "right")]        # keepalive
+    for t, pos in steps:
+        rec.now = t
+        publish_position(pos, t, st)
+    assert [(round(t, 2), value) for t, _, value in rec.events] == [
+        (round(ZONE_MIN_DWELL_SEC + 0.01, 2), "left"), (1.2, "right"), (round(1.3 + POS_KEEPALIVE_SEC, 2), "right")]
+
+# ========= Gesture engine =========
+def test_engine_detects_wave_and_follows_the_waver():
+    engine = GestureEngine(target="size")
+    rec, st = recording_state()
+    seen = []
+    for i in range(int(3 * FPS)):
+        t = 1.0 + i / FPS
+        rec.now = t
+        waving = person(0.2, wave_dx(t) if t >= 2.0 else None)
+        bigger = person(0.7, scale=1.6)
+        _, _, pos = engine_step(engine, result(bigger, waving), W, H, t, False, st)
+        seen.append((t, pos))
+    waves = rec.times("wave")
+    assert len(waves) == 1 and 2.0 < waves[0] < 2.0 + 1.0
+    # largest person until the wave, then the waver for TARGET_HOLD_SEC
+    assert all(pos == "right" for t, pos in seen if t < waves[0])
+    assert all(pos == "left" for t, pos in seen if t >= waves[0])
+
+def test_engine_target_center():
+    engine = GestureEngine(target="center")
+    kpts, waved = engine.update(result(person(0.15, scale=1.6), person(0.55)), W, H, 1.0, False)
+    assert len(waved) == 0
+    assert classify_position(kpts, W, False)[1] == "right"
+
+def test_engine_needs_raised_oscillation():
+    engine = GestureEngine()
+    for i in range(int(3 * FPS)):
+        t = 1.0 + i / FPS
+        kpts = person(0.5)
+        kpts[[9, 10], 0] += wave_dx(t) * W   # swinging below the shoulders
+        _, waved = engine.update(result(kpts), W, H, t, False)
+        assert len(waved) == 0
+    engine = GestureEngine()
+    for i in range(int(3 * FPS)):
+        t = 4.0 + i / FPS
+        _, waved = engine.update(result(person(0.5, 0.0)), W, H, t, False)   # raised but still
+        assert len(waved) == 0
+
+def test_engine_tracks_people_by_id():
+    engine = GestureEngine()
+    waved_slots = set()
+    for i in range(int(2 * FPS)):
+        t = 1.0 + i / FPS
+        r = result(person(0.3), person(0.6, wave_dx(t)))
+        r.ids = np.array([7, 3])
+        _, waved = engine.update(r, W, H, t, False)
+        waved_slots.update(int(s) for s in waved)
+    assert len(waved_slots) == 1
+    assert engine.slot_id[waved_slots.pop()] == 3
+
+def test_engine_no_people():
+    engine = GestureEngine()
+    rec, st = recording_state()
+    assert engine_step(engine, result(), W, H, 1.0, False, st) == (None, "", None)
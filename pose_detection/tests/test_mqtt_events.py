@@ -0,0 +1,62 @@
+# EventPublisher: per-event rate caps, coalescing to the newest value, compact payloads
+import json, types
+import pytest
+
+import mqtt_events
+from mqtt_events import EVENT_MIN_INTERVAL, EventPublisher
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, payload, qos=0):
+        self.sent.append((topic, json.loads(payload)))
+
+@pytest.fixture
+def fake_mqtt(monkeypatch):
+    clock = [100.0]
+    client = FakeClient()
+    monkeypatch.setattr(mqtt_events, "client", client)
+    monkeypatch.setattr(mqtt_events, "time", types.SimpleNamespace(time=lambda: clock[0]))
+    return clock, client
+
+def test_rate_cap_coalesces_to_newest(fake_mqtt):
+    clock, client = fake_mqtt
+    pub = EventPublisher()
+    cap = EVENT_MIN_INTERVAL["pos"]
+    pub.publish("pos", "left", 1)
+    clock[0] += cap / 4
+    pub.publish("pos", "center", 1)
+    clock[0] += cap / 4
+    pub.publish("pos", "right", 1)
+    pub.publish("wave", "R", 2)       # separate cap per event type
+    pub.flush()
+    assert [(p["event"], p["value"]) for _, p in client.sent] == [("pos", "left"), ("wave", "R")]
+    clock[0] += cap / 2 + 1e-6
+    pub.flush()
+    assert [p["value"] for _, p in client.sent] == ["left", "R", "right"]
+    assert all(topic == mqtt_events.ONE_TOPIC for topic, _ in client.sent)
+    assert client.sent[0][1] == {"event": "pos", "value": "left", "robot_id": mqtt_events.TARGET_ROBOT_ID}
+    assert "coalesced=1" in pub.report()
+
+def test_wave_cap(fake_mqtt):
+    clock, client = fake_mqtt
+    pub = EventPublisher()
+    for _ in range(5):
+        pub.publish("wave", "R", 2)
+        pub.flush()
+        clock[0] += EVENT_MIN_INTERVAL["wave"] / 8
+    assert len(client.sent) == 1
+    clock[0] += EVENT_MIN_INTERVAL["wave"]
+    pub.flush()
+    pub.flush()
+    assert len(client.sent) == 2   # the four capped waves went out as one
+
+def test_second_wave_topic_is_opt_in(fake_mqtt, monkeypatch):
+    _, client = fake_mqtt
+    EventPublisher().publish("wave", "R", 2)
+    assert [topic for topic, _ in client.sent] == [mqtt_events.ONE_TOPIC]
+    monkeypatch.setattr(mqtt_events, "ALSO_PUBLISH_WAVES_TOPIC", True)
+    client.sent.clear()
+    EventPublisher().publish("wave", "R", 2)
+    assert [topic for topic, _ in client.sent] == [mqtt_events.SECOND_TOPIC, mqtt_events.ONE_TOPIC]
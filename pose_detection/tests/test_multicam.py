@@ -0,0 +1,47 @@
+# ViewFusion: fixed primary view with a lost-person hold, one wave per COOLDOWN across views
+import types
+
+import multicam
+from gestures import COOLDOWN, GestureState
+from multicam import FUSE_HOLD_SEC, ViewFusion, view_quality
+from synthetic import W, Recorder, person
+
+def test_view_quality_prefers_larger_person():
+    assert view_quality(None, W, False) == 0.0
+    assert view_quality(person(0.5, scale=1.5), W, False) > view_quality(person(0.5), W, False) > 0.0
+
+def test_primary_stays_fixed_while_it_sees_the_person():
+    fusion = ViewFusion(2, GestureState(publish=Recorder()))
+    assert fusion.fuse(["left", "right"], [0.1, 0.9], 0.0) == ("left", 0)
+    assert fusion.fuse(["left", "center"], [0.1, 0.9], 5.0) == ("left", 0)
+
+def test_primary_hands_over_after_hold():
+    fusion = ViewFusion(3, GestureState(publish=Recorder()))
+    assert fusion.fuse([None, "right", "center"], [0.0, 0.3, 0.5], 0.0) == (None, 0)
+    assert fusion.fuse([None, "right", "center"], [0.0, 0.3, 0.5], FUSE_HOLD_SEC / 2) == (None, 0)
+    # a momentary return resets the hold
+    assert fusion.fuse(["left", "right", "center"], [0.2, 0.3, 0.5], FUSE_HOLD_SEC * 0.8) == ("left", 0)
+    assert fusion.fuse([None, "right", "center"], [0.0, 0.3, 0.5], FUSE_HOLD_SEC * 1.5) == (None, 0)
+    assert fusion.fuse([None, "right", "center"], [0.0, 0.3, 0.5], FUSE_HOLD_SEC * 2.6) == ("center", 2)
+    # and the new primary is kept when the first view sees the person again
+    assert fusion.fuse(["left", "right", "center"], [0.9, 0.3, 0.5], FUSE_HOLD_SEC * 3) == ("center", 2)
+
+def test_no_handover_while_every_view_is_empty():
+    fusion = ViewFusion(2, GestureState(publish=Recorder()))
+    for t in (0.0, FUSE_HOLD_SEC, 2 * FUSE_HOLD_SEC):
+        assert fusion.fuse([None, None], [0.0, 0.0], t) == (None, 0)
+    assert fusion.fuse([None, "right"], [0.0, 0.4], 2 * FUSE_HOLD_SEC + 0.1) == ("right", 1)
+
+def test_duplicate_waves_are_folded(monkeypatch):
+    clock = [50.0]
+    monkeypatch.setattr(multicam, "time", types.SimpleNamespace(time=lambda: clock[0]))
+    rec = Recorder()
+    fusion = ViewFusion(2, GestureState(publish=rec))
+    fusion.views[0].publish("wave", "R", 2)
+    clock[0] += 0.1
+    fusion.views[1].publish("wave", "R", 2)     # same wave seen by the second camera
+    fusion.views[1].publish("pos", "left", 1)   # per-view pos is not forwarded
+    clock[0] += COOLDOWN + 0.1
+    fusion.views[1].publish("wave", "R", 2)
+    assert rec.values("wave") == ["R", "R"] and rec.values("pos") == []
+    assert fusion.folded_waves == 1
@@ -0,0 +1,44 @@
+# Offline replay: scoring and a synthetic keypoint log through --replay-keypoints
+import json
+
+from offline import label_position, run_offline, score_events
+import pc_publisher
+from synthetic import FPS, write_log
+
+def test_label_position_change_points():
+    changes = [[0.0, "left"], [2.0, None], [2.5, "right"]]
+    assert label_position(changes, -1.0) is None
+    assert label_position(changes, 1.9) == "left"
+    assert label_position(changes, 2.2) is None
+    assert label_position(changes, 9.0) == "right"
+
+def test_score_events():
+    labels = {"waves": [1.0, 3.0], "positions": [[0.0, "left"], [2.0, None], [2.5, "right"]]}
+    score = score_events(labels, [1.2, 5.0], [(0.5, "left"), (1.5, "center"), (2.2, None), (3.0, "right")])
+    assert score["wave_matched"] == 1
+    assert score["wave_precision"] == 0.5 and score["wave_recall"] == 0.5
+    assert score["pos_accuracy"] == 0.75
+    assert score_events({}, [], [])["wave_precision"] == 1.0
+    assert score_events({"waves": [1.0]}, [], [])["wave_precision"] == 0.0
+    assert score_events({"waves": [1.0]}, [], [(0.0, "left")])["pos_accuracy"] is None
+
+def replay(tmp_path, monkeypatch, *flags):
+    log, labels = tmp_path / "clip.npz", tmp_path / "clip.json"
+    write_log(log)
+    labels.write_text(json.dumps({"waves": [3.6], "positions": [[0.0, "left"], [2.0, "right"]]}))
+    monkeypatch.setattr("sys.argv", ["pc_publisher.py", "--replay-keypoints", str(log), "--labels", str(labels),
+                                     "--config", str(tmp_path / "none.json"), *flags])
+    return run_offline(pc_publisher.parse_args())
+
+def test_replay_keypoints_report(tmp_path, monkeypatch):
+    report = replay(tmp_path, monkeypatch)
+    assert report["frames"] == int(6.0 * FPS)
+    assert report["wave_precision"] == 1.0 and report["wave_recall"] == 1.0
+    assert report["pos_accuracy"] == 1.0
+    # initial zone, the change, and keepalives in between
+    assert report["pos_events"] >= 2
+
+def test_replay_keypoints_report_gesture_engine(tmp_path, monkeypatch):
+    report = replay(tmp_path, monkeypatch, "--gesture-engine")
+    assert report["wave_precision"] == 1.0 and report["wave_recall"] == 1.0
+    assert report["pos_accuracy"] == 1.0
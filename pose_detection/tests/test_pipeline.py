@@ -0,0 +1,48 @@
+# SharedFrameRing: slot ownership between the capture writer and inference readers
+import types
+import pytest
+
+from pipeline import SharedFrameRing
+
+NEVER = types.SimpleNamespace(is_set=lambda: False)
+
+@pytest.fixture
+def ring():
+    r = SharedFrameRing(3, 4, 4)
+    yield r
+    r.close()
+
+def _write(ring, value, t):
+    slot = ring.begin_write()
+    ring.frames[slot][:] = value
+    ring.commit(slot, t)
+    return slot
+
+def test_claim_latest_takes_newest_once(ring):
+    _write(ring, 1, 0.0)
+    newest = _write(ring, 2, 1.0)
+    slot, seq, t = ring.claim_latest(NEVER, timeout=0)
+    assert (slot, seq, t) == (newest, 1, 1.0)
+    assert ring.frames[slot][0, 0, 0] == 2
+    assert ring.claim_latest(NEVER, timeout=0) is None   # already claimed
+    ring.release(slot)
+
+def test_copy_rejected_once_slot_is_rewritten(ring):
+    slot0 = _write(ring, 1, 0.0)
+    claimed_slot, seq, t = ring.claim_latest(NEVER, timeout=0)
+    assert (claimed_slot, seq, t) == (slot0, 0, 0.0)
+    ring.release(claimed_slot)
+    assert ring.copy_if_current(slot0, seq)[0, 0, 0] == 1
+    _write(ring, 2, 1.0)
+    _write(ring, 3, 2.0)
+    # the writer wraps back to slot0: mid-write the old seq is already invalid
+    assert ring.begin_write() == slot0
+    assert ring.copy_if_current(slot0, seq) is None
+
+def test_writer_skips_claimed_slots(ring):
+    _write(ring, 1, 0.0)
+    held, _, _ = ring.claim_latest(NEVER, timeout=0)
+    for i in range(6):
+        assert _write(ring, i, 1.0 + i) != held
+    ring.release(held)
+    assert held in {_write(ring, 9, 10.0) for _ in range(3)}
@@ -0,0 +1,91 @@
+# Per-stage lap timing for the single-process loop
+import time, json
+import numpy as np
+
+# ========= Stage timing =========
+# Lap timers around each stage of the single-process loop. A rolling window of the last
+# TIMING_WINDOW frames feeds the overlay summary and the periodic METRICS_TOPIC message;
+# --timing-dump also writes every frame to .csv or .jsonl for offline analysis.
+TIMING_STAGES = ("capture", "preprocess", "track", "infer", "transfer", "gesture", "publish", "draw", "display")
+TIMING_WINDOW = 120         # frames in the rolling summary
+METRICS_INTERVAL_SEC = 5.0
+OVERLAY_STATS_SEC = 1.0     # how often the overlay summary is refreshed
+
+class StageTimer:
+    def __init__(self, dump_path=None):
+        self.index = {name: i for i, name in enumerate(TIMING_STAGES)}
+        self.window = np.zeros((TIMING_WINDOW, len(TIMING_STAGES) + 1))   # last column = total
+        self.frame_t = np.zeros(TIMING_WINDOW)
+        self.row = np.zeros(len(TIMING_STAGES) + 1)
+        self.n = 0
+        self._t0 = self._t = time.perf_counter()
+        self._dump = None
+        self._dump_rows = 0
+        if dump_path:
+            self._dump_jsonl = dump_path.endswith(".jsonl")
+            self._dump = open(dump_path, "w", encoding="utf-8", buffering=1 << 16)
+            if not self._dump_jsonl:
+                self._dump.write("t," + ",".join(TIMING_STAGES) + ",total\n")
+
+    def start(self):
+        self.row[:] = 0.0
+        self._t0 = self._t = time.perf_counter()
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to `stage`"""
+        now = time.perf_counter()
+        self.row[self.index[stage]] += (now - self._t) * 1000.0
+        self._t = now
+
+    def move(self, src, dst, ms):
+        """Re-attribute `ms` already charged to `src` (e.g. transfer inside the model call)"""
+        ms = min(ms, self.row[self.index[src]])
+        self.row[self.index[src]] -= ms
+        self.row[self.index[dst]] += ms
+
+    def end(self):
+        self.row[-1] = (time.perf_counter() - self._t0) * 1000.0
+        slot = self.n % TIMING_WINDOW
+        self.window[slot] = self.row
+        self.frame_t[slot] = time.time()
+        self.n += 1
+        if self._dump:
+            t = self.frame_t[slot]
+            if self._dump_jsonl:
+                record = {"t": round(t, 3), **{name: round(self.row[i], 3) for name, i in self.index.items()},
+                          "total": round(self.row[-1], 3)}
+                self._dump.write(json.dumps(record, separators=(",", ":")) + "\n")
+            else:
+                self._dump.write(f"{t:.3f}," + ",".join(f"{v:.3f}" for v in self.row) + "\n")
+
+    def summary(self):
+        """Rolling fps and per-stage avg/p95 (ms) over the last TIMING_WINDOW frames"""
+        count = min(self.n, TIMING_WINDOW)
+        if count == 0:
+            return {"fps": 0.0, "frames": 0, "stages": {}}
+        rows = self.window[:count]
+        ts = self.frame_t[:count]
+        span = ts.max() - ts.min()
+        avg = rows.mean(axis=0)
+        p95 = np.percentile(rows, 95, axis=0)
+        names = TIMING_STAGES + ("total",)
+        return {
+            "fps": round((count - 1) / span, 1) if span > 0 else 0.0,
+            "frames": count,
+            "stages": {name: {"avg": round(avg[i], 2), "p95": round(p95[i], 2)} for i, name in enumerate(names)},
+        }
+
+    def overlay_lines(self, top=3):
+        summary = self.summary()
+        if not summary["stages"]:
+            return []
+        stages = summary["stages"]
+        total = stages.pop("total")
+        busiest = sorted(stages.items(), key=lambda kv: -kv[1]["avg"])[:top]
+        return [f"{summary['fps']:.1f} fps  {total['avg']:.0f}ms (p95 {total['p95']:.0f})"] + \
+               [f"{name:<10} {v['avg']:6.1f}ms" for name, v in busiest]
+
+    def close(self):
+        if self._dump:
+            self._dump.close()
+            self._dump = None
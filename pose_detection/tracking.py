@@ -0,0 +1,177 @@
+# Keypoint tracking between inferences, ROI crops and the PoseRunner that combines them
+import cv2, time
+import numpy as np
+
+from gestures import classify_position, first_person, shoulders_visible
+
+# ========= Keypoint tracking between inferences =========
+# --infer-every N runs the model on every Nth frame. In between, the six keypoints
+# the gesture logic reads are propagated with pyramidal Lucas-Kanade optical flow.
+# A frame is re-inferred early if tracking loses points or the shoulders.
+TRACKED_KEYPOINTS = [5, 6, 9, 10, 11, 12]   # shoulders, wrists, hips (same set in both mirror modes)
+TRACK_SCALE = 0.5           # optical flow runs on a downscaled grayscale frame
+TRACK_MIN_POINTS = 5        # fewer surviving keypoints than this -> infer now
+TRACK_MAX_ERR = 20.0        # LK per-point error above which a point counts as lost
+TRACK_CONF_DECAY = 0.95     # tracked confidence decays per frame since the last inference
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+class KeypointTracker:
+    """Carries the last inferred keypoints forward frame to frame with optical flow"""
+    def __init__(self, infer_every, scale=TRACK_SCALE):
+        self.infer_every = max(1, infer_every)
+        self.scale = scale
+        self.kpts = None
+        self.prev_gray = None
+        self.since_infer = 0
+        self.lost = 0   # tracking gave up and forced an early inference
+
+    def prepare(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def due(self):
+        return self.kpts is None or self.since_infer + 1 >= self.infer_every
+
+    def reset(self, gray, kpts):
+        """Called after every inference with its result (None = nobody detected)"""
+        self.kpts = kpts.copy() if kpts is not None else None
+        self.prev_gray = gray
+        self.since_infer = 0
+
+    def track(self, gray, mirrored):
+        """Propagate to this frame -> (17, 3) keypoints with only the tracked rows set, or None"""
+        if self.kpts is None or self.prev_gray is None:
+            return None
+        prev_pts = (self.kpts[TRACKED_KEYPOINTS, :2] * self.scale).astype(np.float32).reshape(-1, 1, 2)
+        next_pts, status, err = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, prev_pts, None, **LK_PARAMS)
+        good = (status.reshape(-1) == 1) & (err.reshape(-1) < TRACK_MAX_ERR)
+        tracked = np.zeros_like(self.kpts)
+        tracked[TRACKED_KEYPOINTS, :2] = next_pts.reshape(-1, 2) / self.scale
+        tracked[TRACKED_KEYPOINTS, 2] = np.where(good, self.kpts[TRACKED_KEYPOINTS, 2] * TRACK_CONF_DECAY, 0.0)
+        if good.sum() < TRACK_MIN_POINTS or not shoulders_visible(tracked, mirrored):
+            self.lost += 1
+            self.kpts = None
+            return None
+        self.kpts, self.prev_gray = tracked, gray
+        self.since_infer += 1
+        return tracked
+
+class KeypointEval:
+    """
+    Scores cheaper keypoints (tracked, ROI crop) against full-frame inference on the same frame.
+    err is the per-keypoint distance normalized by frame size; miss = reference found a person, candidate did not.
+    """
+    def __init__(self, label):
+        self.label = label
+        self.n, self.err_sum, self.err_max, self.pos_agree, self.misses = 0, 0.0, 0.0, 0, 0
+
+    def add(self, tracked, inferred, w, h, mirrored):
+        if inferred is None:
+            return
+        if tracked is None:
+            self.misses += 1
+            return
+        err = np.linalg.norm((tracked[TRACKED_KEYPOINTS, :2] - inferred[TRACKED_KEYPOINTS, :2]) / (w, h), axis=1)
+        self.n += 1
+        self.err_sum += float(err.mean())
+        self.err_max = max(self.err_max, float(err.max()))
+        _, pos_t = classify_position(tracked, w, mirrored)
+        _, pos_i = classify_position(inferred, w, mirrored)
+        self.pos_agree += int(pos_t == pos_i)
+
+    def report(self):
+        if not self.n:
+            return f"{self.label}_eval n=0 miss={self.misses}"
+        text = (f"{self.label}_eval n={self.n} err avg={self.err_sum / self.n:.3f} max={self.err_max:.3f} "
+                f"pos_agree={self.pos_agree / self.n:.0%} miss={self.misses}")
+        self.n, self.err_sum, self.err_max, self.pos_agree, self.misses = 0, 0.0, 0.0, 0, 0
+        return text
+
+# ========= Region of interest =========
+# --roi crops around the last detected person (box + margin) and infers the crop at ROI_IMGSZ.
+# It falls back to a full-frame search when the person is lost, and every ROI_REFRESH_SEC
+# so a better-placed person can still take over. Keypoints are mapped back to full-frame
+# pixels, so analyze_pose and the CENTER_*_RATIO zones see the same coordinates as before.
+FULL_IMGSZ = 640
+ROI_IMGSZ = 320             # must be a multiple of 32
+ROI_MARGIN = 0.35           # added on each side, as a fraction of the box size
+ROI_MIN_SIZE = 192          # px, so a small box still leaves room to move
+ROI_REFRESH_SEC = 2.0
+
+class RoiSelector:
+    def __init__(self, imgsz=ROI_IMGSZ, full_imgsz=FULL_IMGSZ):
+        self.imgsz = imgsz
+        self.full_imgsz = full_imgsz
+        self.box = None
+        self.last_full = 0.0
+        self.lost = 0
+        self.roi_n, self.roi_ms_sum, self.full_n, self.full_ms_sum = 0, 0.0, 0, 0.0
+
+    def select(self, frame, now):
+        """-> (image to infer, (x offset, y offset) or None for full frame, imgsz)"""
+        if self.box is None or now - self.last_full >= ROI_REFRESH_SEC:
+            self.last_full = now
+            return frame, None, self.full_imgsz
+        h, w = frame.shape[:2]
+        x1, y1, x2, y2 = self.box
+        bw, bh = x2 - x1, y2 - y1
+        pad_x = max(bw * ROI_MARGIN, (ROI_MIN_SIZE - bw) / 2)
+        pad_y = max(bh * ROI_MARGIN, (ROI_MIN_SIZE - bh) / 2)
+        x1, y1 = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+        x2, y2 = min(w, int(x2 + pad_x)), min(h, int(y2 + pad_y))
+        return np.ascontiguousarray(frame[y1:y2, x1:x2]), (x1, y1), self.imgsz
+
+    def update(self, results, kpts, offset, infer_ms):
+        """Map the crop's keypoints back to the full frame and remember the box for the next frame"""
+        if offset is None:
+            self.full_n, self.full_ms_sum = self.full_n + 1, self.full_ms_sum + infer_ms
+            ox, oy = 0, 0
+        else:
+            self.roi_n, self.roi_ms_sum = self.roi_n + 1, self.roi_ms_sum + infer_ms
+            ox, oy = offset
+        if kpts is None:
+            if offset is not None:
+                self.lost += 1
+            self.box = None
+            return None
+        kpts = kpts.copy()
+        kpts[:, :2] += (ox, oy)
+        self.box = results.boxes[0] + (ox, oy, ox, oy)
+        return kpts
+
+    def report(self):
+        text = (f"roi n={self.roi_n} avg={self.roi_ms_sum / max(self.roi_n, 1):.1f}ms "
+                f"full n={self.full_n} avg={self.full_ms_sum / max(self.full_n, 1):.1f}ms lost={self.lost}")
+        self.roi_n, self.roi_ms_sum, self.full_n, self.full_ms_sum = 0, 0.0, 0, 0.0
+        return text
+
+class PoseRunner:
+    """One model call for a frame -> (results, kpts), optionally on the ROI crop"""
+    def __init__(self, model, roi=None, evaluator=None, imgsz=None):
+        self.model = model
+        self.roi = roi
+        self.evaluator = evaluator
+        self.imgsz = imgsz
+
+    def __call__(self, frame, mirrored, now):
+        if self.roi is None:
+            results = self.model.predict(frame, self.imgsz)
+            return results, first_person(results, mirrored)
+        image, offset, imgsz = self.roi.select(frame, now)
+        t0 = time.perf_counter()
+        results = self.model.predict(image, imgsz)
+        infer_ms = (time.perf_counter() - t0) * 1000.0
+        kpts = self.roi.update(results, first_person(results, mirrored), offset, infer_ms)
+        if offset is None:
+            return results, kpts
+        if self.evaluator:
+            h, w = frame.shape[:2]
+            t0 = time.perf_counter()
+            reference = first_person(self.model.predict(frame, self.roi.full_imgsz), mirrored)
+            self.roi.full_n, self.roi.full_ms_sum = self.roi.full_n + 1, self.roi.full_ms_sum + (time.perf_counter() - t0) * 1000.0
+            self.evaluator.add(kpts, reference, w, h, mirrored)
+        # results are in crop coordinates; the display draws from the mapped keypoints instead
+        return None, kpts